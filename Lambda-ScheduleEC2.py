@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+################################################################################
+# Copyright (c) 2025 Kazuhiro Tsuzuki
+# This software is released under the MIT License see LICENSE.txt
+# Overview : Start / Stop AWS EC2 Instances by their Schedule tag
+#
+#-------------------------------------------------------------------------------
+# Author: Isaac Factory (sir.isaac.factory@gmail.com)
+# Repository: https://github.com/SirIsaacFactory/EC2-StartStop
+#
+################################################################################
+
+################################################################################
+# History
+#-------------------------------------------------------------------------------
+# 2026/10/18: Initially created
+################################################################################
+__VERSION__ = "1.00"
+
+
+################################################################################
+# Libraries
+################################################################################
+from aws_functions import Schedule
+from aws_functions import Transition
+
+
+################################################################################
+# Init
+################################################################################
+# loads boto3 in the init phase when AWS_CONTROL_PREWARM=1
+Transition.prewarm()
+
+
+################################################################################
+# Main
+################################################################################
+def run(event, context):
+    return Schedule.handle(event)
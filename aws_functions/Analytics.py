@@ -0,0 +1,395 @@
+# -*- coding: utf-8 -*-
+################################################################################
+# Columnar fleet analytics
+#-------------------------------------------------------------------------------
+# Requires numpy, imported on the first Fleet. A Fleet holds one array per
+# field instead of one object per instance: the categorical fields (state,
+# availability zone, VPC, subnet, platform, instance type and the tags) are
+# int32 codes into a list of categories, so that filters are boolean masks
+# and group-bys are a bincount over the codes.
+#
+#     _, EC2InstanceList = ListEC2.getEC2Instances(Filters, Fields=Analytics.FIELDS)
+#     fleet = Analytics.Fleet(EC2InstanceList)
+#     fleet.countBy("State", "AvailabilityZone")
+#     stopped = fleet.filter(fleet.isIn("State", "stopped"))
+#     stopped.stoppedHours().sum()
+#     fleet.tagCompliance(["env", "team"])
+################################################################################
+import datetime
+import re
+import time
+
+from . import Projection
+from .EC2Instance import EC2Instance
+from .log import logger
+
+
+################################################################################
+# variables
+################################################################################
+NA = Projection.NA
+# Fields to extract for every column of Fleet
+FIELDS = Projection.FIELDS + ("InstanceType", "StateTransitionReason")
+CATEGORICALS = ("State", "AvailabilityZone", "VpcId", "SubnetId", "Platform", "InstanceType")
+MISSING = -1
+# e.g. "User initiated (2025-02-22 08:00:00 GMT)"
+_TRANSITION_TIME = re.compile(r"\((\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}) GMT\)")
+_np = None
+
+
+def _numpy():
+    global _np
+    if _np is None:
+        import numpy
+        _np = numpy
+    return _np
+
+
+################################################################################
+# Categorical
+################################################################################
+class Categorical:
+    """
+    Categorical column
+
+    Attributes
+    ------------------------------------
+    codes : numpy.ndarray
+        int32 index into categories per instance, MISSING when there is none
+    categories : list
+        Distinct values
+    """
+
+    __slots__ = ("codes", "categories", "_lookup")
+
+    def __init__(self, codes, categories):
+        self.codes = codes
+        self.categories = categories
+        self._lookup = None
+
+    @classmethod
+    def encode(cls, values, Missing=(None,)):
+        """
+        Encode values, the ones in Missing get MISSING
+        """
+        np = _numpy()
+        index = {}
+        codes = np.fromiter(
+            (MISSING if value in Missing else index.setdefault(value, len(index)) for value in values),
+            dtype=np.int32,
+            count=len(values)
+        )
+        return cls(codes, list(index))
+
+    def code(self, value):
+        """
+        Code of a value, None when it is not a category
+        """
+        if self._lookup is None:
+            self._lookup = {value: n for n, value in enumerate(self.categories)}
+        return self._lookup.get(value)
+
+    def isIn(self, *Values):
+        """
+        Boolean mask of the instances having one of Values
+        """
+        np = _numpy()
+        codes = [c for c in map(self.code, Values) if c is not None]
+        return np.isin(self.codes, np.array(codes, dtype=np.int32))
+
+    def take(self, mask):
+        """
+        Categorical of the masked instances, sharing the categories
+        """
+        return Categorical(self.codes[mask], self.categories)
+
+    def counts(self):
+        """
+        {value: count}, the missing ones are not counted
+        """
+        np = _numpy()
+        present = self.codes[self.codes != MISSING]
+        counts = np.bincount(present, minlength=len(self.categories))
+        return {self.categories[n]: int(c) for n, c in enumerate(counts) if c}
+
+    def values(self):
+        """
+        Decoded values, None for the missing ones
+        """
+        return [self.categories[c] if c != MISSING else None for c in self.codes.tolist()]
+
+
+################################################################################
+# Fleet
+################################################################################
+class Fleet:
+    """
+    Columnar arrays of a fleet
+
+    Parameters
+    ------------------------------------
+    EC2InstanceList : list
+        getEC2Instances / extractEC2Info result (EC2Instance or dict),
+        extracted with FIELDS for the InstanceType and stopped hours
+    Now : float
+        Epoch seconds the stopped hours are counted to, now when None
+
+    Attributes
+    ------------------------------------
+    InstanceIds : numpy.ndarray
+        EC2 Instance Ids
+    columns : dict
+        Categorical per name of CATEGORICALS
+    StoppedSince : numpy.ndarray
+        Epoch seconds of the last state transition of the stopped
+        instances, NaN for the others or when unknown
+    """
+
+    def __init__(self, EC2InstanceList=(), Now=None, _columns=None):
+        np = _numpy()
+        self.Now = time.time() if Now is None else Now
+        if _columns is not None:
+            self.InstanceIds, self.columns, self.StoppedSince, self._tagDicts, self._tags = _columns
+            return
+
+        instances = [
+            i if isinstance(i, EC2Instance) else EC2Instance.fromDict(i)
+            for i in EC2InstanceList
+        ]
+        # attributes are read directly, EC2Instance.get costs more than the rest
+        extras = [i.Extra or {} for i in instances]
+        self.InstanceIds = np.array([i.InstanceId for i in instances], dtype=object)
+        self.columns = {
+            "State": Categorical.encode([i.stateName for i in instances], (NA,)),
+            "AvailabilityZone": Categorical.encode([i.availabilityZone for i in instances], (NA,)),
+            "VpcId": Categorical.encode([i.VpcId for i in instances], (NA,)),
+            "SubnetId": Categorical.encode([i.SubnetId for i in instances], (NA,)),
+            "Platform": Categorical.encode([i.PlatformDetails for i in instances], (NA,)),
+            "InstanceType": Categorical.encode([e.get("InstanceType", NA) for e in extras], (NA,)),
+        }
+        stopped = self.columns["State"].code("stopped")
+        parsed = {}
+        self.StoppedSince = np.fromiter(
+            (_transitionTime(e.get("StateTransitionReason"), parsed) if c == stopped else np.nan
+             for c, e in zip(self.columns["State"].codes.tolist(), extras)),
+            dtype=np.float64,
+            count=len(instances)
+        )
+        self._tagDicts = [i.TagDict for i in instances]
+        # tag key -> Categorical, made on the first use of the key
+        self._tags = {}
+        logger.debug("Fleet of %s instance(s)", len(instances))
+
+    def __len__(self):
+        return len(self.InstanceIds)
+
+    #-------------------------------------------------------
+    # Columns
+    #-------------------------------------------------------
+    def column(self, Name):
+        """
+        Categorical of a name of CATEGORICALS, or "tag:Key" for a tag
+        """
+        if Name.startswith("tag:"):
+            return self.tag(Name[4:])
+        return self.columns[Name]
+
+    def tag(self, Key):
+        """
+        Categorical of the tag values, MISSING when the instance doesn't have it
+        """
+        column = self._tags.get(Key)
+        if column is None:
+            column = self._tags[Key] = Categorical.encode([d.get(Key) for d in self._tagDicts])
+        return column
+
+    def stoppedHours(self):
+        """
+        Hours since each stopped instance stopped, NaN for the others
+        """
+        return (self.Now - self.StoppedSince) / 3600
+
+    #-------------------------------------------------------
+    # Filter
+    #-------------------------------------------------------
+    def isIn(self, Name, *Values):
+        """
+        Boolean mask of the instances whose column Name has one of Values
+        """
+        return self.column(Name).isIn(*Values)
+
+    def hasTag(self, Key):
+        """
+        Boolean mask of the instances having the tag Key
+        """
+        return self.tag(Key).codes != MISSING
+
+    def filter(self, mask):
+        """
+        Fleet of the masked instances
+
+        Parameters
+        ------------------------------------
+        mask : numpy.ndarray
+            Boolean mask, e.g. fleet.isIn("State", "stopped") & fleet.hasTag("env")
+        """
+        columns = (
+            self.InstanceIds[mask],
+            {name: column.take(mask) for name, column in self.columns.items()},
+            self.StoppedSince[mask],
+            [d for d, m in zip(self._tagDicts, mask.tolist()) if m],
+            {key: column.take(mask) for key, column in self._tags.items()},
+        )
+        return Fleet(Now=self.Now, _columns=columns)
+
+    #-------------------------------------------------------
+    # Group By
+    #-------------------------------------------------------
+    def groupBy(self, *Names, Values=None):
+        """
+        Group the instances by columns
+
+        Parameters
+        ------------------------------------
+        Names : str
+            Column names (see column)
+        Values : numpy.ndarray
+            Values summed per group, the instance count when None
+            NaN values are skipped
+
+        Returns
+        ------------------------------------
+        groups : dict
+            {(value of Names[0], value of Names[1], ...): count or sum}
+            missing values are None
+        """
+        np = _numpy()
+        columns = [self.column(name) for name in Names]
+        if len(self) == 0 or not columns:
+            return {}
+        codes = [c.codes for c in columns]
+        weights = None
+        if Values is not None:
+            Values = np.asarray(Values, dtype=np.float64)
+            valid = ~np.isnan(Values)
+            codes = [code[valid] for code in codes]
+            weights = Values[valid]
+        # combine the codes column by column, numbering the groups seen after
+        # each one, so that the index stays below instances x categories
+        # however many columns; MISSING is shifted to 0
+        inverse = np.zeros(len(codes[0]), dtype=np.int64)
+        for c, code in zip(columns, codes):
+            combined = inverse * (len(c.categories) + 1) + (code.astype(np.int64) + 1)
+            _, first, inverse = np.unique(combined, return_index=True, return_inverse=True)
+        sums = np.bincount(inverse, weights=weights)
+        groups = {}
+        # the key of a group is decoded from its first instance
+        for group, row in enumerate(first.tolist()):
+            key = tuple(c.categories[code[row]] if code[row] != MISSING else None for c, code in zip(columns, codes))
+            groups[key] = sums[group].item()
+        return groups
+
+    def countBy(self, *Names):
+        """
+        Instance count per group, keyed by the value itself for one column
+        """
+        groups = self.groupBy(*Names)
+        if len(Names) == 1:
+            return {key[0]: int(count) for key, count in groups.items()}
+        return {key: int(count) for key, count in groups.items()}
+
+    #-------------------------------------------------------
+    # Aggregates
+    #-------------------------------------------------------
+    def tagCompliance(self, RequiredKeys, Allowed=None):
+        """
+        Rate of the instances having every required tag
+
+        Parameters
+        ------------------------------------
+        RequiredKeys : list
+            Tag keys every instance must have
+        Allowed : dict
+            {Key: [values]} allowed values of some of the keys
+
+        Returns
+        ------------------------------------
+        result : dict
+            {
+                "Rate": 0.97,
+                "Compliant": 970,
+                "Missing": {Key: count of the instances without it},
+                "Invalid": {Key: count of the instances with another value},
+                "NonCompliantIds": [InstanceId, ...]
+            }
+        """
+        np = _numpy()
+        Allowed = Allowed or {}
+        compliant = np.ones(len(self), dtype=bool)
+        missing = {}
+        invalid = {}
+        for key in RequiredKeys:
+            present = self.hasTag(key)
+            missing[key] = int((~present).sum())
+            ok = present
+            if key in Allowed:
+                valid = self.tag(key).isIn(*Allowed[key])
+                invalid[key] = int((present & ~valid).sum())
+                ok = valid
+            compliant &= ok
+        count = int(compliant.sum())
+        return {
+            "Rate": count / len(self) if len(self) else 1.0,
+            "Compliant": count,
+            "Missing": missing,
+            "Invalid": invalid,
+            "NonCompliantIds": self.InstanceIds[~compliant].tolist(),
+        }
+
+    def summary(self, By=("State", "AvailabilityZone", "Platform")):
+        """
+        Fleet-wide aggregates
+
+        Returns
+        ------------------------------------
+        summary : dict
+            {
+                "Count": 50000,
+                "By": {"State": {"running": 25000, ...}, ...},
+                "StoppedHours": {"Count": 25000, "Total": 1.2e7, "Mean": 480.0, "Max": 600.0}
+            }
+        """
+        np = _numpy()
+        hours = self.stoppedHours()
+        known = hours[~np.isnan(hours)]
+        return {
+            "Count": len(self),
+            "By": {name: self.countBy(name) for name in By},
+            "StoppedHours": {
+                "Count": int(known.size),
+                "Total": round(float(known.sum()), 3),
+                "Mean": round(float(known.mean()), 3) if known.size else None,
+                "Max": round(float(known.max()), 3) if known.size else None,
+            },
+        }
+
+
+################################################################################
+# StateTransitionReason
+################################################################################
+def _transitionTime(reason, parsed):
+    """
+    Epoch seconds of a StateTransitionReason, NaN when it has no time
+    parsed caches the results, the same reasons repeat across a fleet
+    """
+
+    seconds = parsed.get(reason)
+    if seconds is not None:
+        return seconds
+    match = _TRANSITION_TIME.search(reason) if type(reason) == str else None
+    if match is None:
+        seconds = float("nan")
+    else:
+        seconds = datetime.datetime.fromisoformat(match.group(1)).replace(tzinfo=datetime.timezone.utc).timestamp()
+    parsed[reason] = seconds
+    return seconds
@@ -0,0 +1,435 @@
+# -*- coding: utf-8 -*-
+################################################################################
+# asyncio API of ListEC2 / ControlEC2 / VerifyEC2 / WaitEC2
+#-------------------------------------------------------------------------------
+# Requires aiobotocore. One client per (region, profile) is shared by every
+# coroutine of the event loop, and its connection pool is sized by
+# _MAX_POOL_CONNECTIONS, so hundreds of calls run concurrently on one thread.
+# Each event loop has its own clients, e.g. successive asyncio.run calls, and
+# closeClients closes the ones of the running loop.
+#
+#     async def main():
+#         try:
+#             results = await AsyncEC2.gather(
+#                 [AsyncEC2.getEC2Instances(Filters) for Filters in FiltersList],
+#                 Limit=20
+#             )
+#         finally:
+#             await AsyncEC2.closeClients()
+################################################################################
+import asyncio
+import contextlib
+import random
+import time
+import traceback
+import weakref
+
+from . import __VERSION__
+from . import Status
+from . import BatchEC2
+from . import ClientPool
+from . import ControlEC2
+from . import InventoryCache
+from . import ListEC2
+from . import Projection
+from . import RateLimit
+from . import VerifyEC2
+from . import WaitEC2
+from .log import logger, LazyRepr
+
+
+################################################################################
+# variables
+################################################################################
+_MAX_RESULTS = ListEC2._MAX_RESULTS
+_MAX_POOL_CONNECTIONS = 100
+_LIMIT = 20
+# event loop -> _LoopClients, an asyncio.Lock and the connections of a client
+# belong to the loop they were made in, and asyncio.run makes a new one
+_loops = weakref.WeakKeyDictionary()
+# (region, profile) -> client injected by setClient, for every loop
+_injected = {}
+
+
+################################################################################
+# Client
+################################################################################
+class _LoopClients:
+    """
+    Shared clients of one event loop
+    """
+
+    def __init__(self):
+        # (region, profile) -> client
+        self.clients = {}
+        self.exitStack = contextlib.AsyncExitStack()
+        self.lock = asyncio.Lock()
+
+
+def _loopClients():
+    loop = asyncio.get_running_loop()
+    state = _loops.get(loop)
+    if state is None:
+        state = _loops[loop] = _LoopClients()
+    return state
+
+
+async def getClient(Region=None, Profile=None):
+    """
+    Get the shared aiobotocore EC2 client of the region and profile in the
+    running event loop
+
+    Parameters
+    ------------------------------------
+    Region : str
+        AWS region name, None means the default region
+    Profile : str
+        Credentials profile name, or role ARN assumed through ClientPool
+        None means the default credentials chain
+
+    Returns
+    ------------------------------------
+    client : aiobotocore client
+        EC2 client
+    """
+
+    key = (Region, Profile)
+    if key in _injected:
+        return _injected[key]
+    state = _loopClients()
+    client = state.clients.get(key)
+    # the client of a role holds frozen credentials, so it is made again
+    # with the new ones when they are about to expire
+    if client is not None and not ClientPool._expiring(Profile):
+        return client
+
+    async with state.lock:
+        client = state.clients.get(key)
+        if client is not None and not ClientPool._expiring(Profile):
+            return client
+
+        from aiobotocore.config import AioConfig
+        from aiobotocore.session import get_session
+
+        logger.debug("create async client: key = %s", key)
+        session = get_session()
+        params = {
+            "region_name": Region,
+            # the blocking token bucket of RateLimit can't run in the event loop,
+            # so use botocore's adaptive mode with the same number of attempts
+            "config": AioConfig(
+                max_pool_connections=_MAX_POOL_CONNECTIONS,
+                retries={"mode": "adaptive", "total_max_attempts": RateLimit._MAX_ATTEMPTS}
+            )
+        }
+        if Profile is not None and Profile.startswith(ClientPool._ROLE_PREFIX):
+            # reuse the role session of ClientPool for the credentials,
+            # assume_role blocks so it runs off the event loop
+            roleSession = await asyncio.to_thread(ClientPool.getSession, Profile)
+            credentials = roleSession.get_credentials().get_frozen_credentials()
+            params["aws_access_key_id"] = credentials.access_key
+            params["aws_secret_access_key"] = credentials.secret_key
+            params["aws_session_token"] = credentials.token
+        elif Profile is not None:
+            session.set_config_variable("profile", Profile)
+
+        # a previous client of the key stays open for the calls still using it
+        # and is closed by closeClients
+        client = await state.exitStack.enter_async_context(session.create_client("ec2", **params))
+        state.clients[key] = client
+    return client
+
+
+def setClient(client, Region=None, Profile=None):
+    """
+    Inject a client to be returned by getClient in every event loop, for tests
+    """
+
+    _injected[(Region, Profile)] = client
+
+
+def clearClients():
+    """
+    Drop the clients injected by setClient
+    """
+
+    _injected.clear()
+
+
+async def closeClients():
+    """
+    Close every shared client of the running event loop and its connection
+    pool, the injected ones are left to their owner
+    """
+
+    state = _loops.pop(asyncio.get_running_loop(), None)
+    if state is not None:
+        state.clients.clear()
+        await state.exitStack.aclose()
+
+
+################################################################################
+# gather
+################################################################################
+async def gather(coros, Limit=_LIMIT):
+    """
+    asyncio.gather with at most Limit coroutines running at a time
+
+    Parameters
+    ------------------------------------
+    coros : list
+        Coroutines
+    Limit : int
+        The number of coroutines run concurrently
+
+    Returns
+    ------------------------------------
+    results : list
+        Results in the order of coros
+    """
+
+    semaphore = asyncio.Semaphore(Limit)
+
+    async def bounded(coro):
+        async with semaphore:
+            return await coro
+
+    return await asyncio.gather(*(bounded(coro) for coro in coros))
+
+
+################################################################################
+# iterEC2Instances
+################################################################################
+async def iterEC2Instances(Filters, PageSize=_MAX_RESULTS, Region=None, Profile=None,
+                           Fields=Projection.FIELDS, AsDict=False):
+    """
+    Async version of ListEC2.iterEC2Instances
+
+    Yields
+    ------------------------------------
+    status: int
+        Return code
+    EC2InstanceList : list
+        EC2 information of one page, None when status is fail
+    """
+
+    logger.debug("start")
+    logger.debug("__VERSION__ = %s", __VERSION__)
+    logger.debug("Filters = %s", Filters)
+
+    status = Status()
+    NextToken = None
+    while True:
+        params = {
+            "Filters": Filters,
+            "MaxResults": PageSize
+        }
+        if NextToken is not None:
+            params["NextToken"] = NextToken
+        try:
+            client = await getClient(Region, Profile)
+            response = await client.describe_instances(**params)
+            logger.debug("response = %s", LazyRepr(response))
+        except Exception as e:
+            logger.error(f"Exception: {e}\n{traceback.format_exc()}")
+            logger.debug("end")
+            yield status.fail, None
+            return
+
+        NextToken = response.get("NextToken")
+        _, EC2InstanceList = ListEC2.extractEC2Info(response, Fields, AsDict, Consume=True)
+        response = None
+        yield status.success, EC2InstanceList
+
+        if not NextToken:
+            break
+    logger.debug("end")
+
+
+################################################################################
+# getEC2Instances
+################################################################################
+async def getEC2Instances(Filters, MaxResults=_MAX_RESULTS, Region=None, Profile=None,
+                          Fields=Projection.FIELDS, AsDict=False):
+    """
+    Async version of ListEC2.getEC2Instances
+
+    Returns
+    ------------------------------------
+    status: int
+        Return code
+    EC2InstanceList : list
+        EC2 information
+    """
+
+    status = Status()
+    EC2InstanceList = []
+    async for ret, EC2InstancePage in iterEC2Instances(Filters, MaxResults, Region, Profile, Fields, AsDict):
+        if ret != status.success:
+            return status.fail, None
+        EC2InstanceList += EC2InstancePage
+    return status.success, EC2InstanceList
+
+
+################################################################################
+# start / stop
+################################################################################
+async def control(Action, InstanceIds, DryRun=False, Region=None, Profile=None):
+    """
+    Async version of ControlEC2.start / ControlEC2.stop
+
+    Parameters
+    ------------------------------------
+    Action : str
+        "start" or "stop"
+    InstanceIds : list
+        EC2 Instance Ids
+    DryRun : boolean
+    Region : str
+        AWS region name, None means the default region
+    Profile : str
+        Credentials profile name, None means the default credentials
+
+    Returns
+    ------------------------------------
+    status: int
+        Return code
+    response : dict
+        API response, None when failed
+    """
+
+    logger.debug("start")
+    logger.debug("Action = %s, InstanceIds = %s", Action, LazyRepr(InstanceIds))
+
+    status = Status()
+    method, _ = ControlEC2._ACTIONS[Action]
+    try:
+        client = await getClient(Region, Profile)
+        response = await getattr(client, method)(
+            InstanceIds = InstanceIds,
+            DryRun = DryRun
+        )
+    except Exception as e:
+        logger.error(f"Exception: {e}\n{traceback.format_exc()}")
+        logger.debug("end")
+        return status.fail, None
+    finally:
+        if not DryRun:
+            InventoryCache.invalidate(InstanceIds)
+
+    logger.debug("end")
+    return status.success, response
+
+
+async def start(InstanceIds, DryRun=False, Region=None, Profile=None):
+    """
+    Start EC2 instances (see control)
+    """
+
+    return await control("start", InstanceIds, DryRun, Region, Profile)
+
+
+async def stop(InstanceIds, DryRun=False, Region=None, Profile=None):
+    """
+    Stop EC2 instances (see control)
+    """
+
+    return await control("stop", InstanceIds, DryRun, Region, Profile)
+
+
+################################################################################
+# Verification
+################################################################################
+async def getInstanceStates(InstanceIds, Region=None, Profile=None):
+    """
+    Async version of VerifyEC2.getInstanceStates
+    """
+
+    status = Status()
+    ret = status.success
+    states = {}
+    try:
+        client = await getClient(Region, Profile)
+    except Exception as e:
+        logger.error(f"Exception: {e}\n{traceback.format_exc()}")
+        return status.fail, states
+    size = VerifyEC2._ID_CHUNK_SIZE
+    chunks = [InstanceIds[i:i + size] for i in range(0, len(InstanceIds), size)]
+    while chunks:
+        chunk = chunks.pop()
+        try:
+            response = await client.describe_instance_status(
+                InstanceIds = chunk,
+                IncludeAllInstances = True
+            )
+        except Exception as e:
+            code = BatchEC2._errorCode(e)
+            if code in VerifyEC2._BISECT_ERRORS and len(chunk) > 1:
+                half = len(chunk) // 2
+                chunks += [chunk[:half], chunk[half:]]
+            elif code in VerifyEC2._BISECT_ERRORS:
+                logger.warning(f"{code}: {chunk[0]}")
+                states[chunk[0]] = VerifyEC2.NOT_FOUND
+            else:
+                logger.warning(f"Exception: {e}\n{traceback.format_exc()}")
+                ret = status.fail
+            continue
+        for instanceStatus in response["InstanceStatuses"]:
+            states[instanceStatus["InstanceId"]] = instanceStatus["InstanceState"]["Name"]
+    return ret, states
+
+
+async def verify(InstanceIds, TargetState, Region=None, Profile=None):
+    """
+    Async version of VerifyEC2.verify
+    """
+
+    status = Status()
+    _, states = await getInstanceStates(InstanceIds, Region, Profile)
+    result = VerifyEC2.convergence(InstanceIds, states, TargetState)
+    if all(item["Converged"] for item in result.values()):
+        return status.success, result
+    return status.fail, result
+
+
+async def waitForState(InstanceIds, TargetState, Timeout=WaitEC2._TIMEOUT, Delay=WaitEC2._DELAY,
+                       MaxDelay=WaitEC2._MAX_DELAY, Region=None, Profile=None):
+    """
+    Async version of WaitEC2.waitForState
+    The event loop keeps running other coroutines while waiting
+
+    Returns
+    ------------------------------------
+    status: int
+        success when all instances reached the target state, fail when not
+    states : dict
+        Last known state name per EC2 Instance Id
+    """
+
+    status = Status()
+    deadline = time.monotonic() + Timeout
+    states = {InstanceId: None for InstanceId in InstanceIds}
+    waiting = list(states)
+    attempt = 0
+
+    while waiting:
+        ret, current = await getInstanceStates(waiting, Region, Profile)
+        states.update(current)
+        if ret != status.success:
+            logger.error("Failed to get the states, stop waiting")
+            break
+        waiting = [InstanceId for InstanceId in waiting if not WaitEC2.isSettled(states[InstanceId], TargetState)]
+        if not waiting:
+            break
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            logger.warning(f"Timed out: {waiting}")
+            break
+        backoff = min(MaxDelay, Delay * (2 ** attempt))
+        await asyncio.sleep(min(remaining, random.uniform(Delay / 2, backoff)))
+        attempt += 1
+
+    if all(state == TargetState for state in states.values()):
+        return status.success, states
+    return status.fail, states
@@ -0,0 +1,295 @@
+# -*- coding: utf-8 -*-
+import random
+import time
+import traceback
+from concurrent.futures import (
+    ThreadPoolExecutor,
+    wait,
+    FIRST_COMPLETED
+)
+
+from . import __VERSION__
+from . import Status
+from . import ClientPool
+from . import ControlEC2
+from . import RateLimit
+from .log import logger
+
+
+################################################################################
+# variables
+################################################################################
+_CHUNK_SIZE = 50
+_MAX_WORKERS = 8
+_RETRIES = 3
+_RETRY_DELAY = 1.0
+NA = "NA"
+# Errors worth retrying the same chunk for instead of bisecting it,
+# when the client doesn't retry them itself (RateLimit)
+_RETRYABLE_ERRORS = {
+    "RequestLimitExceeded",
+    "Throttling",
+    "ThrottlingException",
+    "ServiceUnavailable",
+    "Unavailable",
+    "InternalError",
+}
+# Errors caused by some of the ids of the chunk, worth bisecting it for
+# Any other error (credentials, permissions, parameters) fails the chunk as it is
+_BISECT_ERRORS = {
+    "InvalidInstanceID.NotFound",
+    "InvalidInstanceID.Malformed",
+    "IncorrectInstanceState",
+    "UnsupportedOperation",
+}
+_DRY_RUN_OK = "DryRunOperation"
+
+
+################################################################################
+# _errorCode
+################################################################################
+def _errorCode(e):
+    """
+    Get the AWS error code of the exception, or the exception class name
+    """
+
+    response = getattr(e, "response", None)
+    if isinstance(response, dict):
+        return response.get("Error", {}).get("Code", type(e).__name__)
+    return type(e).__name__
+
+
+################################################################################
+# _runChunk
+################################################################################
+def _runChunk(Action, chunk, attempt, delay, DryRun, Region, Profile, kwargs):
+    """
+    Run the action against one chunk after waiting delay seconds
+
+    Returns
+    ------------------------------------
+    chunk : list
+        EC2 Instance Ids of the chunk
+    attempt : int
+        Number of the attempts made for the chunk so far
+    response : dict
+        API response, None when failed
+    e : Exception
+        Exception raised, None when succeeded
+    """
+
+    if delay > 0:
+        time.sleep(delay)
+    try:
+        response = ControlEC2._invoke(Action, chunk, DryRun, Region, Profile, **kwargs)
+    except Exception as e:
+        return chunk, attempt, None, e
+    return chunk, attempt, response, None
+
+
+################################################################################
+# run
+################################################################################
+def run(Action, InstanceIds, ChunkSize=_CHUNK_SIZE, MaxWorkers=_MAX_WORKERS,
+        Retries=_RETRIES, DryRun=False, Region=None, Profile=None, **kwargs):
+    """
+    Run start/stop/reboot against EC2 instances in chunks on a thread pool
+    A chunk failing by throttling is retried as it is unless the client
+    already retried it (RateLimit), a chunk failing by
+    an error of some of its ids (_BISECT_ERRORS) is bisected until the bad
+    instance ids are isolated, and any other error fails the whole chunk
+
+    Parameters
+    ------------------------------------
+    Action : str
+        "start", "stop" or "reboot"
+    InstanceIds : list
+        EC2 Instance Ids
+    ChunkSize : int
+        The number of EC2 instances per API call
+    MaxWorkers : int
+        The number of API calls made concurrently
+    Retries : int
+        The number of retries of a throttled chunk, 0 with the clients of
+        ClientPool as RateLimit retries their calls
+    DryRun : boolean
+    Region : str
+        AWS region name, None means the default region
+    Profile : str
+        Credentials profile name, None means the default credentials
+    kwargs : dict
+        Additional parameters of the API
+
+    Returns
+    ------------------------------------
+    status: int
+        success when all instances succeeded,
+        warning when some of them failed, fail when all of them failed
+    results : dict
+        Result per EC2 Instance Id as below:
+        {
+            "i-0123456789abcdef0": {
+                "Status": 0,
+                "PreviousState": "stopped",
+                "CurrentState": "pending",
+                "Error": None
+            }
+        }
+    """
+
+    logger.debug("start")
+    logger.debug("__VERSION__ = %s", __VERSION__)
+    logger.debug("Action = %s, len(InstanceIds) = %s, ChunkSize = %s, MaxWorkers = %s", Action, len(InstanceIds), ChunkSize, MaxWorkers)
+
+    #-------------------------------------------------------
+    # Variables
+    #-------------------------------------------------------
+    status = Status()
+    results = {}
+    if ChunkSize < 1 or MaxWorkers < 1:
+        logger.error(f"Invalid ChunkSize / MaxWorkers: {ChunkSize} / {MaxWorkers}")
+        logger.debug("end")
+        return status.fail, results
+    _, stateKey = ControlEC2._ACTIONS[Action]
+    # remove duplicated ids keeping the order
+    InstanceIds = list(dict.fromkeys(InstanceIds))
+    chunks = [InstanceIds[i:i + ChunkSize] for i in range(0, len(InstanceIds), ChunkSize)]
+
+    if len(InstanceIds) == 0:
+        logger.debug("end")
+        return status.success, results
+
+    #-------------------------------------------------------
+    # Run Chunks
+    #-------------------------------------------------------
+    try:
+        # retrying a chunk RateLimit gave up on would multiply its attempts
+        if RateLimit.isInstalled(ClientPool.getClient("ec2", Region, Profile)):
+            Retries = 0
+        with ThreadPoolExecutor(max_workers=MaxWorkers) as executor:
+            submit = lambda chunk, attempt, delay=0: executor.submit(
+                _runChunk, Action, chunk, attempt, delay, DryRun, Region, Profile, kwargs
+            )
+            pending = {submit(chunk, 0) for chunk in chunks}
+
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    chunk, attempt, response, e = future.result()
+
+                    # Succeeded
+                    if e is None and stateKey is None:
+                        for InstanceId in chunk:
+                            results[InstanceId] = {
+                                "Status": status.success,
+                                "PreviousState": NA,
+                                "CurrentState": NA,
+                                "Error": None
+                            }
+                        continue
+                    if e is None:
+                        for instance in response.get(stateKey, []):
+                            results[instance["InstanceId"]] = {
+                                "Status": status.success,
+                                "PreviousState": instance.get("PreviousState", {}).get("Name", NA),
+                                "CurrentState": instance.get("CurrentState", {}).get("Name", NA),
+                                "Error": None
+                            }
+                        continue
+
+                    code = _errorCode(e)
+                    # DryRun succeeded
+                    if code == _DRY_RUN_OK:
+                        for InstanceId in chunk:
+                            results[InstanceId] = {
+                                "Status": status.success,
+                                "PreviousState": NA,
+                                "CurrentState": NA,
+                                "Error": None
+                            }
+                        continue
+
+                    # Throttled: retry the same chunk
+                    if code in _RETRYABLE_ERRORS and attempt < Retries:
+                        logger.warning(f"{code}: retry {len(chunk)} instance(s) (attempt {attempt + 1})")
+                        delay = random.uniform(0, _RETRY_DELAY * (2 ** attempt))
+                        pending.add(submit(chunk, attempt + 1, delay))
+                        continue
+
+                    # Failed: bisect to isolate the bad ids
+                    if len(chunk) > 1 and code in _BISECT_ERRORS:
+                        logger.warning(f"{code}: bisect {len(chunk)} instance(s)")
+                        half = len(chunk) // 2
+                        pending.add(submit(chunk[:half], 0))
+                        pending.add(submit(chunk[half:], 0))
+                        continue
+
+                    logger.error(f"{code}: {e}: {chunk}")
+                    for InstanceId in chunk:
+                        results[InstanceId] = {
+                            "Status": status.fail,
+                            "PreviousState": NA,
+                            "CurrentState": NA,
+                            "Error": str(e)
+                        }
+    except Exception as e:
+        logger.error(f"Exception: {e}\n{traceback.format_exc()}")
+        logger.debug("end")
+        return status.fail, results
+
+    #-------------------------------------------------------
+    # Return Value
+    #-------------------------------------------------------
+    failed = [InstanceId for InstanceId in InstanceIds
+              if results.get(InstanceId, {}).get("Status") != status.success]
+    logger.debug("len(failed) = %s", len(failed))
+    logger.debug("end")
+    if len(failed) == 0:
+        return status.success, results
+    if len(failed) == len(InstanceIds):
+        return status.fail, results
+    return status.warning, results
+
+
+################################################################################
+# start
+################################################################################
+def start(InstanceIds, **kwargs):
+    """
+    Start EC2 instances in chunks (see run)
+    """
+
+    return run("start", InstanceIds, **kwargs)
+
+
+################################################################################
+# stop
+################################################################################
+def stop(InstanceIds, **kwargs):
+    """
+    Stop EC2 instances in chunks (see run)
+    """
+
+    return run("stop", InstanceIds, **kwargs)
+
+
+################################################################################
+# hibernate
+################################################################################
+def hibernate(InstanceIds, **kwargs):
+    """
+    Hibernate EC2 instances in chunks (see run)
+    """
+
+    return run("stop", InstanceIds, Hibernate=True, **kwargs)
+
+
+################################################################################
+# reboot
+################################################################################
+def reboot(InstanceIds, **kwargs):
+    """
+    Reboot EC2 instances in chunks (see run)
+    """
+
+    return run("reboot", InstanceIds, **kwargs)
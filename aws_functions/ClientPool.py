@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+################################################################################
+# Cached boto3 sessions and clients
+#-------------------------------------------------------------------------------
+# boto3 and botocore are imported on the first session, not when the package
+# is imported, so that a Lambda cold start only pays for them when an API is
+# actually called. prewarm() loads them and the service model ahead of time.
+################################################################################
+import threading
+import time
+
+from . import Metrics
+from . import RateLimit
+from .log import logger
+
+
+################################################################################
+# variables
+################################################################################
+# boto3 sessions keyed by profile, clients keyed by (service, region, profile)
+# Both live at module level so they survive across warm Lambda invocations
+_sessions = {}
+_clients = {}
+_lock = threading.Lock()
+# (service, region, profile) -> lock held while creating that client only,
+# so that clients of other keys are created concurrently, and
+# ("assume", role ARN) -> lock held while assuming that role
+_keyLocks = {}
+# A profile starting with "arn:" is a role ARN to be assumed
+_ROLE_PREFIX = "arn:"
+_ROLE_SESSION_NAME = "aws_functions"
+# Seconds before expiration the role is assumed again
+_ROLE_REFRESH_MARGIN = 300
+# role ARN -> expiration (epoch seconds) of the assumed credentials
+_expirations = {}
+
+
+################################################################################
+# _expiring
+################################################################################
+def _expiring(Profile):
+    """
+    True when Profile is a role whose credentials are missing or about to expire
+    """
+
+    if Profile is None or not Profile.startswith(_ROLE_PREFIX):
+        return False
+    return _expirations.get(Profile, 0) - time.time() < _ROLE_REFRESH_MARGIN
+
+
+################################################################################
+# _assumeRole
+################################################################################
+def _assumeRole(RoleArn):
+    """
+    Assume the role with the default credentials and cache a session of it
+    The clients made with the previous credentials of the role are dropped
+    """
+
+    logger.debug("assume role: %s", RoleArn)
+    response = getClient("sts").assume_role(
+        RoleArn = RoleArn,
+        RoleSessionName = _ROLE_SESSION_NAME
+    )
+    credentials = response["Credentials"]
+    import boto3
+    session = boto3.session.Session(
+        aws_access_key_id = credentials["AccessKeyId"],
+        aws_secret_access_key = credentials["SecretAccessKey"],
+        aws_session_token = credentials["SessionToken"]
+    )
+    with _lock:
+        _sessions[RoleArn] = session
+        _expirations[RoleArn] = credentials["Expiration"].timestamp()
+        for key in [key for key in _clients if key[2] == RoleArn]:
+            del _clients[key]
+    return session
+
+
+################################################################################
+# getSession
+################################################################################
+def getSession(Profile=None):
+    """
+    Get the cached boto3 session of the credentials profile
+
+    Parameters
+    ------------------------------------
+    Profile : str
+        Credentials profile name, or role ARN to be assumed
+        None means the default credentials chain
+
+    Returns
+    ------------------------------------
+    session : boto3.session.Session
+        boto3 session
+    """
+
+    if _expiring(Profile):
+        with _keyLock(("assume", Profile)):
+            # only the first thread assumes it, the others get its session
+            if _expiring(Profile):
+                return _assumeRole(Profile)
+    with _lock:
+        session = _sessions.get(Profile)
+        if session is None:
+            logger.debug("create session: Profile = %s", Profile)
+            import boto3
+            session = boto3.session.Session(profile_name=Profile)
+            _sessions[Profile] = session
+    return session
+
+
+################################################################################
+# _keyLock
+################################################################################
+def _keyLock(key):
+    """
+    Lock of a client key or of a role, made on the first use
+    """
+
+    with _lock:
+        return _keyLocks.setdefault(key, threading.Lock())
+
+
+################################################################################
+# getClient
+################################################################################
+def getClient(Service="ec2", Region=None, Profile=None):
+    """
+    Get the cached boto3 client of the service
+    The client is created on the first call and reused afterwards
+    Its calls are rate limited and retried by RateLimit
+
+    Parameters
+    ------------------------------------
+    Service : str
+        AWS service name
+    Region : str
+        AWS region name
+        None means the default region of the session
+    Profile : str
+        Credentials profile name, or role ARN to be assumed
+        None means the default credentials chain
+
+    Returns
+    ------------------------------------
+    client : botocore.client.BaseClient
+        boto3 client
+    """
+
+    key = (Service, Region, Profile)
+    client = _clients.get(key)
+    if client is not None and not _expiring(Profile):
+        return client
+
+    from botocore.config import Config
+    with _keyLock(key):
+        session = getSession(Profile)
+        # another thread may have created it while waiting for the lock
+        client = _clients.get(key)
+        if client is None:
+            logger.debug("create client: key = %s", key)
+            with Metrics.timer("ClientCreation"):
+                client = session.client(Service, region_name=Region, config=Config(**RateLimit.CONFIG))
+            RateLimit.install(client, Profile)
+            Metrics.install(client)
+            with _lock:
+                _clients[key] = client
+    return client
+
+
+################################################################################
+# prewarm
+################################################################################
+def prewarm(Service="ec2", Profile=None):
+    """
+    Import boto3 and load the service model into the session of Profile,
+    without creating a client nor calling any API
+    Meant for the init phase of a Lambda function, the model is then
+    reused by the first getClient
+
+    Parameters
+    ------------------------------------
+    Service : str
+        AWS service name
+    Profile : str
+        Credentials profile name, None means the default credentials chain
+        Role ARNs are not assumed here
+    """
+
+    if Profile is not None and Profile.startswith(_ROLE_PREFIX):
+        Profile = None
+    with Metrics.timer("Prewarm"):
+        session = getSession(Profile)
+        session._session.get_service_model(Service)
+    logger.debug("prewarmed: Service = %s", Service)
+
+
+################################################################################
+# setClient
+################################################################################
+def setClient(client, Service="ec2", Region=None, Profile=None):
+    """
+    Inject a client to be returned by getClient
+    This is the hook for botocore Stubber or moto backed clients in tests
+
+    Parameters
+    ------------------------------------
+    client : botocore.client.BaseClient
+        Client to be used
+    Service : str
+        AWS service name
+    Region : str
+        AWS region name
+    Profile : str
+        Credentials profile name
+    """
+
+    logger.debug("set client: %s", (Service, Region, Profile))
+    with _lock:
+        _clients[(Service, Region, Profile)] = client
+        if Profile is not None and Profile.startswith(_ROLE_PREFIX):
+            # injected clients never expire
+            _expirations[Profile] = float("inf")
+
+
+################################################################################
+# clearClients
+################################################################################
+def clearClients():
+    """
+    Drop every cached client and session
+    """
+
+    logger.debug("clear clients")
+    with _lock:
+        _clients.clear()
+        _sessions.clear()
+        _expirations.clear()
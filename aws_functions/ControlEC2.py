@@ -1,17 +1,71 @@
 # -*- coding: utf-8 -*-
 import traceback
 
-import boto3
-
 from . import __VERSION__
 from . import Status
-from .log import logger
+from . import ClientPool
+from . import InventoryCache
+from .log import logger, LazyRepr
+
+
+################################################################################
+# variables
+################################################################################
+# Action : (boto3 method, key of the per-instance state list in the response)
+# reboot_instances returns no per-instance states
+_ACTIONS = {
+    "start": ("start_instances", "StartingInstances"),
+    "stop": ("stop_instances", "StoppingInstances"),
+    "reboot": ("reboot_instances", None),
+}
+
+
+################################################################################
+# _invoke
+################################################################################
+def _invoke(Action, InstanceIds, DryRun=False, Region=None, Profile=None, **kwargs):
+    """
+    Call the EC2 API of the action and invalidate the cached listings of the instances
+    Exceptions are not caught here so that callers can inspect them
+
+    Parameters
+    ------------------------------------
+    Action : str
+        Key of _ACTIONS
+    InstanceIds : list
+        EC2 Instance Ids
+    DryRun : boolean
+    Region : str
+        AWS region name, None means the default region
+    Profile : str
+        Credentials profile name, None means the default credentials
+    kwargs : dict
+        Additional parameters of the API
+
+    Returns
+    ------------------------------------
+    response : dict
+        API response
+    """
+
+    method, _ = _ACTIONS[Action]
+    client = ClientPool.getClient("ec2", Region, Profile)
+    try:
+        return getattr(client, method)(
+            InstanceIds = InstanceIds,
+            DryRun = DryRun,
+            **kwargs
+        )
+    finally:
+        # the states may have changed even when the call failed halfway
+        if not DryRun:
+            InventoryCache.invalidate(InstanceIds)
 
 
 ################################################################################
 # startEC2
 ################################################################################
-def start(InstanceIds, DryRun=False):
+def start(InstanceIds, DryRun=False, Region=None, Profile=None):
     """
     Start E2 instances
     
@@ -20,6 +74,10 @@ def start(InstanceIds, DryRun=False):
     InstanceIds : dict
         EC2 Instance Ids
     DryRun : boolean
+    Region : str
+        AWS region name, None means the default region
+    Profile : str
+        Credentials profile name, None means the default credentials
 
     Returns
     ------------------------------------
@@ -28,8 +86,8 @@ def start(InstanceIds, DryRun=False):
     """
 
     logger.debug("start")
-    logger.debug(f"{__VERSION__ = }")
-    logger.debug(f"{InstanceIds = }")
+    logger.debug("__VERSION__ = %s", __VERSION__)
+    logger.debug("InstanceIds = %s", LazyRepr(InstanceIds))
     #-------------------------------------------------------
     # Variables
     #-------------------------------------------------------
@@ -39,11 +97,7 @@ def start(InstanceIds, DryRun=False):
     # Start EC2
     #-------------------------------------------------------
     try:
-        client = boto3.client("ec2")
-        response = client.start_instances(
-            InstanceIds = InstanceIds,
-            DryRun = DryRun
-        )
+        response = _invoke("start", InstanceIds, DryRun, Region, Profile)
     except Exception as e:
         response = None
         logger.error(f"Exception: {e}\n{traceback.format_exc()}") 
@@ -60,7 +114,7 @@ def start(InstanceIds, DryRun=False):
 ################################################################################
 # stopEC2
 ################################################################################
-def stop(InstanceIds, DryRun=False):
+def stop(InstanceIds, DryRun=False, Region=None, Profile=None):
     """
     Stop E2 instances
     
@@ -69,6 +123,10 @@ def stop(InstanceIds, DryRun=False):
     InstanceIds : dict
         EC2 Instance Ids
     DryRun : boolean
+    Region : str
+        AWS region name, None means the default region
+    Profile : str
+        Credentials profile name, None means the default credentials
 
     Returns
     ------------------------------------
@@ -77,8 +135,8 @@ def stop(InstanceIds, DryRun=False):
     """
 
     logger.debug("start")
-    logger.debug(f"{__VERSION__ = }")
-    logger.debug(f"{InstanceIds = }")
+    logger.debug("__VERSION__ = %s", __VERSION__)
+    logger.debug("InstanceIds = %s", LazyRepr(InstanceIds))
     #-------------------------------------------------------
     # Variables
     #-------------------------------------------------------
@@ -88,11 +146,106 @@ def stop(InstanceIds, DryRun=False):
     # Stop EC2
     #-------------------------------------------------------
     try:
-        client = boto3.client("ec2")
-        response = client.stop_instances(
-            InstanceIds = InstanceIds,
-            DryRun = DryRun
-        )
+        response = _invoke("stop", InstanceIds, DryRun, Region, Profile)
+    except Exception as e:
+        response = None
+        logger.error(f"Exception: {e}\n{traceback.format_exc()}") 
+        logger.debug("end")
+        return status.fail, response
+    
+    #-------------------------------------------------------
+    # Return Value
+    #-------------------------------------------------------
+    logger.debug("end")
+    return status.success, response
+
+
+################################################################################
+# hibernateEC2
+################################################################################
+def hibernate(InstanceIds, DryRun=False, Region=None, Profile=None):
+    """
+    Hibernate E2 instances
+    The instances must have been launched with hibernation enabled
+    
+    Parameters
+    ------------------------------------
+    InstanceIds : dict
+        EC2 Instance Ids
+    DryRun : boolean
+    Region : str
+        AWS region name, None means the default region
+    Profile : str
+        Credentials profile name, None means the default credentials
+
+    Returns
+    ------------------------------------
+    response : dict
+        EC2 Instance Stop Result
+    """
+
+    logger.debug("start")
+    logger.debug("__VERSION__ = %s", __VERSION__)
+    logger.debug("InstanceIds = %s", LazyRepr(InstanceIds))
+    #-------------------------------------------------------
+    # Variables
+    #-------------------------------------------------------
+    status = Status()
+
+    #-------------------------------------------------------
+    # Hibernate EC2
+    #-------------------------------------------------------
+    try:
+        response = _invoke("stop", InstanceIds, DryRun, Region, Profile, Hibernate=True)
+    except Exception as e:
+        response = None
+        logger.error(f"Exception: {e}\n{traceback.format_exc()}") 
+        logger.debug("end")
+        return status.fail, response
+    
+    #-------------------------------------------------------
+    # Return Value
+    #-------------------------------------------------------
+    logger.debug("end")
+    return status.success, response
+
+
+################################################################################
+# rebootEC2
+################################################################################
+def reboot(InstanceIds, DryRun=False, Region=None, Profile=None):
+    """
+    Reboot E2 instances
+    
+    Parameters
+    ------------------------------------
+    InstanceIds : dict
+        EC2 Instance Ids
+    DryRun : boolean
+    Region : str
+        AWS region name, None means the default region
+    Profile : str
+        Credentials profile name, None means the default credentials
+
+    Returns
+    ------------------------------------
+    response : dict
+        EC2 Instance Reboot Result
+    """
+
+    logger.debug("start")
+    logger.debug("__VERSION__ = %s", __VERSION__)
+    logger.debug("InstanceIds = %s", LazyRepr(InstanceIds))
+    #-------------------------------------------------------
+    # Variables
+    #-------------------------------------------------------
+    status = Status()
+
+    #-------------------------------------------------------
+    # Reboot EC2
+    #-------------------------------------------------------
+    try:
+        response = _invoke("reboot", InstanceIds, DryRun, Region, Profile)
     except Exception as e:
         response = None
         logger.error(f"Exception: {e}\n{traceback.format_exc()}") 
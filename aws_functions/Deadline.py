@@ -0,0 +1,448 @@
+# -*- coding: utf-8 -*-
+################################################################################
+# Deadline-aware transitions
+#-------------------------------------------------------------------------------
+# A Lambda invocation is killed at its timeout, wherever it is. With
+# "deadline", a transition runs in three resumable phases instead:
+#   list   : describe_instances page by page, the NextToken is kept
+#   act    : BatchEC2 on the selected ids, one batch at a time
+#   verify : state polls by id until the interval or the time left ends
+# Before each page, batch or poll, the time left from
+# context.get_remaining_time_in_millis() is checked against the longest
+# one seen so far plus Reserve seconds. When it runs short, the progress is
+# checkpointed into a continuation payload and the invocation returns it:
+#
+#     {"statusCode": 202, "body": "Continue from act", "continuation": {...}}
+#
+# Invoking the function again with the event and that "continuation" resumes
+# from it, e.g. from a Step Functions loop, or by the function itself when
+# the event has "reinvoke" (asynchronous invoke, needs lambda:InvokeFunction).
+# The continuation carries the instance ids, so keep it under the 256 KB of
+# an asynchronous payload: about 5000 instances per Filters.
+#
+# FakeContext stands in for the Lambda context locally:
+#
+#     context = Deadline.FakeContext(TimeoutSeconds=30)
+#     response = Transition.run(event, "start", context)
+#     while "continuation" in response:
+#         event = dict(event, continuation=response["continuation"])
+#         response = Transition.run(event, "start", Deadline.FakeContext(30))
+################################################################################
+import contextlib
+import json
+import random
+import time
+import traceback
+import uuid
+
+from . import __VERSION__
+from . import Status
+from . import BatchEC2
+from . import ClientPool
+from . import ListEC2
+from . import Metrics
+from . import VerifyEC2
+from . import WaitEC2
+from .log import logger
+
+
+################################################################################
+# variables
+################################################################################
+# seconds kept for checkpointing and returning the response
+_RESERVE = 10
+# instance ids per BatchEC2.run call in the act phase
+_ACT_BATCH = BatchEC2._CHUNK_SIZE * BatchEC2._MAX_WORKERS
+_PAGE_SIZE = ListEC2._MAX_RESULTS
+# seconds assumed for an operation not seen yet
+_ESTIMATES = {
+    "page": 1.0,
+    "act": 2.0,
+    "poll": 1.0,
+}
+PHASES = ("list", "act", "verify")
+
+
+################################################################################
+# FakeContext
+################################################################################
+class FakeContext:
+    """
+    Lambda context for local runs, the timeout counts from its creation
+
+    Parameters
+    ------------------------------------
+    TimeoutSeconds : float
+        Function timeout
+    FunctionName : str
+        Function name, in the ARN as well
+    """
+
+    def __init__(self, TimeoutSeconds=900, FunctionName="AWS-Control",
+                 Region="us-east-1", Account="123456789012"):
+        self.function_name = FunctionName
+        self.function_version = "$LATEST"
+        self.invoked_function_arn = f"arn:aws:lambda:{Region}:{Account}:function:{FunctionName}"
+        self.memory_limit_in_mb = 128
+        self.aws_request_id = str(uuid.uuid4())
+        self.log_group_name = f"/aws/lambda/{FunctionName}"
+        self.log_stream_name = self.aws_request_id
+        self._timeout = time.monotonic() + TimeoutSeconds
+
+    def get_remaining_time_in_millis(self):
+        return max(0, int((self._timeout - time.monotonic()) * 1000))
+
+
+################################################################################
+# Deadline
+################################################################################
+class Deadline:
+    """
+    Time budget of an invocation
+
+    Parameters
+    ------------------------------------
+    context : object
+        Lambda context, None means no limit
+    Reserve : float
+        Seconds kept for checkpointing and returning
+
+    Attributes
+    ------------------------------------
+    estimates : dict
+        Longest seconds seen per operation name, _ESTIMATES until seen
+    """
+
+    def __init__(self, context=None, Reserve=_RESERVE):
+        self.context = context
+        self.Reserve = Reserve
+        self.estimates = dict(_ESTIMATES)
+        self._seen = set()
+
+    def remaining(self):
+        """
+        Seconds left before the reserve, infinite without a context
+        """
+        if self.context is None:
+            return float("inf")
+        return self.context.get_remaining_time_in_millis() / 1000 - self.Reserve
+
+    def allows(self, Name):
+        """
+        True when there is time for one more operation Name
+        """
+        return self.remaining() >= self.estimates.get(Name, 0)
+
+    @contextlib.contextmanager
+    def measure(self, Name):
+        """
+        Time an operation Name and keep the longest
+        """
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - started
+            # the assumed seconds are replaced by the first measure
+            if Name in self._seen:
+                elapsed = max(self.estimates[Name], elapsed)
+            self._seen.add(Name)
+            self.estimates[Name] = elapsed
+
+
+################################################################################
+# Continuation
+################################################################################
+def newContinuation():
+    """
+    Continuation of a transition that has not started yet
+
+    Returns
+    ------------------------------------
+    continuation : dict
+        {
+            "Phase": "list", "act" or "verify",
+            "NextToken": NextToken of the next page to list,
+            "Listed": instances listed so far,
+            "PendingIds": [ids selected and not acted on yet],
+            "InstanceIds": [ids acted on],
+            "Confirmed": instances already in the After state,
+            "WaitingIds": [ids not converged yet],
+            "FailedIds": [ids the action failed on, not waited for],
+            "VerifyUntil": epoch seconds the verify phase ends at,
+            "Invocations": invocations so far
+        }
+    """
+
+    return {
+        "Phase": "list",
+        "NextToken": None,
+        "Listed": 0,
+        "PendingIds": [],
+        "InstanceIds": [],
+        "Confirmed": 0,
+        "WaitingIds": [],
+        "FailedIds": [],
+        "VerifyUntil": None,
+        "Invocations": 0,
+    }
+
+
+def isContinuation(continuation):
+    """
+    True when continuation looks like a newContinuation
+    """
+
+    return (
+        type(continuation) == dict
+        and continuation.get("Phase") in PHASES
+        and all(key in continuation for key in newContinuation())
+    )
+
+
+def reinvoke(event, continuation, context):
+    """
+    Invoke the function again asynchronously with the continuation
+
+    Returns
+    ------------------------------------
+    status: int
+        Return code
+    """
+
+    status = Status()
+    try:
+        client = ClientPool.getClient("lambda")
+        client.invoke(
+            FunctionName=context.invoked_function_arn,
+            InvocationType="Event",
+            Payload=json.dumps(dict(event, continuation=continuation)).encode()
+        )
+    except Exception as e:
+        logger.error(f"Exception: {e}\n{traceback.format_exc()}")
+        return status.fail
+    return status.success
+
+
+################################################################################
+# Runner
+################################################################################
+class Runner:
+    """
+    One invocation of a resumable transition
+
+    Parameters
+    ------------------------------------
+    definition : dict
+        Transition.TRANSITIONS entry
+    Filters : list
+        EC2 searching filter
+    minInstNum : int
+        Minimum expected EC2 instances
+    maxInstNum : int
+        Maximum expected EC2 instances
+    interval : int
+        Seconds to wait for the instances to reach the "After" state,
+        counted from the end of the act phase across invocations
+    deadline : Deadline
+        Time budget of the invocation
+    continuation : dict
+        Payload of the previous invocation, None to start
+    Display : function
+        Called as Display(i, instance) for each instance listed
+    DryRun : boolean
+    PageSize : int
+        The number of EC2 instances per describe_instances call
+    ActBatch : int
+        The number of EC2 instances per BatchEC2.run call
+    """
+
+    def __init__(self, definition, Filters, minInstNum=1, maxInstNum=1, interval=120, deadline=None,
+                 continuation=None, Display=None, DryRun=False, PageSize=_PAGE_SIZE, ActBatch=_ACT_BATCH,
+                 Region=None, Profile=None):
+        self.definition = definition
+        self.Filters = Filters
+        self.minInstNum = minInstNum
+        self.maxInstNum = maxInstNum
+        self.interval = interval
+        self.deadline = deadline if deadline is not None else Deadline()
+        self.state = continuation if continuation is not None else newContinuation()
+        self.Display = Display
+        self.DryRun = DryRun
+        self.PageSize = PageSize
+        self.ActBatch = ActBatch
+        self.Region = Region
+        self.Profile = Profile
+        self.status = Status()
+        self.actResult = {}
+        # operations done in this invocation, the first one always runs
+        self._done = 0
+
+    def _allows(self, Name):
+        return self._done == 0 or self.deadline.allows(Name)
+
+    def _checkpoint(self):
+        phase = self.state["Phase"]
+        logger.warning(f"{self.deadline.remaining() + self.deadline.Reserve:.1f} second(s) left, continue from {phase}")
+        Metrics.count("Checkpoints")
+        return self.status.success, f"Continue from {phase}", self.state
+
+    #-------------------------------------------------------
+    # Phases
+    #-------------------------------------------------------
+    def list(self):
+        """
+        List the pages from NextToken and select the instances
+        """
+        Before = self.definition["Before"]
+        After = self.definition["After"]
+        state = self.state
+        while True:
+            if not self._allows("page"):
+                return self._checkpoint()
+            with self.deadline.measure("page"):
+                ret, EC2InstanceList, NextToken = ListEC2.getEC2InstancePage(
+                    self.Filters, state["NextToken"], self.PageSize, self.Region, self.Profile
+                )
+            self._done += 1
+            if ret != self.status.success:
+                return self.status.fail, "Failed to get EC2 instances", None
+
+            for instance in EC2InstanceList:
+                state["Listed"] += 1
+                if self.Display is not None:
+                    self.Display(state["Listed"], instance)
+                stateName = instance.stateName
+                if stateName in Before:
+                    state["PendingIds"].append(instance.InstanceId)
+                elif stateName == After:
+                    state["Confirmed"] += 1
+                else:
+                    # in transition, e.g. pending or stopping
+                    state["WaitingIds"].append(instance.InstanceId)
+            state["NextToken"] = NextToken
+            if NextToken is None:
+                break
+
+        Listed = state["Listed"]
+        logger.info(f"{Listed} instance(s) found")
+        logger.info(f"The expected instance number(s) is {self.minInstNum} <= instance(s) <= {self.maxInstNum}")
+        if Listed < self.minInstNum or Listed > self.maxInstNum:
+            return self.status.fail, "The number of instance(s) is out of range", None
+        if Listed == 0:
+            return self.status.success, "No instance found", None
+        if len(state["PendingIds"]) == 0 and len(state["WaitingIds"]) == 0:
+            return self.status.success, f"All instances are in {After} state", None
+        state["Phase"] = "act"
+        return None
+
+    def act(self):
+        """
+        Call the API of the action on the pending instances, a batch at a time
+        """
+        verb, _ = self.definition["Verb"]
+        state = self.state
+        while state["PendingIds"]:
+            if not self._allows("act"):
+                return self._checkpoint()
+            batch = state["PendingIds"][:self.ActBatch]
+            with self.deadline.measure("act"):
+                ret, result = BatchEC2.run(
+                    self.definition["Api"], batch, DryRun=self.DryRun,
+                    Region=self.Region, Profile=self.Profile, **self.definition["Params"]
+                )
+            self._done += 1
+            self.actResult.update(result)
+            del state["PendingIds"][:len(batch)]
+            state["InstanceIds"] += batch
+            for InstanceId, item in result.items():
+                if item["Status"] != self.status.success:
+                    logger.error(f"Failed to {verb} {InstanceId}: {item['Error']}")
+                    # it stays in the "Before" state, waiting for it is useless
+                    state["FailedIds"].append(InstanceId)
+
+        logger.info(f"{len(state['InstanceIds'])} instance(s) requested to {verb}")
+        failed = set(state["FailedIds"])
+        state["WaitingIds"] = [i for i in state["InstanceIds"] if i not in failed] + state["WaitingIds"]
+        state["VerifyUntil"] = time.time() + self.interval
+        state["Phase"] = "verify"
+        return None
+
+    def verify(self):
+        """
+        Poll the instances not converged yet with backoff, until VerifyUntil
+        or until the time left runs short
+        """
+        After = self.definition["After"]
+        state = self.state
+        attempt = 0
+        logger.info(f"Wait up to {state['VerifyUntil'] - time.time():.0f} seconds for {len(state['WaitingIds'])} instance(s) to be {After}")
+        while True:
+            if not self._allows("poll"):
+                return self._checkpoint()
+            with self.deadline.measure("poll"):
+                Metrics.count("Polls")
+                ret, states = VerifyEC2.getInstanceStates(state["WaitingIds"], self.Region, self.Profile)
+            self._done += 1
+            convergence = VerifyEC2.convergence(state["WaitingIds"], states, After)
+            state["WaitingIds"] = [i for i, item in convergence.items() if not item["Converged"]]
+            left = state["VerifyUntil"] - time.time()
+            if ret != self.status.success or not state["WaitingIds"] or left <= 0 or any(WaitEC2.isSettled(states.get(i), After) for i in state["WaitingIds"]):
+                for i, (InstanceId, item) in enumerate(convergence.items(), 1):
+                    logger.info(f"EC2 INSTANCE {i:003} ----------------------------------------")
+                    logger.info(f"{InstanceId = }")
+                    logger.info(f"State = {item['State']}")
+                if state["WaitingIds"] or state["FailedIds"]:
+                    return self.status.fail, None, None
+                return self.status.success, None, None
+
+            # jitter as WaitEC2, no longer than the time left allows
+            backoff = min(WaitEC2._MAX_DELAY, WaitEC2._DELAY * (2 ** attempt))
+            pause = min(random.uniform(WaitEC2._DELAY / 2, backoff), left, self.deadline.remaining() - self.deadline.estimates["poll"])
+            if pause > 0:
+                with Metrics.timer("WaitSleep"):
+                    time.sleep(pause)
+            attempt += 1
+
+    #-------------------------------------------------------
+    # Run
+    #-------------------------------------------------------
+    def run(self):
+        """
+        Run the phases from the one of the continuation
+
+        Returns
+        ------------------------------------
+        status: int
+            Return code
+        msg : str
+            Result message, or "Continue from <phase>"
+        continuation : dict
+            Payload to resume from, None when the transition ended
+        """
+
+        logger.debug("start")
+        logger.debug("__VERSION__ = %s", __VERSION__)
+        verb, participle = self.definition["Verb"]
+        state = self.state
+        state["Invocations"] += 1
+        logger.info(f"Invocation {state['Invocations']}, phase {state['Phase']}, {self.deadline.remaining():.1f} second(s) available")
+
+        try:
+            for phase in PHASES[PHASES.index(state["Phase"]):]:
+                with Metrics.timer(phase):
+                    result = getattr(self, phase)()
+                if result is not None:
+                    break
+        except Exception as e:
+            logger.error(f"Exception: {e}\n{traceback.format_exc()}")
+            logger.debug("end")
+            return self.status.fail, str(e), None
+
+        logger.debug("end")
+        ret, msg, continuation = result
+        if msg is not None:
+            return ret, msg, continuation
+        if ret == self.status.success:
+            return ret, f"Scceeded in {participle} EC2 instance: {state['InstanceIds']}", None
+        return ret, f"Failed to {verb} EC2 instances: {state['InstanceIds']}", None
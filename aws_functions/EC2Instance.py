@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+from . import Projection
+
+
+################################################################################
+# variables
+################################################################################
+NA = Projection.NA
+
+
+################################################################################
+# EC2Instance
+################################################################################
+class EC2Instance:
+    """
+    EC2 instance information extracted from describe_instances
+    Attributes are the fields of Projection.FIELDS, "NA" when the instance
+    doesn't have it. It can also be read like the dict extractEC2Info used
+    to return, e.g. instance["State"]["Name"]
+
+    Attributes
+    ------------------------------------
+    TagDict : dict
+        Tags as {Key: Value}
+    Extra : dict
+        Projected fields other than Projection.FIELDS, None when there is none
+    """
+
+    __slots__ = Projection.FIELDS + ("TagDict", "Extra")
+
+    def __init__(self, InstanceId, VpcId=NA, SubnetId=NA, PrivateIpAddress=NA,
+                 Placement=NA, PlatformDetails=NA, State=NA, StateReason=NA,
+                 KeyName=NA, MaintenanceOptions=NA, Tags=NA, Extra=None):
+        self.InstanceId = InstanceId
+        self.VpcId = VpcId
+        self.SubnetId = SubnetId
+        self.PrivateIpAddress = PrivateIpAddress
+        self.Placement = Placement
+        self.PlatformDetails = PlatformDetails
+        self.State = State
+        self.StateReason = StateReason
+        self.KeyName = KeyName
+        self.MaintenanceOptions = MaintenanceOptions
+        self.Tags = Tags
+        self.TagDict = {tag["Key"]: tag["Value"] for tag in Tags} if type(Tags) == list else {}
+        self.Extra = Extra
+
+    @classmethod
+    def fromInstance(cls, instance, Fields=Projection.FIELDS):
+        """
+        Make EC2Instance from an instance of a describe_instances response
+
+        Parameters
+        ------------------------------------
+        instance : dict
+            Instance of a describe_instances response
+        Fields : tuple
+            Fields to keep, the fields of Projection.FIELDS not in it are
+            "NA" (InstanceId is always kept), the others are kept in Extra
+        """
+
+        get = instance.get
+        if Fields is not Projection.FIELDS and not set(Projection.FIELDS) <= set(Fields):
+            wanted = set(Fields)
+            wanted.add("InstanceId")
+            get = lambda key, default: instance.get(key, default) if key in wanted else default
+        extra = None
+        if Fields is not Projection.FIELDS:
+            extra = {key: get(key, NA) for key in Fields if key not in Projection.FIELDS} or None
+        return cls(
+            get("InstanceId", NA),
+            get("VpcId", NA),
+            get("SubnetId", NA),
+            get("PrivateIpAddress", NA),
+            get("Placement", NA),
+            get("PlatformDetails", NA),
+            get("State", NA),
+            get("StateReason", NA),
+            get("KeyName", NA),
+            get("MaintenanceOptions", NA),
+            get("Tags", NA),
+            extra
+        )
+
+    @classmethod
+    def fromDict(cls, EC2Info):
+        """
+        Make EC2Instance from the dict toDict returns
+        """
+
+        extra = {key: value for key, value in EC2Info.items() if key not in Projection.FIELDS} or None
+        fields = {key: EC2Info[key] for key in Projection.FIELDS if key in EC2Info}
+        return cls(Extra=extra, **fields)
+
+    #-------------------------------------------------------
+    # Shortcuts
+    #-------------------------------------------------------
+    @property
+    def name(self):
+        """
+        Value of the Name tag, "NA" when there is no Name tag
+        """
+        return self.TagDict.get("Name", NA)
+
+    @property
+    def stateName(self):
+        """
+        State name such as "running", "NA" when unknown
+        """
+        return self.State["Name"] if type(self.State) == dict else NA
+
+    @property
+    def availabilityZone(self):
+        """
+        Availability zone of Placement, "NA" when unknown
+        """
+        return self.Placement.get("AvailabilityZone", NA) if type(self.Placement) == dict else NA
+
+    #-------------------------------------------------------
+    # dict compatibility
+    #-------------------------------------------------------
+    def __getitem__(self, key):
+        if key in Projection.FIELDS:
+            return getattr(self, key)
+        if self.Extra is not None and key in self.Extra:
+            return self.Extra[key]
+        raise KeyError(key)
+
+    def __contains__(self, key):
+        return key in Projection.FIELDS or (self.Extra is not None and key in self.Extra)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return list(Projection.FIELDS) + (list(self.Extra) if self.Extra else [])
+
+    def toDict(self):
+        """
+        Convert to the dict extractEC2Info used to return
+        """
+        return {key: self[key] for key in self.keys()}
+
+    def __eq__(self, other):
+        if not isinstance(other, EC2Instance):
+            return NotImplemented
+        return self.toDict() == other.toDict()
+
+    def __hash__(self):
+        # equal records have the same id, and the id doesn't change on update
+        return hash(self.InstanceId)
+
+    def __repr__(self):
+        return f"EC2Instance({self.toDict()!r})"
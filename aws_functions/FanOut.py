@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+import time
+import traceback
+from collections import deque, namedtuple
+from concurrent.futures import (
+    ThreadPoolExecutor,
+    wait,
+    FIRST_COMPLETED
+)
+
+from . import __VERSION__
+from . import Status
+from . import ClientPool
+from . import ListEC2
+from . import BatchEC2
+from .log import logger
+
+
+################################################################################
+# variables
+################################################################################
+_MAX_WORKERS = 16
+# Targets of the same account running at the same time
+_ACCOUNT_LIMIT = 4
+# Concurrent API calls of BatchEC2 within a target
+_TARGET_WORKERS = 4
+
+# RoleArn : role to be assumed, None means the default credentials
+# Region : AWS region name, None means the default region
+Target = namedtuple("Target", ["RoleArn", "Region"])
+
+
+################################################################################
+# _account
+################################################################################
+def _account(RoleArn):
+    """
+    Account id of a role ARN (arn:aws:iam::<account>:role/<name>),
+    the profile itself for the others
+    """
+
+    if RoleArn is not None and RoleArn.startswith(ClientPool._ROLE_PREFIX):
+        return RoleArn.split(":")[4]
+    return RoleArn
+
+
+################################################################################
+# run
+################################################################################
+def run(Targets, func, MaxWorkers=_MAX_WORKERS, AccountLimit=_ACCOUNT_LIMIT):
+    """
+    Run func against every target on a thread pool
+    The role of each target is assumed through ClientPool, and the
+    targets of the same account are limited to AccountLimit at a time:
+    the others wait in a queue of the account, not in a thread of the
+    pool, so that they don't hold up the targets of the other accounts
+
+    Parameters
+    ------------------------------------
+    Targets : list
+        Target (RoleArn, Region)
+    func : callable
+        func(target) -> (status, result)
+    MaxWorkers : int
+        The number of targets run concurrently
+    AccountLimit : int
+        The number of targets of the same account run concurrently
+
+    Returns
+    ------------------------------------
+    status: int
+        success when all targets succeeded,
+        warning when some of them failed, fail when all of them failed
+        or when MaxWorkers or AccountLimit is less than 1
+    report : dict
+        Result per target, in the order of Targets, as below:
+        {
+            "Elapsed": 1.23,
+            "Succeeded": 1,
+            "Failed": 0,
+            "Targets": [
+                {
+                    "RoleArn": "arn:aws:iam::123456789012:role/EC2Control",
+                    "Region": "ap-northeast-1",
+                    "Status": 0,
+                    "Elapsed": 0.45,
+                    "Error": None,
+                    "Result": ...
+                }
+            ]
+        }
+    """
+
+    logger.debug("start")
+    logger.debug("__VERSION__ = %s", __VERSION__)
+    logger.debug("%s target(s)", len(Targets))
+
+    #-------------------------------------------------------
+    # Variables
+    #-------------------------------------------------------
+    status = Status()
+    if MaxWorkers < 1 or AccountLimit < 1:
+        logger.error(f"Invalid MaxWorkers / AccountLimit: {MaxWorkers} / {AccountLimit}")
+        logger.debug("end")
+        return status.fail, {"Elapsed": 0, "Succeeded": 0, "Failed": len(Targets), "Targets": []}
+    Targets = [Target(*target) for target in Targets]
+    # account -> indexes of its targets not submitted yet
+    queues = {}
+    for n, target in enumerate(Targets):
+        queues.setdefault(_account(target.RoleArn), deque()).append(n)
+    started = time.monotonic()
+
+    #-------------------------------------------------------
+    # Run per Target
+    #-------------------------------------------------------
+    def runTarget(target):
+        begin = time.monotonic()
+        try:
+            ret, result = func(target)
+            error = None if ret != status.fail else "failed"
+        except Exception as e:
+            logger.error(f"{target}: Exception: {e}\n{traceback.format_exc()}")
+            ret, result, error = status.fail, None, str(e)
+        return {
+            "RoleArn": target.RoleArn,
+            "Region": target.Region,
+            "Status": ret,
+            "Elapsed": round(time.monotonic() - begin, 3),
+            "Error": error,
+            "Result": result
+        }
+
+    results = [None] * len(Targets)
+    with ThreadPoolExecutor(max_workers=MaxWorkers) as executor:
+        # future -> (index of the target, account)
+        pending = {}
+
+        def submit(account):
+            n = queues[account].popleft()
+            pending[executor.submit(runTarget, Targets[n])] = (n, account)
+
+        for account, queue in queues.items():
+            for _ in range(min(AccountLimit, len(queue))):
+                submit(account)
+        # a target of the account is submitted when another one ends
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                n, account = pending.pop(future)
+                results[n] = future.result()
+                if queues[account]:
+                    submit(account)
+
+    #-------------------------------------------------------
+    # Return Value
+    #-------------------------------------------------------
+    failed = sum(1 for result in results if result["Status"] == status.fail)
+    report = {
+        "Elapsed": round(time.monotonic() - started, 3),
+        "Succeeded": len(results) - failed,
+        "Failed": failed,
+        "Targets": results
+    }
+    logger.debug("end")
+    if failed == 0:
+        return status.success, report
+    if failed == len(results):
+        return status.fail, report
+    return status.warning, report
+
+
+################################################################################
+# getEC2Instances
+################################################################################
+def getEC2Instances(Targets, Filters, **kwargs):
+    """
+    ListEC2.getEC2Instances against every target
+
+    Parameters
+    ------------------------------------
+    Targets : list
+        Target (RoleArn, Region)
+    Filters : list
+        EC2 searching filter
+    kwargs : dict
+        MaxWorkers and AccountLimit of run
+
+    Returns
+    ------------------------------------
+    status: int
+        Return code of run
+    report : dict
+        Report of run, with "Instances" merging every target as
+        [(Target, EC2Instance), ...]
+    """
+
+    ret, report = run(
+        Targets,
+        lambda target: ListEC2.getEC2Instances(Filters, Region=target.Region, Profile=target.RoleArn),
+        **kwargs
+    )
+    report["Instances"] = [
+        (Target(result["RoleArn"], result["Region"]), EC2Info)
+        for result in report["Targets"] if result["Result"] is not None
+        for EC2Info in result["Result"]
+    ]
+    return ret, report
+
+
+################################################################################
+# control
+################################################################################
+def control(Action, TargetInstanceIds, DryRun=False, TargetWorkers=_TARGET_WORKERS, **kwargs):
+    """
+    BatchEC2.run against the instances of every target
+
+    Parameters
+    ------------------------------------
+    Action : str
+        "start" or "stop"
+    TargetInstanceIds : dict
+        EC2 Instance Ids per Target as {Target: [InstanceId, ...]}
+    DryRun : boolean
+    TargetWorkers : int
+        Concurrent API calls within a target
+    kwargs : dict
+        MaxWorkers and AccountLimit of run
+
+    Returns
+    ------------------------------------
+    status: int
+        Return code of run
+    report : dict
+        Report of run, "Result" of each target is the per-instance result of BatchEC2
+    """
+
+    TargetInstanceIds = {Target(*target): ids for target, ids in TargetInstanceIds.items()}
+    return run(
+        list(TargetInstanceIds),
+        lambda target: BatchEC2.run(
+            Action,
+            TargetInstanceIds[target],
+            MaxWorkers=TargetWorkers,
+            DryRun=DryRun,
+            Region=target.Region,
+            Profile=target.RoleArn
+        ),
+        **kwargs
+    )
+
+
+def start(TargetInstanceIds, **kwargs):
+    """
+    Start EC2 instances of every target (see control)
+    """
+
+    return control("start", TargetInstanceIds, **kwargs)
+
+
+def stop(TargetInstanceIds, **kwargs):
+    """
+    Stop EC2 instances of every target (see control)
+    """
+
+    return control("stop", TargetInstanceIds, **kwargs)
@@ -0,0 +1,300 @@
+# -*- coding: utf-8 -*-
+import fnmatch
+
+from .EC2Instance import EC2Instance
+from .log import logger
+
+
+################################################################################
+# variables
+################################################################################
+# Indexed keys, named after the describe_instances filter names
+TAG_KEY = "tag-key"
+STATE = "instance-state-name"
+VPC = "vpc-id"
+SUBNET = "subnet-id"
+AZ = "availability-zone"
+INSTANCE_ID = "instance-id"
+_TAG_PREFIX = "tag:"
+INDEXED = (TAG_KEY, STATE, VPC, SUBNET, AZ, INSTANCE_ID)
+
+
+################################################################################
+# Query
+################################################################################
+class Query:
+    """
+    Condition over an Inventory, combined with & (AND), | (OR) and ~ (NOT)
+
+        query = Tag("env", "dev") & State("stopped") & Vpc("vpc-0123")
+        instances = inventory.find(query)
+    """
+
+    __slots__ = ("_func",)
+
+    def __init__(self, func):
+        # func : inventory -> set of EC2 Instance Ids
+        self._func = func
+
+    def ids(self, inventory):
+        return self._func(inventory)
+
+    def __and__(self, other):
+        return Query(lambda inv: self.ids(inv) & other.ids(inv))
+
+    def __or__(self, other):
+        return Query(lambda inv: self.ids(inv) | other.ids(inv))
+
+    def __invert__(self):
+        return Query(lambda inv: set(inv.instances) - self.ids(inv))
+
+
+def Match(Name, *Values):
+    """
+    Instances whose indexed key Name has one of Values
+    """
+    return Query(lambda inv: inv.lookup(Name, *Values))
+
+
+def Tag(Key, *Values):
+    """
+    Instances that have the tag Key, with one of Values when given
+    """
+    if len(Values) == 0:
+        return Match(TAG_KEY, Key)
+    return Match(_TAG_PREFIX + Key, *Values)
+
+
+def State(*Names):
+    """
+    Instances in one of the states
+    """
+    return Match(STATE, *Names)
+
+
+def Vpc(*VpcIds):
+    """
+    Instances in one of the VPCs
+    """
+    return Match(VPC, *VpcIds)
+
+
+def Subnet(*SubnetIds):
+    """
+    Instances in one of the subnets
+    """
+    return Match(SUBNET, *SubnetIds)
+
+
+def AvailabilityZone(*Names):
+    """
+    Instances in one of the availability zones
+    """
+    return Match(AZ, *Names)
+
+
+def InstanceId(*InstanceIds):
+    """
+    Instances of the EC2 Instance Ids
+    """
+    return Match(INSTANCE_ID, *InstanceIds)
+
+
+################################################################################
+# Inventory
+################################################################################
+class Inventory:
+    """
+    In-memory set of EC2 instances with inverted indexes on tags, state,
+    VPC, subnet and availability zone, so that many selections can be made
+    from one getEC2Instances result without calling the API again
+
+    Parameters
+    ------------------------------------
+    EC2InstanceList : list
+        getEC2Instances result (EC2Instance or dict)
+    """
+
+    def __init__(self, EC2InstanceList=()):
+        self.instances = {}
+        # EC2 Instance Id -> sequence number, to return results in the order added
+        self._order = {}
+        self._sequence = 0
+        # indexed key -> value -> set of EC2 Instance Ids
+        self._index = {}
+        for instance in EC2InstanceList:
+            self.add(instance)
+
+    #-------------------------------------------------------
+    # Index
+    #-------------------------------------------------------
+    @staticmethod
+    def _keys(instance):
+        """
+        (indexed key, value) pairs of the instance
+        """
+        yield INSTANCE_ID, instance.InstanceId
+        yield STATE, instance.stateName
+        yield VPC, instance.VpcId
+        yield SUBNET, instance.SubnetId
+        yield AZ, instance.availabilityZone
+        for key, value in instance.TagDict.items():
+            yield TAG_KEY, key
+            yield _TAG_PREFIX + key, value
+
+    def add(self, instance):
+        """
+        Add or replace an instance
+        """
+        if not isinstance(instance, EC2Instance):
+            instance = EC2Instance.fromDict(instance)
+        if instance.InstanceId in self.instances:
+            self.remove(instance.InstanceId)
+        self.instances[instance.InstanceId] = instance
+        self._order[instance.InstanceId] = self._sequence
+        self._sequence += 1
+        self._link(instance)
+
+    def remove(self, InstanceId):
+        """
+        Remove an instance, nothing happens when it is not in the inventory
+        """
+        instance = self.instances.pop(InstanceId, None)
+        if instance is None:
+            return
+        del self._order[InstanceId]
+        self._unlink(instance)
+
+    def update(self, InstanceId, **Fields):
+        """
+        Change fields of an instance in place and index it again, keeping
+        its order. Nothing happens when it is not in the inventory
+
+        Parameters
+        ------------------------------------
+        InstanceId : str
+            EC2 Instance Id
+        Fields : dict
+            Fields of Projection.FIELDS, e.g. State={"Code": 16, "Name": "running"}
+
+        Returns
+        ------------------------------------
+        instance : EC2Instance
+            Updated instance, None when it is not in the inventory
+        """
+        instance = self.instances.get(InstanceId)
+        if instance is None:
+            return None
+        self._unlink(instance)
+        for key, value in Fields.items():
+            setattr(instance, key, value)
+        if "Tags" in Fields:
+            instance.TagDict = {tag["Key"]: tag["Value"] for tag in instance.Tags} if type(instance.Tags) == list else {}
+        self._link(instance)
+        return instance
+
+    def _link(self, instance):
+        for name, value in self._keys(instance):
+            self._index.setdefault(name, {}).setdefault(value, set()).add(instance.InstanceId)
+
+    def _unlink(self, instance):
+        for name, value in self._keys(instance):
+            ids = self._index[name][value]
+            ids.discard(instance.InstanceId)
+            if not ids:
+                del self._index[name][value]
+
+    def lookup(self, Name, *Values):
+        """
+        EC2 Instance Ids whose indexed key Name has one of Values
+
+        Returns
+        ------------------------------------
+        ids : set
+            EC2 Instance Ids
+        """
+        values = self._index.get(Name, {})
+        ids = set()
+        for value in Values:
+            ids |= values.get(value, set())
+        return ids
+
+    def values(self, Name):
+        """
+        Distinct values of the indexed key Name and their instance count
+        """
+        return {value: len(ids) for value, ids in self._index.get(Name, {}).items()}
+
+    #-------------------------------------------------------
+    # Query
+    #-------------------------------------------------------
+    def find(self, query=None):
+        """
+        Instances matching the query, all instances when query is None
+
+        Parameters
+        ------------------------------------
+        query : Query
+            Condition
+
+        Returns
+        ------------------------------------
+        EC2InstanceList : list
+            EC2Instance in the order they were added
+        """
+        if query is None:
+            return list(self.instances.values())
+        ids = query.ids(self)
+        logger.debug("%s instance(s) matched", len(ids))
+        return [self.instances[InstanceId] for InstanceId in sorted(ids, key=self._order.__getitem__)]
+
+    def _expand(self, Name, Values):
+        """
+        Values with the wildcard patterns replaced by the indexed values
+        they match
+        """
+        result = []
+        for value in Values:
+            if "*" in value or "?" in value:
+                result += [v for v in self._index.get(Name, {}) if fnmatch.fnmatchcase(str(v), value)]
+            else:
+                result.append(value)
+        return result
+
+    def select(self, Filters):
+        """
+        Instances matching describe_instances style Filters on the indexed keys
+        Filters are ANDed, Values of a filter are ORed and may contain the
+        wildcards * and ?
+
+        Parameters
+        ------------------------------------
+        Filters : list
+            [{"Name": "tag:env", "Values": ["dev"]}, ...]
+
+        Raises
+        ------------------------------------
+        ValueError
+            When a filter name is not indexed (INDEXED or "tag:Key"),
+            e.g. "instance-type", which would match nothing
+        """
+        for f in Filters:
+            if f["Name"] not in INDEXED and not f["Name"].startswith(_TAG_PREFIX):
+                raise ValueError(f"Filter not indexed: {f['Name']}")
+        query = None
+        for f in Filters:
+            q = Match(f["Name"], *self._expand(f["Name"], f["Values"]))
+            query = q if query is None else query & q
+        return self.find(query)
+
+    def __len__(self):
+        return len(self.instances)
+
+    def __iter__(self):
+        return iter(self.instances.values())
+
+    def __contains__(self, InstanceId):
+        return InstanceId in self.instances
+
+    def get(self, InstanceId, default=None):
+        return self.instances.get(InstanceId, default)
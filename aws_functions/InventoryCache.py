@@ -0,0 +1,300 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import os
+import threading
+import time
+import traceback
+from collections import OrderedDict
+
+from . import __VERSION__
+from . import Status
+from . import ListEC2
+from .EC2Instance import EC2Instance
+from .log import logger
+
+
+################################################################################
+# variables
+################################################################################
+_TTL = 60
+_MAX_ENTRIES = 64
+_DISK_DIR = "/tmp/aws_functions_cache"
+_STATE_FILTER = "instance-state-name"
+
+
+################################################################################
+# normalizeFilters
+################################################################################
+def normalizeFilters(Filters):
+    """
+    Make a cache key that doesn't depend on the order of filters or values
+
+    Parameters
+    ------------------------------------
+    Filters : list
+        EC2 searching filter
+
+    Returns
+    ------------------------------------
+    key : str
+        Normalized Filters as JSON
+    """
+
+    normalized = sorted(
+        (f["Name"], sorted(set(f["Values"]))) for f in Filters
+    )
+    return json.dumps(normalized, separators=(",", ":"))
+
+
+################################################################################
+# InventoryCache
+################################################################################
+class InventoryCache:
+    """
+    TTL and LRU cache of getEC2Instances results keyed by normalized Filters
+    It is kept at module level (see cache) so that warm Lambda invocations
+    share it, and can be backed by files in /tmp so that a new module
+    instance in the same container can reuse the results too
+
+    Parameters
+    ------------------------------------
+    TTL : int
+        Seconds an entry is valid
+    MaxEntries : int
+        Number of entries kept, the least recently used one is evicted
+    DiskDir : str
+        Directory of the on-disk entries, None means memory only
+    """
+
+    def __init__(self, TTL=_TTL, MaxEntries=_MAX_ENTRIES, DiskDir=None):
+        self.TTL = TTL
+        self.MaxEntries = MaxEntries
+        self.DiskDir = DiskDir
+        # key -> (expiry, EC2InstanceList, filter names)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    #-------------------------------------------------------
+    # Disk
+    #-------------------------------------------------------
+    def _path(self, key):
+        name = hashlib.sha256(key.encode()).hexdigest()
+        return os.path.join(self.DiskDir, f"{name}.json")
+
+    def _readDisk(self, key):
+        path = self._path(key)
+        try:
+            with open(path) as f:
+                data = json.load(f)
+            if data["key"] != key or data["expiry"] <= time.time():
+                return None
+            return (
+                data["expiry"],
+                [EC2Instance.fromDict(EC2Info) for EC2Info in data["instances"]],
+                frozenset(data["names"])
+            )
+        except OSError:
+            return None
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            # truncated or edited by hand, a miss that is written again
+            logger.warning(f"Invalid cache file {path}: {e}")
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+
+    def _writeDisk(self, key, expiry, EC2InstanceList, Names):
+        try:
+            os.makedirs(self.DiskDir, exist_ok=True)
+            path = self._path(key)
+            data = {
+                "key": key,
+                "expiry": expiry,
+                "names": sorted(Names),
+                "instances": [EC2Info.toDict() for EC2Info in EC2InstanceList]
+            }
+            # write then rename so that a reader never sees a partial file
+            with open(path + ".tmp", "w") as f:
+                json.dump(data, f, default=str)
+            os.replace(path + ".tmp", path)
+        except Exception as e:
+            logger.warning(f"Failed to write cache: {e}")
+
+    #-------------------------------------------------------
+    # Entries
+    #-------------------------------------------------------
+    def get(self, key):
+        """
+        Cached EC2InstanceList of the key, None when missing or expired
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    logger.debug("cache hit: %s", key)
+                    return entry[1]
+                del self._entries[key]
+
+        if self.DiskDir is not None:
+            entry = self._readDisk(key)
+            if entry is not None:
+                logger.debug("disk cache hit: %s", key)
+                self._store(key, *entry)
+                return entry[1]
+        logger.debug("cache miss: %s", key)
+        return None
+
+    def _store(self, key, expiry, EC2InstanceList, Names):
+        with self._lock:
+            self._entries[key] = (expiry, EC2InstanceList, Names)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.MaxEntries:
+                evicted, _ = self._entries.popitem(last=False)
+                logger.debug("cache evicted: %s", evicted)
+
+    def put(self, key, EC2InstanceList, Names=()):
+        """
+        Store EC2InstanceList (list of EC2Instance) for TTL seconds
+        Names are the filter names of the listing, for invalidate
+        """
+        expiry = time.time() + self.TTL
+        Names = frozenset(Names)
+        self._store(key, expiry, EC2InstanceList, Names)
+        if self.DiskDir is not None:
+            self._writeDisk(key, expiry, EC2InstanceList, Names)
+
+    def invalidate(self, InstanceIds=None):
+        """
+        Drop the entries that contain any of InstanceIds or are filtered by
+        state, every entry when None
+
+        Parameters
+        ------------------------------------
+        InstanceIds : list
+            EC2 Instance Ids whose state was changed
+        """
+        with self._lock:
+            if InstanceIds is None:
+                keys = list(self._entries)
+            else:
+                InstanceIds = set(InstanceIds)
+                # a listing filtered by state may gain the instances, so drop it as well
+                keys = [
+                    key for key, (_, EC2InstanceList, Names) in self._entries.items()
+                    if _STATE_FILTER in Names
+                    or any(EC2Info.InstanceId in InstanceIds for EC2Info in EC2InstanceList)
+                ]
+            for key in keys:
+                del self._entries[key]
+        logger.debug("cache invalidated: %s entry(s)", len(keys))
+
+        if self.DiskDir is not None and os.path.isdir(self.DiskDir):
+            # entries only on disk can't be checked without loading them, so drop them all
+            for name in os.listdir(self.DiskDir):
+                if name.endswith(".json"):
+                    try:
+                        os.remove(os.path.join(self.DiskDir, name))
+                    except OSError:
+                        pass
+
+
+################################################################################
+# Module Cache
+################################################################################
+cache = InventoryCache()
+
+
+def configure(TTL=_TTL, MaxEntries=_MAX_ENTRIES, Disk=False):
+    """
+    Replace the module cache
+
+    Parameters
+    ------------------------------------
+    TTL : int
+        Seconds an entry is valid
+    MaxEntries : int
+        Number of entries kept
+    Disk : boolean
+        Back the cache by files in /tmp
+    """
+
+    global cache
+    cache = InventoryCache(TTL, MaxEntries, _DISK_DIR if Disk else None)
+
+
+def invalidate(InstanceIds=None):
+    """
+    Drop the cached results containing any of InstanceIds, every result when None
+    """
+
+    cache.invalidate(InstanceIds)
+
+
+################################################################################
+# getEC2Instances
+################################################################################
+def getEC2Instances(Filters, Region=None, Profile=None, Refresh=False, **kwargs):
+    """
+    ListEC2.getEC2Instances through the module cache
+
+    Parameters
+    ------------------------------------
+    Filters : list
+        EC2 searching filter
+    Region : str
+        AWS region name, None means the default region
+    Profile : str
+        Credentials profile name, None means the default credentials
+    Refresh : boolean
+        Ignore the cached result and get it again
+    kwargs : dict
+        Other parameters of ListEC2.getEC2Instances
+
+    Returns
+    ------------------------------------
+    status: int
+        Return code
+    EC2InstanceList : list
+        EC2Instance, shared with the cache so don't modify it
+    """
+
+    logger.debug("start")
+    logger.debug("__VERSION__ = %s", __VERSION__)
+
+    #-------------------------------------------------------
+    # Variables
+    #-------------------------------------------------------
+    status = Status()
+    if kwargs.get("AsDict"):
+        logger.debug("end")
+        return ListEC2.getEC2Instances(Filters, Region=Region, Profile=Profile, **kwargs)
+
+    try:
+        key = json.dumps([Region, Profile, normalizeFilters(Filters), sorted(kwargs.items())], default=str)
+    except Exception as e:
+        logger.error(f"Exception: {e}\n{traceback.format_exc()}")
+        logger.debug("end")
+        return status.fail, None
+
+    #-------------------------------------------------------
+    # Cached Result
+    #-------------------------------------------------------
+    if not Refresh:
+        EC2InstanceList = cache.get(key)
+        if EC2InstanceList is not None:
+            logger.debug("end")
+            return status.success, EC2InstanceList
+
+    #-------------------------------------------------------
+    # Get and Store
+    #-------------------------------------------------------
+    ret, EC2InstanceList = ListEC2.getEC2Instances(Filters, Region=Region, Profile=Profile, **kwargs)
+    if ret == status.success:
+        cache.put(key, EC2InstanceList, {f["Name"] for f in Filters})
+
+    logger.debug("end")
+    return ret, EC2InstanceList
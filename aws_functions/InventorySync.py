@@ -0,0 +1,389 @@
+# -*- coding: utf-8 -*-
+################################################################################
+# Incremental inventory kept current by EC2 state-change events
+#-------------------------------------------------------------------------------
+# An InventorySync is seeded once with a full getEC2Instances of its Filters.
+# After that, "EC2 Instance State-change Notification" events of EventBridge
+# are applied to it (apply / handleEvent), and the fleet is scanned again only
+# every ReconcileInterval seconds to catch what the events missed (another
+# container got them, tag changes, ...).
+#
+#     sync = InventorySync.getSync(Filters)
+#     sync.apply(event)
+#     ret, EC2InstanceList = sync.current()
+#
+# Events of instances that are not in the inventory (launched, or now
+# matching a state filter) are resolved on the next current() by describing
+# just those ids with Filters, so instances outside Filters stay out.
+################################################################################
+import datetime
+import fnmatch
+import threading
+import time
+import traceback
+
+from . import __VERSION__
+from . import Status
+from . import ListEC2
+from .Inventory import Inventory, STATE, INSTANCE_ID
+from .InventoryCache import normalizeFilters
+from .log import logger, LazyRepr
+
+
+################################################################################
+# variables
+################################################################################
+DETAIL_TYPE = "EC2 Instance State-change Notification"
+SOURCE = "aws.ec2"
+_RECONCILE_INTERVAL = 3600
+# values per describe_instances filter
+_ID_CHUNK_SIZE = 200
+STATE_CODES = {
+    "pending": 0,
+    "running": 16,
+    "shutting-down": 32,
+    "terminated": 48,
+    "stopping": 64,
+    "stopped": 80,
+}
+
+# (Region, Profile, normalized Filters) -> InventorySync
+# kept at module level so that warm Lambda invocations share them
+_syncs = {}
+_lock = threading.Lock()
+
+
+################################################################################
+# Events
+################################################################################
+def isStateChange(event):
+    """
+    True when the event is an EC2 Instance State-change Notification
+    """
+
+    return type(event) == dict and event.get("detail-type") == DETAIL_TYPE
+
+
+def _eventTime(event):
+    """
+    Epoch seconds of the event "time", None when missing or invalid
+    """
+
+    try:
+        return datetime.datetime.fromisoformat(event["time"].replace("Z", "+00:00")).timestamp()
+    except Exception:
+        return None
+
+
+def makeEvent(InstanceId, State, Time=None, Region="us-east-1", Account="123456789012"):
+    """
+    Make a synthetic EC2 Instance State-change Notification event
+
+    Parameters
+    ------------------------------------
+    InstanceId : str
+        EC2 Instance Id
+    State : str
+        New state name such as "running"
+    Time : float
+        Epoch seconds of the change, now when None
+    Region : str
+        AWS region name of the event
+    Account : str
+        AWS account id of the event
+
+    Returns
+    ------------------------------------
+    event : dict
+        Event as EventBridge delivers it
+    """
+
+    if Time is None:
+        Time = time.time()
+    return {
+        "version": "0",
+        "id": f"{InstanceId}-{State}-{Time}",
+        "detail-type": DETAIL_TYPE,
+        "source": SOURCE,
+        "account": Account,
+        "time": datetime.datetime.fromtimestamp(Time, datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "region": Region,
+        "resources": [f"arn:aws:ec2:{Region}:{Account}:instance/{InstanceId}"],
+        "detail": {"instance-id": InstanceId, "state": State}
+    }
+
+
+################################################################################
+# InventorySync
+################################################################################
+class InventorySync:
+    """
+    Inventory of the instances of Filters, updated by state-change events
+
+    Parameters
+    ------------------------------------
+    Filters : list
+        EC2 searching filter
+    Region : str
+        AWS region name, None means the default region
+    Profile : str
+        Credentials profile name, None means the default credentials
+    ReconcileInterval : int
+        Seconds after which current() scans the whole fleet again
+    """
+
+    def __init__(self, Filters, Region=None, Profile=None, ReconcileInterval=_RECONCILE_INTERVAL):
+        self.Filters = Filters
+        self.Region = Region
+        self.Profile = Profile
+        self.ReconcileInterval = ReconcileInterval
+        self.inventory = None
+        # epoch seconds of the last full scan
+        self.reconciled = None
+        # EC2 Instance Id -> epoch seconds of the last event applied
+        self._eventTimes = {}
+        # EC2 Instance Ids of events not in the inventory
+        self._unknown = set()
+        # state values of Filters, evaluated locally as the events change them
+        self._states = [v for f in Filters if f["Name"] == STATE for v in f["Values"]]
+        self._lock = threading.RLock()
+
+    #-------------------------------------------------------
+    # Full Scan
+    #-------------------------------------------------------
+    def reconcile(self):
+        """
+        Scan the whole fleet of Filters and replace the inventory
+
+        Returns
+        ------------------------------------
+        status: int
+            Return code
+        drift : dict
+            Differences the events had missed, empty on the first scan
+            {"Added": [ids], "Removed": [ids], "Changed": [ids]}
+        """
+
+        logger.debug("start")
+        status = Status()
+        started = time.time()
+        ret, EC2InstanceList = ListEC2.getEC2Instances(self.Filters, Region=self.Region, Profile=self.Profile)
+        if ret != status.success:
+            logger.debug("end")
+            return status.fail, {}
+
+        with self._lock:
+            drift = {}
+            if self.inventory is not None:
+                old = {i.InstanceId: i.stateName for i in self.inventory}
+                new = {i.InstanceId: i.stateName for i in EC2InstanceList}
+                drift = {
+                    "Added": [i for i in new if i not in old],
+                    "Removed": [i for i in old if i not in new and self._matchesState(old[i])],
+                    "Changed": [i for i in new if i in old and new[i] != old[i]],
+                }
+                if any(drift.values()):
+                    logger.info(f"Inventory drift: {drift}")
+            self.inventory = Inventory(EC2InstanceList)
+            self.reconciled = started
+            # events older than the scan are in it already
+            self._eventTimes = {i: t for i, t in self._eventTimes.items() if t >= int(started)}
+            self._unknown.clear()
+        logger.debug("%s instance(s) in the inventory", len(self.inventory))
+        logger.debug("end")
+        return status.success, drift
+
+    def seed(self):
+        """
+        First full scan, the same as reconcile
+        """
+        return self.reconcile()
+
+    #-------------------------------------------------------
+    # Events
+    #-------------------------------------------------------
+    def apply(self, event):
+        """
+        Apply an EC2 Instance State-change Notification event
+        Events older than the last one applied to the instance, or than the
+        last full scan, are ignored since EventBridge doesn't keep the order
+
+        Parameters
+        ------------------------------------
+        event : dict
+            EventBridge event
+
+        Returns
+        ------------------------------------
+        applied : boolean
+            True when the inventory changed or the instance is to be resolved
+        """
+
+        if not isStateChange(event):
+            return False
+        if self.Region is not None and event.get("region") not in (None, self.Region):
+            return False
+        detail = event.get("detail", {})
+        InstanceId = detail.get("instance-id")
+        state = detail.get("state")
+        if InstanceId is None or state is None:
+            logger.warning(f"Invalid event: {event}")
+            return False
+        eventTime = _eventTime(event) or time.time()
+
+        with self._lock:
+            if self.inventory is None:
+                # the first scan will see it
+                return False
+            # event times are in seconds, an event of the second of the scan is applied
+            if self.reconciled is not None and eventTime < int(self.reconciled):
+                return False
+            if eventTime < self._eventTimes.get(InstanceId, 0):
+                return False
+            self._eventTimes[InstanceId] = eventTime
+
+            if InstanceId not in self.inventory:
+                self._unknown.add(InstanceId)
+                logger.debug("unknown instance: %s", InstanceId)
+                return True
+            self.setState(InstanceId, state)
+        return True
+
+    def setState(self, InstanceId, state):
+        """
+        Set the state of an instance in the inventory, e.g. after acting on it
+        """
+        with self._lock:
+            if self.inventory is None:
+                return
+            self.inventory.update(
+                InstanceId,
+                State={"Code": STATE_CODES.get(state, -1), "Name": state}
+            )
+
+    def _resolve(self):
+        """
+        Describe the unknown instances with Filters and add the ones matching
+        """
+        status = Status()
+        with self._lock:
+            unknown = sorted(self._unknown)
+            self._unknown.clear()
+        if not unknown:
+            return status.success
+
+        # an instance-id filter of Filters is applied here, the request has its own
+        patterns = [v for f in self.Filters if f["Name"] == INSTANCE_ID for v in f["Values"]]
+        if patterns:
+            unknown = [i for i in unknown if any(fnmatch.fnmatchcase(i, p) for p in patterns)]
+        logger.debug("resolve: %s", LazyRepr(unknown))
+        filters = [f for f in self.Filters if f["Name"] not in (STATE, INSTANCE_ID)]
+        ret = status.success
+        for i in range(0, len(unknown), _ID_CHUNK_SIZE):
+            chunk = unknown[i:i + _ID_CHUNK_SIZE]
+            r, EC2InstanceList = ListEC2.getEC2Instances(
+                filters + [{"Name": INSTANCE_ID, "Values": chunk}],
+                Region=self.Region,
+                Profile=self.Profile
+            )
+            if r != status.success:
+                with self._lock:
+                    self._unknown.update(chunk)
+                ret = status.fail
+                continue
+            with self._lock:
+                for instance in EC2InstanceList:
+                    self.inventory.add(instance)
+        return ret
+
+    #-------------------------------------------------------
+    # Result
+    #-------------------------------------------------------
+    def _matchesState(self, stateName):
+        if not self._states:
+            return True
+        return any(fnmatch.fnmatchcase(stateName, pattern) for pattern in self._states)
+
+    def current(self, Reconcile=False):
+        """
+        Instances of Filters now, as known from the last scan and the events
+        Scans the whole fleet first when not seeded yet, when the last scan
+        is older than ReconcileInterval, or when Reconcile is True
+
+        Returns
+        ------------------------------------
+        status: int
+            Return code
+        EC2InstanceList : list
+            EC2Instance, owned by the inventory so don't modify it
+        """
+
+        logger.debug("start")
+        status = Status()
+        try:
+            stale = self.reconciled is None or time.time() - self.reconciled >= self.ReconcileInterval
+            if Reconcile or stale:
+                ret, _ = self.reconcile()
+                if ret != status.success:
+                    logger.debug("end")
+                    return status.fail, None
+            elif self._resolve() != status.success:
+                logger.warning("Failed to resolve some instances, they are retried next time")
+
+            with self._lock:
+                EC2InstanceList = [i for i in self.inventory if self._matchesState(i.stateName)]
+        except Exception as e:
+            logger.error(f"Exception: {e}\n{traceback.format_exc()}")
+            logger.debug("end")
+            return status.fail, None
+
+        logger.debug("end")
+        return status.success, EC2InstanceList
+
+
+################################################################################
+# Module Level Syncs
+################################################################################
+def getSync(Filters, Region=None, Profile=None, ReconcileInterval=_RECONCILE_INTERVAL):
+    """
+    Shared InventorySync of (Filters, Region, Profile), made on the first call
+    """
+
+    key = (Region, Profile, normalizeFilters(Filters))
+    with _lock:
+        sync = _syncs.get(key)
+        if sync is None:
+            sync = InventorySync(Filters, Region, Profile, ReconcileInterval)
+            _syncs[key] = sync
+    return sync
+
+
+def handleEvent(event):
+    """
+    Apply a state-change event to every shared InventorySync
+
+    Returns
+    ------------------------------------
+    status: int
+        success when it is a state-change event, fail when not
+    msg : str
+        Result message
+    """
+
+    status = Status()
+    if not isStateChange(event):
+        return status.fail, "Not an EC2 Instance State-change Notification"
+    with _lock:
+        syncs = list(_syncs.values())
+    applied = sum(1 for sync in syncs if sync.apply(event))
+    detail = event.get("detail", {})
+    return status.success, f"{detail.get('instance-id')} {detail.get('state')}: applied to {applied} inventory(ies)"
+
+
+def clearSyncs():
+    """
+    Drop every shared InventorySync
+    """
+
+    with _lock:
+        _syncs.clear()
@@ -1,11 +1,13 @@
 # -*- coding: utf-8 -*-
 import traceback
 
-import boto3
-
 from . import __VERSION__
 from . import Status
-from .log import logger
+from . import ClientPool
+from . import Metrics
+from . import Projection
+from .EC2Instance import EC2Instance
+from .log import logger, LazyRepr
 
 
 ################################################################################
@@ -17,7 +19,7 @@ _MAX_RESULTS = 100
 ################################################################################
 # extractEC2Info
 ################################################################################
-def extractEC2Info(response):
+def extractEC2Info(response, Fields = Projection.FIELDS, AsDict = False, Consume = False):
     """
     Extract necessary information to Start/Stop E2 instances
     
@@ -25,72 +27,43 @@ def extractEC2Info(response):
     ------------------------------------
     response : dict
         EC2 search result
+    Fields : tuple
+        Instance fields to keep (see Projection.FIELDS)
+    AsDict : boolean
+        Return dict instead of EC2Instance
+    Consume : boolean
+        Remove the reservations from the response while extracting
+        (see Projection.iterInstances)
 
     Returns
     ------------------------------------
     status: int
         Return code
-    EC2InfoList : dict
-        EC2 information extract result
+    EC2InfoList : list
+        EC2 information extract result as EC2Instance, or dict when AsDict is True
     """
 
     logger.debug("start")
-    logger.debug(f"{__VERSION__ = }")
+    logger.debug("__VERSION__ = %s", __VERSION__)
 
     #-------------------------------------------------------
     # Variables
     #-------------------------------------------------------
     status = Status()
-    NA = "NA"
-    getEc2Param = lambda keyword: instance[keyword] if keyword in instance else NA
-    EC2InfoList = []
 
     #-------------------------------------------------------
     # Extract EC2 Information
     #-------------------------------------------------------
-    for reservation in response["Reservations"]:
-        EC2Info = {}
-        for instance in reservation["Instances"]:
-            # InstanceId
-            InstanceId = getEc2Param("InstanceId")
-            if InstanceId == NA:
-                break
-
-            # VpcId
-            VpcId = getEc2Param("VpcId")
-            # SubnetId
-            SubnetId = getEc2Param("SubnetId")
-            # PrivateIpAddress
-            PrivateIpAddress = getEc2Param("PrivateIpAddress")
-            # Placement
-            Placement = getEc2Param("Placement")
-            # PlatformDetails
-            PlatformDetails = getEc2Param("PlatformDetails")
-            # State
-            State = getEc2Param("State")
-            # StateReason
-            StateReason = getEc2Param("StateReason")
-            # KeyName
-            KeyName = getEc2Param("KeyName")
-            # MaintenanceOptions
-            MaintenanceOptions = getEc2Param("MaintenanceOptions")
-            # Tags
-            Tags = getEc2Param("Tags")
-            
-            EC2Info = {
-                "InstanceId": InstanceId,
-                "VpcId": VpcId,
-                "SubnetId": SubnetId,
-                "PrivateIpAddress": PrivateIpAddress,
-                "Placement": Placement,
-                "PlatformDetails": PlatformDetails,
-                "State": State,
-                "StateReason": StateReason,
-                "KeyName": KeyName,
-                "MaintenanceOptions": MaintenanceOptions,
-                "Tags": Tags
-            }
-            EC2InfoList.append(EC2Info)
+    if AsDict:
+        EC2InfoList = [
+            Projection.project(instance, Fields)
+            for instance in Projection.iterInstances(response, Consume)
+        ]
+    else:
+        EC2InfoList = [
+            EC2Instance.fromInstance(instance, Fields)
+            for instance in Projection.iterInstances(response, Consume)
+        ]
 
     #-------------------------------------------------------
     # Return Value
@@ -99,10 +72,147 @@ def extractEC2Info(response):
     return status.success, EC2InfoList
 
 
+################################################################################
+# getEC2InstancePage
+################################################################################
+def getEC2InstancePage(Filters, NextToken = None, PageSize = _MAX_RESULTS, Region = None, Profile = None, Fields = Projection.FIELDS, AsDict = False):
+    """
+    Get one describe_instances page of the instances of the filters given
+    The NextToken of the page is returned, so that listing can be stopped
+    and resumed from it later, even in another process
+    
+    Parameters
+    ------------------------------------
+    Filters : dict
+        EC2 searching filter (see getEC2Instances)
+    NextToken : str
+        NextToken of the previous page, None for the first page
+    PageSize: int
+        The number of EC2 instances requested per describe_instances call
+    Region : str
+        AWS region name, None means the default region
+    Profile : str
+        Credentials profile name, None means the default credentials
+    Fields : tuple
+        Instance fields to keep (see Projection.FIELDS)
+    AsDict : boolean
+        Return dict instead of EC2Instance
+
+    Returns
+    ------------------------------------
+    status: int
+        Return code
+    EC2InstanceList : list
+        EC2 information of the page, None when status is fail
+    NextToken : str
+        NextToken of the next page, None when it is the last page
+    """
+
+    logger.debug("start")
+    logger.debug("NextToken = %s", NextToken)
+
+    #-------------------------------------------------------
+    # Variables
+    #-------------------------------------------------------
+    status = Status()
+    params = {
+        "Filters": Filters,
+        "MaxResults": PageSize
+    }
+    if NextToken is not None:
+        params["NextToken"] = NextToken
+
+    #-------------------------------------------------------
+    # Searching EC2
+    #-------------------------------------------------------
+    try:
+        client = ClientPool.getClient("ec2", Region, Profile)
+        with Metrics.timer("DescribePage"):
+            response = client.describe_instances(**params)
+        logger.debug("response = %s", LazyRepr(response))
+    except Exception as e:
+        logger.error(f"Exception: {e}\n{traceback.format_exc()}")
+        logger.debug("end")
+        return status.fail, None, None
+
+    NextToken = response.get("NextToken") or None
+    # the page is ours, its reservations are released while extracting
+    _, EC2InstanceList = extractEC2Info(response, Fields, AsDict, Consume = True)
+    Metrics.count("Pages")
+    Metrics.count("Instances", len(EC2InstanceList))
+
+    #-------------------------------------------------------
+    # Return Value
+    #-------------------------------------------------------
+    logger.debug("end")
+    return status.success, EC2InstanceList, NextToken
+
+
+################################################################################
+# iterEC2Instances
+################################################################################
+def iterEC2Instances(Filters, PageSize = _MAX_RESULTS, Region = None, Profile = None, Fields = Projection.FIELDS, AsDict = False):
+    """
+    Iterate AWS EC2 instance information page by page by searching by the filters given
+    Each describe_instances page is requested with the NextToken of the previous one
+    (getEC2InstancePage), so only one page is held in memory at a time
+    
+    Parameters
+    ------------------------------------
+    Filters : dict
+        EC2 searching filter (see getEC2Instances)
+    PageSize: int
+        The number of EC2 instances requested per describe_instances call
+    Region : str
+        AWS region name, None means the default region
+    Profile : str
+        Credentials profile name, None means the default credentials
+    Fields : tuple
+        Instance fields to keep (see Projection.FIELDS)
+    AsDict : boolean
+        Return dict instead of EC2Instance
+
+    Yields
+    ------------------------------------
+    status: int
+        Return code
+    EC2InstanceList : list
+        EC2 information of one page
+        When status is fail, EC2InstanceList is None and the iteration stops
+    """
+
+    logger.debug("start")
+    logger.debug("__VERSION__ = %s", __VERSION__)
+    logger.debug("Filters = %s", Filters)
+    logger.debug("PageSize = %s", PageSize)
+
+    #-------------------------------------------------------
+    # Variables
+    #-------------------------------------------------------
+    status = Status()
+    NextToken = None
+
+    #-------------------------------------------------------
+    # Searching EC2 until there is no NextToken
+    #-------------------------------------------------------
+    while True:
+        ret, EC2InstanceList, NextToken = getEC2InstancePage(Filters, NextToken, PageSize, Region, Profile, Fields, AsDict)
+        if ret != status.success:
+            logger.debug("end")
+            yield status.fail, None
+            return
+        yield status.success, EC2InstanceList
+
+        if not NextToken:
+            break
+
+    logger.debug("end")
+
+
 ################################################################################
 # getEc2Instances
 ################################################################################
-def getEC2Instances(Filters, MaxResults = _MAX_RESULTS):
+def getEC2Instances(Filters, MaxResults = _MAX_RESULTS, Region = None, Profile = None, Fields = Projection.FIELDS, AsDict = False):
     """
     Get AWS EC2 instance information by searching by the filters given
     
@@ -122,66 +232,44 @@ def getEC2Instances(Filters, MaxResults = _MAX_RESULTS):
             }
         ]
     MaxResults: int
-        The number of EC2 instances the function gets
+        The number of EC2 instances the function gets per describe_instances call
+    Region : str
+        AWS region name, None means the default region
+    Profile : str
+        Credentials profile name, None means the default credentials
+    Fields : tuple
+        Instance fields to keep (see Projection.FIELDS)
+    AsDict : boolean
+        Return dict instead of EC2Instance
 
     Returns
     ------------------------------------
     status: int
         Return code
-    EC2InstanceList : dict
-        EC2 information
+    EC2InstanceList : list
+        EC2 information as EC2Instance, or dict when AsDict is True
     """
 
     logger.debug("start")
-    logger.debug(f"{__VERSION__ = }")
-    logger.debug(f"Filters = {Filters}")
-    logger.debug(f"MaxResults = {MaxResults}")
+    logger.debug("__VERSION__ = %s", __VERSION__)
 
     #-------------------------------------------------------
     # Variables
     #-------------------------------------------------------
     status = Status()
-    EC2InstanceList = None
+    EC2InstanceList = []
 
     #-------------------------------------------------------
-    # Searching EC2 Initial Loop
+    # Collect all pages
     #-------------------------------------------------------
-    try:
-        client = boto3.client("ec2")
-        response = client.describe_instances(
-            Filters = Filters,
-            MaxResults = MaxResults
-        )
-        logger.debug(f"response = {response}")
-    except Exception as e:
-        response = None
-        logger.error(f"Exception: {e}\n{traceback.format_exc()}")
-        logger.debug("end")
-        return status.fail, EC2InstanceList
-    _, EC2Instance = extractEC2Info(response)
-    EC2InstanceList = EC2Instance
-    
-    #-------------------------------------------------------
-    # Searching EC2 Second Loop in case there are more than MaxResults
-    #-------------------------------------------------------
-    if response is not None:
-        while "NextToken" in response:
-            try:
-                response = client.describe_instances(
-                    Filters = Filters,
-                    MaxResults = MaxResults
-                )
-                logger.debug(f"response = {response}")
-            except Exception as e:
-                logger.error(f"Exception: {e}\n{traceback.format_exc()}")
-                logger.debug("end")
-                return status.fail, EC2InstanceList
-            _, EC2Instance = extractEC2Info(response)
-            EC2InstanceList += EC2Instance
+    for ret, EC2InstancePage in iterEC2Instances(Filters, PageSize = MaxResults, Region = Region, Profile = Profile, Fields = Fields, AsDict = AsDict):
+        if ret != status.success:
+            logger.debug("end")
+            return status.fail, None
+        EC2InstanceList += EC2InstancePage
 
     #-------------------------------------------------------
     # Return Value
     #-------------------------------------------------------
     logger.debug("end")
     return status.success, EC2InstanceList
-
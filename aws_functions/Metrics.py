@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+################################################################################
+# Hot-path instrumentation
+#-------------------------------------------------------------------------------
+# Timers and counters are no-ops until enable() is called, so the call sites
+# can stay in place:
+#     with Metrics.timer("search"):
+#         ...
+#     Metrics.count("Pages")
+# ClientPool installs an after-call hook counting API calls and response
+# bytes per action. report() returns everything collected since reset().
+################################################################################
+import contextlib
+import functools
+import json
+import threading
+import time
+
+from . import RateLimit
+
+
+################################################################################
+# variables
+################################################################################
+_NAMESPACE = "AWSControl"
+_enabled = False
+_lock = threading.Lock()
+# name -> [count, seconds]
+_timings = {}
+# name -> value
+_counters = {}
+_NULL_TIMER = contextlib.nullcontext()
+
+
+################################################################################
+# Switch
+################################################################################
+def enable(flag=True):
+    """
+    Enable or disable collecting
+    """
+
+    global _enabled
+    _enabled = flag
+
+
+def isEnabled():
+    return _enabled
+
+
+def reset():
+    """
+    Drop everything collected, including the RateLimit counters
+    """
+
+    with _lock:
+        _timings.clear()
+        _counters.clear()
+    RateLimit.resetCounters()
+
+
+################################################################################
+# Timers and Counters
+################################################################################
+class _Timer:
+    __slots__ = ("name", "_start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self._start
+        with _lock:
+            timing = _timings.setdefault(self.name, [0, 0.0])
+            timing[0] += 1
+            timing[1] += elapsed
+        return False
+
+
+def timer(name):
+    """
+    Context manager adding the elapsed time of the block to the timing name
+    """
+
+    return _Timer(name) if _enabled else _NULL_TIMER
+
+
+def timed(name):
+    """
+    Decorator adding the elapsed time of each call to the timing name
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with _Timer(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def count(name, value=1):
+    """
+    Add value to the counter name
+    """
+
+    if not _enabled:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+################################################################################
+# Client Hook
+################################################################################
+def install(client):
+    """
+    Count API calls and response bytes per action of a botocore client
+    """
+
+    def afterCall(event_name, http_response, **kwargs):
+        if not _enabled:
+            return
+        action = event_name.rsplit(".", 1)[-1]
+        count("ApiCalls")
+        count(f"ApiCalls.{action}")
+        if http_response is not None:
+            count("ResponseBytes", len(http_response.content or b""))
+
+    client.meta.events.register("after-call", afterCall)
+
+
+################################################################################
+# Report
+################################################################################
+def report():
+    """
+    Everything collected since reset
+
+    Returns
+    ------------------------------------
+    report : dict
+        {
+            "Timings": {"search": {"Count": 1, "Milliseconds": 812.3}, ...},
+            "Counters": {"ApiCalls": 12, "Pages": 10, ...},
+            "RateLimit": {"Throttles": 0, ...}
+        }
+    """
+
+    with _lock:
+        timings = {
+            name: {"Count": n, "Milliseconds": round(seconds * 1000, 3)}
+            for name, (n, seconds) in _timings.items()
+        }
+        counters = dict(_counters)
+    return {
+        "Timings": timings,
+        "Counters": counters,
+        "RateLimit": RateLimit.getCounters()
+    }
+
+
+def emitEMF(Dimensions=None, Namespace=_NAMESPACE):
+    """
+    Print the report as a CloudWatch Embedded Metric Format line
+    Lambda sends stdout to CloudWatch Logs, which extracts the metrics
+
+    Parameters
+    ------------------------------------
+    Dimensions : dict
+        Dimension name and value, e.g. {"Action": "start"}
+    Namespace : str
+        CloudWatch namespace
+    """
+
+    Dimensions = Dimensions or {}
+    data = report()
+    values = {}
+    metrics = []
+    for name, timing in data["Timings"].items():
+        values[name] = timing["Milliseconds"]
+        metrics.append({"Name": name, "Unit": "Milliseconds"})
+    for name, value in list(data["Counters"].items()) + list(data["RateLimit"].items()):
+        if name in values:
+            continue
+        values[name] = value
+        unit = "Seconds" if name.endswith("Seconds") else "Bytes" if name.endswith("Bytes") else "Count"
+        metrics.append({"Name": name, "Unit": unit})
+
+    line = {
+        "_aws": {
+            "Timestamp": int(time.time() * 1000),
+            "CloudWatchMetrics": [{
+                "Namespace": Namespace,
+                "Dimensions": [list(Dimensions)],
+                "Metrics": metrics
+            }]
+        },
+        **Dimensions,
+        **values
+    }
+    print(json.dumps(line, separators=(",", ":")), flush=True)
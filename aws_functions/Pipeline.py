@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+################################################################################
+# Pipelined list -> act
+#-------------------------------------------------------------------------------
+# The describe_instances pages are the producer: as each page arrives, the
+# instances in the "Before" states are cut into chunks and put on a bounded
+# queue, and worker threads call BatchEC2 on them while the next pages are
+# still being fetched. The queue holds at most QueueSize chunks, so paging
+# waits for the workers when they fall behind and memory stays flat.
+#
+# With PreCount, every page is listed first and the number of instances is
+# checked against (minInstNum, maxInstNum) before anything is acted on, as
+# the handlers always did. Only the ids are kept for that, not the pages.
+################################################################################
+import queue
+import threading
+import time
+import traceback
+
+from . import __VERSION__
+from . import Status
+from . import BatchEC2
+from . import ListEC2
+from . import Metrics
+from . import Projection
+from .log import logger
+
+
+################################################################################
+# variables
+################################################################################
+_CHUNK_SIZE = BatchEC2._CHUNK_SIZE
+_MAX_WORKERS = 4
+_QUEUE_SIZE = 4
+_PAGE_SIZE = ListEC2._MAX_RESULTS
+
+
+################################################################################
+# _worker
+################################################################################
+def _worker(Action, chunks, results, lock, DryRun, Region, Profile, kwargs):
+    """
+    Act on the chunks of the queue until it gets None
+    """
+
+    while True:
+        chunk = chunks.get()
+        try:
+            if chunk is None:
+                return
+            _, result = BatchEC2.run(
+                Action, chunk, ChunkSize=len(chunk), MaxWorkers=1,
+                DryRun=DryRun, Region=Region, Profile=Profile, **kwargs
+            )
+            Metrics.count("PipelineChunks")
+            with lock:
+                results.update(result)
+        except Exception as e:
+            logger.error(f"Exception: {e}\n{traceback.format_exc()}")
+        finally:
+            chunks.task_done()
+
+
+################################################################################
+# run
+################################################################################
+def run(Action, Filters, Before, After, ChunkSize=_CHUNK_SIZE, MaxWorkers=_MAX_WORKERS,
+        QueueSize=_QUEUE_SIZE, PageSize=_PAGE_SIZE, PreCount=None, Fields=Projection.FIELDS,
+        Display=None, DryRun=False, Region=None, Profile=None, **kwargs):
+    """
+    List the instances of Filters and act on the ones in the Before states,
+    overlapping the describe_instances paging with the API calls
+
+    Parameters
+    ------------------------------------
+    Action : str
+        BatchEC2 action, "start", "stop" or "reboot"
+    Filters : list
+        EC2 searching filter
+    Before : tuple
+        States the action is applied to
+    After : str
+        State expected after the action
+    ChunkSize : int
+        The number of EC2 instances per API call
+    MaxWorkers : int
+        Worker threads calling the API
+    QueueSize : int
+        Chunks waiting for a worker at most, the paging blocks beyond it
+    PageSize : int
+        The number of EC2 instances per describe_instances call
+    PreCount : tuple
+        (minInstNum, maxInstNum), list everything and check the number of
+        instances before acting. None acts while listing
+    Fields : tuple
+        Instance fields to keep (see Projection.FIELDS)
+    Display : function
+        Called as Display(i, instance) for each instance listed
+    DryRun : boolean
+    Region : str
+        AWS region name, None means the default region
+    Profile : str
+        Credentials profile name, None means the default credentials
+    kwargs : dict
+        Additional parameters of the API
+
+    Returns
+    ------------------------------------
+    status: int
+        success when the listing and every instance acted on succeeded,
+        warning when some of them failed, fail otherwise
+    report : dict
+        {
+            "Listed": 120,
+            "InstanceIds": [ids acted on],
+            "ConfirmedIds": [ids already in the After state],
+            "WaitingIds": [ids in another state, e.g. pending],
+            "Results": {InstanceId: BatchEC2 result},
+            "FirstActSeconds": seconds until the first chunk was queued,
+            "Error": message when status is fail, else None
+        }
+    """
+
+    logger.debug("start")
+    logger.debug("__VERSION__ = %s", __VERSION__)
+    logger.debug("Action = %s, PreCount = %s, MaxWorkers = %s, QueueSize = %s", Action, PreCount, MaxWorkers, QueueSize)
+
+    #-------------------------------------------------------
+    # Variables
+    #-------------------------------------------------------
+    status = Status()
+    started = time.monotonic()
+    report = {
+        "Listed": 0,
+        "InstanceIds": [],
+        "ConfirmedIds": [],
+        "WaitingIds": [],
+        "Results": {},
+        "FirstActSeconds": None,
+        "Error": None
+    }
+    chunks = queue.Queue(maxsize=QueueSize)
+    lock = threading.Lock()
+    pending = []
+
+    def put(flush=False):
+        # queue the full chunks, and the rest when flush
+        while len(pending) >= ChunkSize or (flush and pending):
+            chunk = pending[:ChunkSize]
+            del pending[:ChunkSize]
+            if report["FirstActSeconds"] is None:
+                report["FirstActSeconds"] = round(time.monotonic() - started, 6)
+            # blocks while QueueSize chunks are waiting
+            chunks.put(chunk)
+
+    #-------------------------------------------------------
+    # Workers
+    #-------------------------------------------------------
+    workers = [
+        threading.Thread(
+            target=_worker,
+            args=(Action, chunks, report["Results"], lock, DryRun, Region, Profile, kwargs),
+            daemon=True
+        )
+        for _ in range(MaxWorkers)
+    ]
+    for worker in workers:
+        worker.start()
+
+    #-------------------------------------------------------
+    # Producer
+    #-------------------------------------------------------
+    try:
+        for ret, page in ListEC2.iterEC2Instances(Filters, PageSize, Region, Profile, Fields):
+            if ret != status.success:
+                report["Error"] = "Failed to get EC2 instances"
+                break
+            for instance in page:
+                report["Listed"] += 1
+                if Display is not None:
+                    Display(report["Listed"], instance)
+                stateName = instance["State"]["Name"] if type(instance["State"]) == dict else Projection.NA
+                if stateName in Before:
+                    report["InstanceIds"].append(instance["InstanceId"])
+                    pending.append(instance["InstanceId"])
+                elif stateName == After:
+                    report["ConfirmedIds"].append(instance["InstanceId"])
+                else:
+                    report["WaitingIds"].append(instance["InstanceId"])
+            if PreCount is None:
+                put()
+
+        if report["Error"] is None and PreCount is not None:
+            minInstNum, maxInstNum = PreCount
+            logger.info(f"The expected instance number(s) is {minInstNum} <= instance(s) <= {maxInstNum}")
+            if not minInstNum <= report["Listed"] <= maxInstNum:
+                report["Error"] = "The number of instance(s) is out of range"
+                report["InstanceIds"] = []
+                pending.clear()
+        if report["Error"] is None or PreCount is None:
+            # without PreCount the chunks listed before an error are acted on
+            put(flush=True)
+    except Exception as e:
+        logger.error(f"Exception: {e}\n{traceback.format_exc()}")
+        report["Error"] = str(e)
+    finally:
+        for _ in workers:
+            chunks.put(None)
+        for worker in workers:
+            worker.join()
+
+    #-------------------------------------------------------
+    # Return Value
+    #-------------------------------------------------------
+    logger.info(f"{report['Listed']} instance(s) listed, {len(report['InstanceIds'])} instance(s) requested to {Action}")
+    logger.debug("end")
+    if report["Error"] is not None:
+        return status.fail, report
+    acted = report["InstanceIds"]
+    failed = [i for i in acted if report["Results"].get(i, {}).get("Status") != status.success]
+    if len(failed) == 0:
+        return status.success, report
+    if len(failed) == len(acted):
+        report["Error"] = f"Failed to {Action} EC2 instances: {acted}"
+        return status.fail, report
+    return status.warning, report
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+################################################################################
+# Projection of describe_instances responses
+#-------------------------------------------------------------------------------
+# EC2 has no server-side field selection, so the page is trimmed right after
+# botocore parses it: only the declared fields of each instance are kept and,
+# when the caller owns the response (Consume), each reservation is detached
+# from it as soon as it is read.
+# Everything else (BlockDeviceMappings, NetworkInterfaces, SecurityGroups...)
+# becomes garbage while the page is still being processed.
+################################################################################
+
+
+################################################################################
+# variables
+################################################################################
+NA = "NA"
+# Fields extractEC2Info keeps
+FIELDS = (
+    "InstanceId",
+    "VpcId",
+    "SubnetId",
+    "PrivateIpAddress",
+    "Placement",
+    "PlatformDetails",
+    "State",
+    "StateReason",
+    "KeyName",
+    "MaintenanceOptions",
+    "Tags",
+)
+
+
+################################################################################
+# iterInstances
+################################################################################
+def iterInstances(response, Consume=False):
+    """
+    Iterate the instances of a describe_instances response
+
+    Parameters
+    ------------------------------------
+    response : dict
+        describe_instances response
+    Consume : boolean
+        Remove the reservations from the response while iterating, so the
+        response is empty afterwards. Only for a response nobody reads again
+
+    Yields
+    ------------------------------------
+    instance : dict
+        Instance of the response
+    """
+
+    reservations = response.get("Reservations") or []
+    if not Consume:
+        yield from _iterReservations(reservations)
+        return
+    response["Reservations"] = []
+    # pop from the end to drop each reservation as soon as it is read
+    reservations.reverse()
+    while reservations:
+        reservation = reservations.pop()
+        for instance in reservation.get("Instances", []):
+            # keep the original behaviour: an instance without InstanceId ends the reservation
+            if "InstanceId" not in instance:
+                break
+            yield instance
+        del reservation
+
+
+def _iterReservations(reservations):
+    for reservation in reservations:
+        for instance in reservation.get("Instances", []):
+            # keep the original behaviour: an instance without InstanceId ends the reservation
+            if "InstanceId" not in instance:
+                break
+            yield instance
+
+
+################################################################################
+# project
+################################################################################
+def project(instance, Fields=FIELDS):
+    """
+    Copy the declared fields of an instance
+
+    Parameters
+    ------------------------------------
+    instance : dict
+        Instance of a describe_instances response
+    Fields : tuple
+        Field names to keep
+
+    Returns
+    ------------------------------------
+    EC2Info : dict
+        Fields given, "NA" when the instance doesn't have it
+    """
+
+    return {keyword: instance[keyword] if keyword in instance else NA for keyword in Fields}
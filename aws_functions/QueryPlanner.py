@@ -0,0 +1,367 @@
+# -*- coding: utf-8 -*-
+################################################################################
+# Many filter sets in few describe_instances calls
+#-------------------------------------------------------------------------------
+# Callers needing several overlapping filter sets (per team, per environment)
+# give them all at once:
+#
+#     ret, result = QueryPlanner.run({
+#         "team-a": [{"Name": "tag:team", "Values": ["a"]}, {"Name": "tag:env", "Values": ["prd"]}],
+#         "team-b": [{"Name": "tag:team", "Values": ["b"]}, {"Name": "tag:env", "Values": ["prd"]}],
+#     })
+#     result["Results"]["team-a"]
+#
+# The planner combines the sets into as few queries as it can:
+#   - sets with the same filters apart from the values of one name are
+#     merged into one set with the values of that name united, e.g. the two
+#     above become tag:team in (a, b) and tag:env = prd
+#   - a set covered by a broader one is served by it
+#   - filters of the same name in a set are ANDed as describe_instances does,
+#     so such a name is never merged, and a set with a filter of no values
+#     matches nothing without a query
+#   - sets with known instance ids are served by one instance-id query of
+#     all their ids, up to 200 ids per call
+# The queries run concurrently, the instances are deduplicated by id, and
+# each set is split back by evaluating its filters locally. Filters that
+# can't be evaluated locally (e.g. instance-type) keep their own query.
+################################################################################
+import fnmatch
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from . import __VERSION__
+from . import Status
+from . import ListEC2
+from . import Metrics
+from .Inventory import TAG_KEY, STATE, VPC, SUBNET, AZ, INSTANCE_ID
+from .log import logger
+
+
+################################################################################
+# variables
+################################################################################
+_MAX_WORKERS = 8
+# values per describe_instances filter
+_MAX_VALUES = 200
+_TAG_PREFIX = "tag:"
+
+# filter name -> values of an EC2Instance for it
+_LOCAL = {
+    INSTANCE_ID: lambda i: (i.InstanceId,),
+    STATE: lambda i: (i.stateName,),
+    VPC: lambda i: (i.VpcId,),
+    SUBNET: lambda i: (i.SubnetId,),
+    AZ: lambda i: (i.availabilityZone,),
+    TAG_KEY: lambda i: i.TagDict.keys(),
+}
+
+
+################################################################################
+# Local Evaluation
+################################################################################
+def isLocal(Name):
+    """
+    True when the filter Name can be evaluated on an EC2Instance
+    """
+    return Name in _LOCAL or Name.startswith(_TAG_PREFIX)
+
+
+def _isPattern(value):
+    return "*" in value or "?" in value
+
+
+def _valueMatches(value, patterns):
+    for pattern in patterns:
+        if _isPattern(pattern):
+            # only * and ? are wildcards for describe_instances
+            if fnmatch.fnmatchcase(value, pattern.replace("[", "[[]")):
+                return True
+        elif value == pattern:
+            return True
+    return False
+
+
+def matches(instance, Filters):
+    """
+    True when the instance matches every filter, as describe_instances does
+    Every filter name must be local (see isLocal)
+    """
+
+    for f in Filters:
+        Name = f["Name"]
+        if Name.startswith(_TAG_PREFIX):
+            value = instance.TagDict.get(Name[len(_TAG_PREFIX):])
+            values = () if value is None else (value,)
+        else:
+            values = _LOCAL[Name](instance)
+        if not any(_valueMatches(value, f["Values"]) for value in values):
+            return False
+    return True
+
+
+################################################################################
+# Plan
+################################################################################
+def _normalize(Filters):
+    """
+    {Name: frozenset of clauses}, a clause being the frozenset of the Values
+    of one filter. describe_instances ANDs the filters, so two filters of
+    the same name (e.g. two tag-key filters) stay two clauses
+    """
+    normalized = {}
+    for f in Filters:
+        normalized.setdefault(f["Name"], set()).add(frozenset(f["Values"]))
+    return {Name: frozenset(clauses) for Name, clauses in normalized.items()}
+
+
+def _toFilters(normalized):
+    return [
+        {"Name": Name, "Values": sorted(values)}
+        for Name, clauses in sorted(normalized.items())
+        for values in sorted(clauses, key=sorted)
+    ]
+
+
+def _isEmpty(normalized):
+    """
+    True when a filter has no values, so that no instance matches it
+    """
+    return any(not values for clauses in normalized.values() for values in clauses)
+
+
+def _covers(broad, narrow):
+    """
+    True when every instance of narrow is an instance of broad
+    Values are compared as strings, a pattern only covers itself
+    """
+    for Name, clauses in broad.items():
+        for values in clauses:
+            if not any(other <= values for other in narrow.get(Name, ())):
+                return False
+    return True
+
+
+def _absorb(groups):
+    """
+    Groups covered by a broader one moved into it
+    """
+    kept = []
+    for group in groups:
+        for other in kept:
+            if _covers(other[0], group[0]):
+                other[1] += group[1]
+                break
+        else:
+            # the new one may be the broader one
+            covered = [other for other in kept if _covers(group[0], other[0])]
+            for other in covered:
+                group[1] += other[1]
+                kept.remove(other)
+            kept.append(group)
+    return kept
+
+
+def _mergeBy(groups, Name):
+    """
+    Groups equal apart from the values of Name merged, up to _MAX_VALUES values
+    Only a single filter of Name can be merged, the values of the filters of
+    a repeated name aren't interchangeable
+    """
+    buckets = {}
+    for group in groups:
+        f = group[0]
+        key = None
+        if len(f.get(Name, ())) == 1:
+            key = frozenset((n, v) for n, v in f.items() if n != Name)
+        buckets.setdefault(key, []).append(group)
+
+    merged = list(buckets.pop(None, []))
+    for bucket in buckets.values():
+        current = None
+        for f, sets in bucket:
+            values, = f[Name]
+            if current is not None:
+                union = next(iter(current[0][Name])) | values
+                if len(union) <= _MAX_VALUES:
+                    current[0][Name] = frozenset((union,))
+                    current[1] += sets
+                    continue
+            current = [dict(f), list(sets)]
+            merged.append(current)
+    return merged
+
+
+def plan(FilterSets):
+    """
+    Queries serving the filter sets
+
+    Parameters
+    ------------------------------------
+    FilterSets : list
+        EC2 searching filters, one list of filters per set
+
+    Returns
+    ------------------------------------
+    queries : list
+        [
+            {
+                "Filters": filters of the describe_instances call,
+                "Sets": [indexes of FilterSets it serves],
+                "Local": True when the sets are split out locally
+            }
+        ]
+    """
+
+    logger.debug("start")
+    normalized = [_normalize(Filters) for Filters in FilterSets]
+    queries = []
+    # a filter without values matches nothing, the set needs no query
+    served = {n for n, f in enumerate(normalized) if _isEmpty(f)}
+
+    #-------------------------------------------------------
+    # Known Instance Ids
+    #-------------------------------------------------------
+    # exact ids, the other filters of the set are evaluated locally
+    idSets = [
+        n for n, f in enumerate(normalized)
+        if n not in served and INSTANCE_ID in f and all(isLocal(Name) for Name in f)
+        and not any(_isPattern(v) for values in f[INSTANCE_ID] for v in values)
+    ]
+    ids = sorted({i for n in idSets for values in normalized[n][INSTANCE_ID] for i in values})
+    served.update(idSets)
+    for i in range(0, len(ids), _MAX_VALUES):
+        queries.append({
+            "Filters": [{"Name": INSTANCE_ID, "Values": ids[i:i + _MAX_VALUES]}],
+            "Sets": idSets,
+            "Local": True
+        })
+
+    #-------------------------------------------------------
+    # Own Queries
+    #-------------------------------------------------------
+    # filters describe_instances evaluates, identical sets share one
+    own = {}
+    for n, f in enumerate(normalized):
+        if n not in served and not all(isLocal(Name) for Name in f):
+            own.setdefault(repr(_toFilters(f)), {"Filters": _toFilters(f), "Sets": [], "Local": False})["Sets"].append(n)
+    queries += own.values()
+
+    #-------------------------------------------------------
+    # Merged Queries
+    #-------------------------------------------------------
+    # [normalized filters, indexes of FilterSets]
+    groups = [
+        [f, [n]] for n, f in enumerate(normalized)
+        if n not in served and all(isLocal(Name) for Name in f)
+    ]
+    names = sorted({Name for f, _ in groups for Name in f})
+    while True:
+        count = len(groups)
+        groups = _absorb(groups)
+        for Name in names:
+            groups = _mergeBy(groups, Name)
+        if len(groups) == count:
+            break
+    for f, sets in groups:
+        queries.append({"Filters": _toFilters(f), "Sets": sorted(sets), "Local": True})
+
+    logger.info(f"{len(FilterSets)} filter set(s) in {len(queries)} query(ies)")
+    logger.debug("end")
+    return queries
+
+
+################################################################################
+# run
+################################################################################
+def run(FilterSets, MaxWorkers=_MAX_WORKERS, Region=None, Profile=None):
+    """
+    Get the instances of many filter sets with the queries of plan
+
+    Parameters
+    ------------------------------------
+    FilterSets : list or dict
+        EC2 searching filters per set, as a list or as {name: Filters}
+    MaxWorkers : int
+        The number of queries run concurrently
+    Region : str
+        AWS region name, None means the default region
+    Profile : str
+        Credentials profile name, None means the default credentials
+
+    Returns
+    ------------------------------------
+    status: int
+        success when all queries succeeded,
+        warning when some of them failed, fail when all of them failed
+    result : dict
+        {
+            "Results": EC2Instance lists in the shape of FilterSets,
+                       None for a set whose query failed,
+            "Instances": {InstanceId: EC2Instance} of every set,
+            "Queries": describe_instances queries run
+        }
+    """
+
+    logger.debug("start")
+    logger.debug("__VERSION__ = %s", __VERSION__)
+    status = Status()
+    names = list(FilterSets) if type(FilterSets) == dict else None
+    sets = [FilterSets[name] for name in names] if names is not None else list(FilterSets)
+
+    queries = plan(sets)
+
+    #-------------------------------------------------------
+    # Concurrent Queries
+    #-------------------------------------------------------
+    def query(q):
+        try:
+            return ListEC2.getEC2Instances(q["Filters"], Region=Region, Profile=Profile)
+        except Exception as e:
+            logger.error(f"Exception: {e}\n{traceback.format_exc()}")
+            return status.fail, None
+
+    with Metrics.timer("QueryPlanner"):
+        if queries:
+            with ThreadPoolExecutor(max_workers=min(MaxWorkers, len(queries))) as executor:
+                responses = list(executor.map(query, queries))
+        else:
+            responses = []
+
+    #-------------------------------------------------------
+    # Dedupe and Split
+    #-------------------------------------------------------
+    instances = {}
+    results = [[] for _ in sets]
+    seen = [set() for _ in sets]
+    failed = set()
+    for q, (ret, EC2InstanceList) in zip(queries, responses):
+        if ret != status.success:
+            failed.update(q["Sets"])
+            continue
+        for instance in EC2InstanceList:
+            # the first copy of an instance is kept for every set
+            instance = instances.setdefault(instance.InstanceId, instance)
+            for n in q["Sets"]:
+                if instance.InstanceId in seen[n]:
+                    continue
+                if q["Local"] and not matches(instance, sets[n]):
+                    continue
+                seen[n].add(instance.InstanceId)
+                results[n].append(instance)
+    for n in failed:
+        results[n] = None
+
+    #-------------------------------------------------------
+    # Return Value
+    #-------------------------------------------------------
+    result = {
+        "Results": dict(zip(names, results)) if names is not None else results,
+        "Instances": instances,
+        "Queries": len(queries)
+    }
+    logger.debug("end")
+    if not failed:
+        return status.success, result
+    if len(failed) == len(sets):
+        return status.fail, result
+    return status.warning, result
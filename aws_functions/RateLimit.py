@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+################################################################################
+# Client-side rate limiting and adaptive retry of the AWS API calls
+#-------------------------------------------------------------------------------
+# ClientPool installs this into every client it creates. Each attempt of an
+# API call takes a token from the bucket of (profile, region, API action)
+# first. A throttling error halves the rate of the bucket and every success
+# raises it again a little (AIMD), and the call is retried with exponential
+# backoff and full jitter. botocore's own retries are disabled on those
+# clients (see CONFIG) so that the attempts are counted here only.
+################################################################################
+import random
+import threading
+import time
+import weakref
+
+from .log import logger
+
+
+################################################################################
+# variables
+################################################################################
+_RATE = 20.0
+_MAX_RATE = 100.0
+_MIN_RATE = 0.5
+_RATE_INCREMENT = 1.0
+_BURST = 20
+_MAX_ATTEMPTS = 6
+_BASE_DELAY = 0.5
+_MAX_DELAY = 20.0
+THROTTLE_ERRORS = {
+    "RequestLimitExceeded",
+    "Throttling",
+    "ThrottlingException",
+    "TooManyRequestsException",
+}
+RETRYABLE_ERRORS = THROTTLE_ERRORS | {
+    "InternalError",
+    "InternalFailure",
+    "ServiceUnavailable",
+    "Unavailable",
+}
+
+_buckets = {}
+_bucketsLock = threading.Lock()
+# clients install was called on
+_installed = weakref.WeakSet()
+_counters = {
+    "Calls": 0,
+    "Throttles": 0,
+    "Retries": 0,
+    "WaitSeconds": 0.0,
+    "BackoffSeconds": 0.0,
+}
+_countersLock = threading.Lock()
+
+
+################################################################################
+# Counters
+################################################################################
+def _count(name, value=1):
+    with _countersLock:
+        _counters[name] += value
+
+
+def getCounters():
+    """
+    Counters since the last resetCounters
+
+    Returns
+    ------------------------------------
+    counters : dict
+        Calls          : API call attempts
+        Throttles      : throttling errors received
+        Retries        : attempts retried
+        WaitSeconds    : time spent waiting for a token
+        BackoffSeconds : time spent backing off before retries
+    """
+
+    with _countersLock:
+        return dict(_counters)
+
+
+def resetCounters():
+    """
+    Reset every counter to 0
+    """
+
+    with _countersLock:
+        for name in _counters:
+            _counters[name] = type(_counters[name])()
+
+
+################################################################################
+# TokenBucket
+################################################################################
+class TokenBucket:
+    """
+    Token bucket whose rate adapts to throttling
+
+    Parameters
+    ------------------------------------
+    Rate : float
+        Tokens added per second
+    Burst : int
+        Maximum tokens kept
+    """
+
+    def __init__(self, Rate=_RATE, Burst=_BURST):
+        self.Rate = Rate
+        self.Burst = Burst
+        self._tokens = float(Burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.Burst, self._tokens + (now - self._updated) * self.Rate)
+        self._updated = now
+
+    def acquire(self):
+        """
+        Take a token, waiting for it when the bucket is empty
+
+        Returns
+        ------------------------------------
+        waited : float
+            Seconds waited
+        """
+        waited = 0.0
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                delay = (1 - self._tokens) / self.Rate
+            time.sleep(delay)
+            waited += delay
+
+    def throttled(self):
+        """
+        Halve the rate and drop the tokens left
+        """
+        with self._lock:
+            self.Rate = max(_MIN_RATE, self.Rate / 2)
+            self._tokens = 0.0
+
+    def succeeded(self):
+        """
+        Raise the rate by a step
+        """
+        with self._lock:
+            self.Rate = min(_MAX_RATE, self.Rate + _RATE_INCREMENT)
+
+
+def getBucket(Profile, Region, Action):
+    """
+    Shared bucket of (profile, region, API action)
+    """
+
+    key = (Profile, Region, Action)
+    bucket = _buckets.get(key)
+    if bucket is None:
+        with _bucketsLock:
+            bucket = _buckets.setdefault(key, TokenBucket())
+    return bucket
+
+
+################################################################################
+# Client Hooks
+################################################################################
+# Retries are done by the needs-retry handler of install
+CONFIG = {"retries": {"mode": "standard", "total_max_attempts": 1}}
+
+
+def _action(event_name):
+    # e.g. before-send.ec2.DescribeInstances -> DescribeInstances
+    return event_name.rsplit(".", 1)[-1]
+
+
+def install(client, Profile=None, MaxAttempts=_MAX_ATTEMPTS):
+    """
+    Register the rate limiter and the retry handler on a botocore client
+    The client should be created with CONFIG
+
+    Parameters
+    ------------------------------------
+    client : botocore.client.BaseClient
+        Client to be limited
+    Profile : str
+        Credentials profile name or role ARN, the account part of the bucket key
+    MaxAttempts : int
+        Attempts of a call including the first one
+    """
+
+    Region = client.meta.region_name
+
+    def beforeSend(event_name, **kwargs):
+        waited = getBucket(Profile, Region, _action(event_name)).acquire()
+        _count("Calls")
+        if waited:
+            _count("WaitSeconds", waited)
+
+    def afterCall(event_name, http_response, **kwargs):
+        if http_response is not None and http_response.status_code < 300:
+            getBucket(Profile, Region, _action(event_name)).succeeded()
+
+    def needsRetry(event_name, response, attempts, caught_exception, **kwargs):
+        if caught_exception is not None:
+            code = type(caught_exception).__name__
+        elif response is not None:
+            http_response, parsed = response
+            code = parsed.get("Error", {}).get("Code")
+            if code is None and http_response.status_code >= 500:
+                code = "InternalError"
+            if code not in RETRYABLE_ERRORS:
+                return None
+        else:
+            return None
+
+        if code in THROTTLE_ERRORS:
+            _count("Throttles")
+            getBucket(Profile, Region, _action(event_name)).throttled()
+        if attempts >= MaxAttempts:
+            logger.warning(f"{_action(event_name)}: {code}: giving up after {attempts} attempt(s)")
+            return None
+
+        delay = random.uniform(0, min(_MAX_DELAY, _BASE_DELAY * (2 ** attempts)))
+        logger.info(f"{_action(event_name)}: {code}: retry in {delay:.2f} seconds")
+        _count("Retries")
+        _count("BackoffSeconds", delay)
+        return delay
+
+    events = client.meta.events
+    events.register("before-send", beforeSend)
+    events.register("after-call", afterCall)
+    events.register("needs-retry", needsRetry)
+    _installed.add(client)
+
+
+def isInstalled(client):
+    """
+    True when the client retries RETRYABLE_ERRORS itself (install)
+    """
+
+    return client in _installed
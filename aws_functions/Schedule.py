@@ -0,0 +1,431 @@
+# -*- coding: utf-8 -*-
+################################################################################
+# Tag-driven schedules
+#-------------------------------------------------------------------------------
+# Each instance carries its schedule in a tag instead of each schedule
+# having its own event and Filters:
+#
+#     Schedule = Mon-Fri 08:00-20:00 Asia/Tokyo
+#     Schedule = Mon+Wed+Fri 22:00-06:00 Sat 10:00-14:00 Europe/Paris
+#
+# A schedule is pairs of days and a running window, and an optional IANA
+# time zone at the end (UTC by default). Days are a day, a range such as
+# Mon-Fri or Fri-Mon, "+" separated days (tag values can't have ","), or
+# Daily. The window ends at 24:00 at the latest, and a window ending before
+# it starts runs over midnight into the next day.
+#
+# A schedule is compiled once into a minute-of-week bitmap and cached by its
+# text. run() lists the fleet with one getEC2Instances, groups it by the tag
+# value and evaluates each distinct schedule once, then starts and stops the
+# instances out of their schedule with BatchEC2:
+#
+#     ret, plan = Schedule.evaluate(EC2InstanceList)
+#     ret, result = Schedule.run()
+################################################################################
+import datetime
+import functools
+import time
+import traceback
+
+from . import __VERSION__
+from . import Status
+from . import BatchEC2
+from . import ListEC2
+from . import Metrics
+from .log import logger
+
+
+################################################################################
+# variables
+################################################################################
+TAG = "Schedule"
+DEFAULT_ZONE = "UTC"
+DAYS = ("mon", "tue", "wed", "thu", "fri", "sat", "sun")
+DAILY = ("daily", "everyday")
+_MINUTES_PER_DAY = 24 * 60
+_MINUTES_PER_WEEK = 7 * _MINUTES_PER_DAY
+_CACHE_SIZE = 4096
+STATE = "instance-state-name"
+RUNNING = "running"
+STOPPED = "stopped"
+
+
+################################################################################
+# CompiledSchedule
+################################################################################
+class CompiledSchedule:
+    """
+    Schedule compiled into the running minutes of a week
+
+    Parameters
+    ------------------------------------
+    Text : str
+        Schedule as written in the tag
+    Zone : datetime.tzinfo
+        Time zone of the windows
+    Week : bytearray
+        1 per running minute of the week, from Monday 00:00
+    """
+
+    __slots__ = ("Text", "Zone", "Week")
+
+    def __init__(self, Text, Zone, Week):
+        self.Text = Text
+        self.Zone = Zone
+        self.Week = Week
+
+    def __repr__(self):
+        return f"CompiledSchedule({self.Text!r})"
+
+    def isRunning(self, Now=None):
+        """
+        True when the instances of the schedule should be running at Now
+
+        Parameters
+        ------------------------------------
+        Now : float
+            Epoch seconds, now when None
+        """
+        local = datetime.datetime.fromtimestamp(time.time() if Now is None else Now, self.Zone)
+        minute = local.weekday() * _MINUTES_PER_DAY + local.hour * 60 + local.minute
+        return self.Week[minute] == 1
+
+
+#-------------------------------------------------------
+# Parser
+#-------------------------------------------------------
+def _parseDays(text):
+    """
+    Weekday numbers (Monday is 0) of "Mon-Fri", "Mon+Wed", "Sat" or "Daily"
+    """
+    text = text.lower()
+    if text in DAILY:
+        return list(range(7))
+    days = []
+    for part in text.replace(",", "+").split("+"):
+        first, _, last = part.partition("-")
+        if first not in DAYS or (last and last not in DAYS):
+            raise ValueError(f"Invalid days: {text}")
+        start = DAYS.index(first)
+        end = DAYS.index(last) if last else start
+        # Fri-Mon wraps over the weekend
+        days += [(start + n) % 7 for n in range((end - start) % 7 + 1)]
+    return days
+
+
+def _parseMinute(text):
+    """
+    Minutes of the day of "HH:MM", up to 24:00
+    """
+    hour, colon, minute = text.partition(":")
+    if not colon or not hour.isdigit() or not minute.isdigit() or len(minute) != 2:
+        raise ValueError(f"Invalid time: {text}")
+    value = int(hour) * 60 + int(minute)
+    if int(minute) >= 60 or value > _MINUTES_PER_DAY:
+        raise ValueError(f"Invalid time: {text}")
+    return value
+
+
+def _isWindow(token):
+    return "-" in token and ":" in token
+
+
+def _compile(Text):
+    # imported here, zoneinfo loads the tz database on the first use
+    import zoneinfo
+
+    tokens = Text.split()
+    Zone = DEFAULT_ZONE
+    if tokens and not _isWindow(tokens[-1]) and len(tokens) % 2 == 1:
+        Zone = tokens.pop()
+    if not tokens or len(tokens) % 2 != 0:
+        raise ValueError(f"Invalid schedule: {Text}")
+    try:
+        zone = zoneinfo.ZoneInfo(Zone)
+    except Exception:
+        raise ValueError(f"Invalid time zone: {Zone}")
+
+    week = bytearray(_MINUTES_PER_WEEK)
+    for days, window in zip(tokens[0::2], tokens[1::2]):
+        if not _isWindow(window):
+            raise ValueError(f"Invalid window: {window}")
+        start, _, end = window.partition("-")
+        start, end = _parseMinute(start), _parseMinute(end)
+        if start == end:
+            raise ValueError(f"Empty window: {window}")
+        for day in _parseDays(days):
+            offset = day * _MINUTES_PER_DAY
+            if start < end:
+                week[offset + start:offset + end] = b"\x01" * (end - start)
+            else:
+                # over midnight, the rest goes to the next day (Sunday -> Monday)
+                week[offset + start:offset + _MINUTES_PER_DAY] = b"\x01" * (_MINUTES_PER_DAY - start)
+                offset = (day + 1) % 7 * _MINUTES_PER_DAY
+                week[offset:offset + end] = b"\x01" * end
+    return CompiledSchedule(Text, zone, week)
+
+
+@functools.lru_cache(maxsize=_CACHE_SIZE)
+def compileSchedule(Text):
+    """
+    Compile a schedule, cached by its text
+
+    Parameters
+    ------------------------------------
+    Text : str
+        Schedule such as "Mon-Fri 08:00-20:00 Asia/Tokyo"
+
+    Returns
+    ------------------------------------
+    schedule : CompiledSchedule
+
+    Raises
+    ------------------------------------
+    ValueError
+        When the schedule is invalid
+    """
+    return _compile(Text.strip())
+
+
+################################################################################
+# evaluate
+################################################################################
+def evaluate(EC2InstanceList, Now=None, Tag=TAG):
+    """
+    Decide which instances to start and stop at Now
+    The instances are grouped by their schedule, so each distinct schedule
+    is evaluated once however many instances share it
+
+    Parameters
+    ------------------------------------
+    EC2InstanceList : list
+        EC2Instance (see ListEC2.getEC2Instances)
+    Now : float
+        Epoch seconds, now when None
+    Tag : str
+        Tag key of the schedule
+
+    Returns
+    ------------------------------------
+    status: int
+        success, or warning when some schedules are invalid
+    plan : dict
+        {
+            "Start": [ids stopped in their running window],
+            "Stop": [ids running out of their running window],
+            "Schedules": distinct schedules evaluated,
+            "Unscheduled": instances without the tag,
+            "Invalid": {schedule: [ids]}
+        }
+    """
+
+    logger.debug("start")
+    status = Status()
+    Now = time.time() if Now is None else Now
+
+    #-------------------------------------------------------
+    # Group By Schedule
+    #-------------------------------------------------------
+    # schedule -> state name -> [ids]
+    groups = {}
+    for instance in EC2InstanceList:
+        text = instance.TagDict.get(Tag)
+        states = groups.get(text)
+        if states is None:
+            states = groups[text] = {}
+        ids = states.get(instance.stateName)
+        if ids is None:
+            ids = states[instance.stateName] = []
+        ids.append(instance.InstanceId)
+
+    #-------------------------------------------------------
+    # Evaluate Each Schedule Once
+    #-------------------------------------------------------
+    plan = {"Start": [], "Stop": [], "Schedules": 0, "Unscheduled": 0, "Invalid": {}}
+    for text, states in groups.items():
+        if text is None:
+            plan["Unscheduled"] = sum(len(ids) for ids in states.values())
+            continue
+        try:
+            schedule = compileSchedule(text)
+        except ValueError as e:
+            logger.warning(f"{e}")
+            plan["Invalid"][text] = [i for ids in states.values() for i in ids]
+            continue
+        plan["Schedules"] += 1
+        if schedule.isRunning(Now):
+            plan["Start"] += states.get(STOPPED, [])
+        else:
+            plan["Stop"] += states.get(RUNNING, [])
+
+    logger.info(f"{plan['Schedules']} schedule(s): {len(plan['Start'])} instance(s) to start, {len(plan['Stop'])} to stop")
+    logger.debug("end")
+    if plan["Invalid"]:
+        return status.warning, plan
+    return status.success, plan
+
+
+################################################################################
+# run
+################################################################################
+def run(Filters=None, Now=None, Tag=TAG, DryRun=False, Region=None, Profile=None):
+    """
+    List the scheduled instances once, and start and stop them as their
+    schedules say
+
+    Parameters
+    ------------------------------------
+    Filters : list
+        Additional EC2 searching filter, e.g. to split the fleet by tag
+    Now : float
+        Epoch seconds, now when None
+    Tag : str
+        Tag key of the schedule
+    DryRun : boolean
+    Region : str
+        AWS region name, None means the default region
+    Profile : str
+        Credentials profile name, None means the default credentials
+
+    Returns
+    ------------------------------------
+    status: int
+        success when every instance acted on succeeded, warning when some
+        of them failed or some schedules are invalid, fail otherwise
+    result : dict
+        {
+            "Plan": evaluate result,
+            "Results": {InstanceId: BatchEC2 result}
+        }
+    """
+
+    logger.debug("start")
+    logger.debug("__VERSION__ = %s", __VERSION__)
+    status = Status()
+    result = {"Plan": None, "Results": {}}
+
+    #-------------------------------------------------------
+    # One Scan
+    #-------------------------------------------------------
+    Filters = list(Filters or []) + [
+        {"Name": "tag-key", "Values": [Tag]},
+        {"Name": STATE, "Values": [RUNNING, STOPPED]},
+    ]
+    with Metrics.timer("search"):
+        ret, EC2InstanceList = ListEC2.getEC2Instances(Filters, Region=Region, Profile=Profile)
+    if ret != status.success:
+        logger.debug("end")
+        return status.fail, result
+    logger.info(f"{len(EC2InstanceList)} scheduled instance(s) found")
+
+    with Metrics.timer("evaluate"):
+        ret, result["Plan"] = evaluate(EC2InstanceList, Now, Tag)
+    EC2InstanceList = None
+
+    #-------------------------------------------------------
+    # Start / Stop
+    #-------------------------------------------------------
+    rets = [ret]
+    for Action, key in (("start", "Start"), ("stop", "Stop")):
+        InstanceIds = result["Plan"][key]
+        if not InstanceIds:
+            continue
+        try:
+            with Metrics.timer(Action):
+                ret, results = BatchEC2.run(Action, InstanceIds, DryRun=DryRun, Region=Region, Profile=Profile)
+        except Exception as e:
+            logger.error(f"Exception: {e}\n{traceback.format_exc()}")
+            ret, results = status.fail, {}
+        result["Results"].update(results)
+        rets.append(ret)
+        logger.info(f"{len(InstanceIds)} instance(s) requested to {Action}")
+
+    #-------------------------------------------------------
+    # Return Value
+    #-------------------------------------------------------
+    logger.debug("end")
+    if all(r == status.success for r in rets):
+        return status.success, result
+    if all(r == status.fail for r in rets[1:]) and len(rets) > 1:
+        return status.fail, result
+    return status.warning, result
+
+
+################################################################################
+# handle
+################################################################################
+def handle(event):
+    """
+    Lambda entry point of the schedules
+
+    Parameters
+    ------------------------------------
+    event : dict
+        Lambda event, every key is optional
+        {
+            "loglevel": "INFO",
+            "Filters": [{"Name": "tag:env", "Values": ["prd"]}],
+            "tag": "Schedule",
+            "metrics": False
+        }
+
+    Returns
+    ------------------------------------
+    response : dict
+        Lambda response
+    """
+
+    # imported here, Transition is the engine of the start / stop handlers
+    from . import Transition
+
+    logger.debug("start")
+    logger.info("----------------------------------------")
+    logger.info("- START")
+    logger.info("----------------------------------------")
+    status = Status()
+
+    #-------------------------------------------------------
+    # Check Arguments
+    #-------------------------------------------------------
+    Metrics.enable(event.get("metrics") is True)
+    Metrics.reset()
+    loglevel = event.get("loglevel", Transition.DEFAULT_LOGLEVEL)
+    if loglevel not in Transition.LOGLEVELS:
+        loglevel = Transition.DEFAULT_LOGLEVEL
+    logger.setLevel(loglevel)
+
+    Filters = event.get("Filters", [])
+    Tag = event.get("tag", TAG)
+    if type(Filters) != list:
+        msg = f"Invalid Filters: {Filters}"
+    elif type(Tag) != str:
+        msg = f"Invalid tag: {Tag}"
+    else:
+        msg = None
+    if msg is not None:
+        logger.error(msg)
+        logger.debug("end")
+        return Transition.endLambda(200, msg)
+    logger.info(f"{Filters = }")
+    logger.info(f"{Tag = }")
+
+    #-------------------------------------------------------
+    # Run Schedules
+    #-------------------------------------------------------
+    with Metrics.timer("total"):
+        ret, result = run(Filters, Tag=Tag)
+    plan = result["Plan"]
+    if plan is None:
+        msg = "Failed to get EC2 instances"
+    else:
+        msg = f"Started: {plan['Start']}, Stopped: {plan['Stop']}"
+        if plan["Invalid"]:
+            msg += f", Invalid schedules: {list(plan['Invalid'])}"
+    if ret == status.success:
+        logger.info(msg)
+    else:
+        logger.error(msg)
+    if Metrics.isEnabled():
+        Metrics.emitEMF({"Action": "schedule"})
+    logger.debug("end")
+    return Transition.endLambda(200, msg)
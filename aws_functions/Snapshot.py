@@ -0,0 +1,535 @@
+# -*- coding: utf-8 -*-
+################################################################################
+# Persistent inventory snapshots in a compact columnar file
+#-------------------------------------------------------------------------------
+# A snapshot keeps the EC2Instance records of one getEC2Instances result,
+# sorted by InstanceId. It is read with mmap, so opening it costs nothing and
+# a record is decoded only when it is asked for.
+#
+# File layout (little-endian)
+#   header     : magic, version, id width, count, created, column count
+#   directory  : per column, name, kind, offset and length of its block
+#   blocks     : 8-byte aligned
+#     "InstanceId"   kind I : fixed width ASCII, NUL padded, sorted
+#     other fields   kind S : uint32 per record, index into the string table,
+#                             0xFFFFFFFF for None (version 2)
+#                    kind J : the same, the string is compact JSON
+#     "_Offsets"     kind O : uint32 offsets of the string table (count + 1)
+#     "_Strings"     kind B : UTF-8 bytes of the distinct strings
+# Every distinct value is stored once, e.g. the VPC, state and key names.
+#
+#     store = Snapshot.SnapshotStore("/tmp/ec2_snapshots")
+#     ret, diff = store.record(EC2InstanceList)
+#     with store.open(store.latest()) as snapshot:
+#         snapshot.get("i-0123456789abcdef0")
+################################################################################
+import array
+import bisect
+import itertools
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+import traceback
+
+from . import __VERSION__
+from . import Status
+from .EC2Instance import EC2Instance
+from .log import logger
+
+
+################################################################################
+# variables
+################################################################################
+MAGIC = b"EC2SNAP\x00"
+VERSION = 2
+# versions read, version 1 files have no None marker
+_VERSIONS = (1, 2)
+SUFFIX = ".ec2snap"
+_HEADER = struct.Struct("<8sHHIdH6x")
+_ENTRY = struct.Struct("<24scxxxxxxxQQ")
+_ID = "InstanceId"
+_STATE_NAME = "StateName"
+_OFFSETS = "_Offsets"
+_STRINGS = "_Strings"
+# string table index of None
+_NULL = 0xFFFFFFFF
+# fields stored as plain strings, the others as JSON
+_STRING_FIELDS = ("VpcId", "SubnetId", "PrivateIpAddress", "PlatformDetails", "KeyName", _STATE_NAME)
+_JSON_FIELDS = ("Placement", "State", "StateReason", "MaintenanceOptions", "Tags", "Extra")
+_BIG_ENDIAN = sys.byteorder == "big"
+
+
+################################################################################
+# write
+################################################################################
+def _align(n):
+    return (n + 7) & ~7
+
+
+def _uint32(values):
+    column = array.array("I", values)
+    if _BIG_ENDIAN:
+        column.byteswap()
+    return column.tobytes()
+
+
+def _text(value):
+    # None is kept as None rather than "None"
+    return value if value is None or type(value) == str else str(value)
+
+
+def _encoder():
+    """
+    JSON encoder remembering the encoded scalars and flat dicts, most of
+    them repeat across a fleet (Placement, State, "NA", ...) and encoding
+    dominates write
+    """
+
+    dumps = json.JSONEncoder(separators=(",", ":"), default=str).encode
+    encoded = {}
+
+    def encode(value):
+        try:
+            # types are part of the key as True == 1 but they encode differently
+            if type(value) == dict:
+                key = (tuple(value.items()), tuple(map(type, value.values())))
+            else:
+                key = (type(value), value)
+            string = encoded.get(key)
+        except TypeError:
+            # lists and nested values are not hashable
+            return dumps(value)
+        if string is None:
+            string = encoded[key] = dumps(value)
+        return string
+    return encode
+
+
+def write(path, EC2InstanceList, Created=None):
+    """
+    Write a snapshot file, through a temporary file and rename so that
+    readers never see it half written
+
+    Parameters
+    ------------------------------------
+    path : str
+        File path
+    EC2InstanceList : list
+        getEC2Instances result (EC2Instance or dict)
+    Created : float
+        Epoch seconds of the snapshot, now when None
+
+    Returns
+    ------------------------------------
+    count : int
+        Number of records written
+    """
+
+    instances = [
+        i if isinstance(i, EC2Instance) else EC2Instance.fromDict(i)
+        for i in EC2InstanceList
+    ]
+    instances.sort(key=lambda i: i.InstanceId)
+    ids = [i.InstanceId.encode("ascii") for i in instances]
+    width = max((len(i) for i in ids), default=0)
+
+    # string table
+    strings = {}
+
+    def ref(value):
+        if value is None:
+            return _NULL
+        index = strings.get(value)
+        if index is None:
+            index = strings[value] = len(strings)
+        return index
+
+    encode = _encoder()
+    blocks = [(_ID, b"I", b"".join(i.ljust(width, b"\0") for i in ids))]
+    for name in _STRING_FIELDS:
+        if name == _STATE_NAME:
+            values = [ref(i.stateName) for i in instances]
+        else:
+            values = [ref(_text(getattr(i, name))) for i in instances]
+        blocks.append((name, b"S", _uint32(values)))
+    for name in _JSON_FIELDS:
+        blocks.append((name, b"J", _uint32(ref(encode(getattr(i, name))) for i in instances)))
+
+    data = [s.encode("utf-8") for s in strings]
+    offsets = [0]
+    for d in data:
+        offsets.append(offsets[-1] + len(d))
+    blocks.append((_OFFSETS, b"O", _uint32(offsets)))
+    blocks.append((_STRINGS, b"B", b"".join(data)))
+
+    # layout
+    position = _align(_HEADER.size + _ENTRY.size * len(blocks))
+    entries = []
+    for name, kind, block in blocks:
+        entries.append(_ENTRY.pack(name.encode("ascii"), kind, position, len(block)))
+        position = _align(position + len(block))
+
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(_HEADER.pack(MAGIC, VERSION, width, len(instances), Created or time.time(), len(blocks)))
+        f.write(b"".join(entries))
+        for (_, _, block), entry in zip(blocks, entries):
+            f.seek(_ENTRY.unpack(entry)[2])
+            f.write(block)
+        f.truncate(position)
+    os.replace(tmp, path)
+    return len(instances)
+
+
+################################################################################
+# Snapshot
+################################################################################
+class _Ids:
+    """
+    Sequence view of the sorted id column, for bisect
+    """
+
+    __slots__ = ("_view", "_width", "_count")
+
+    def __init__(self, view, width, count):
+        self._view = view
+        self._width = width
+        self._count = count
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, n):
+        return self._view[n * self._width:(n + 1) * self._width].tobytes()
+
+
+class Snapshot:
+    """
+    Memory-mapped snapshot file
+
+    Parameters
+    ------------------------------------
+    path : str
+        File path
+
+    Attributes
+    ------------------------------------
+    count : int
+        Number of records
+    created : float
+        Epoch seconds of the snapshot
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._map)
+        magic, version, self._width, self.count, self.created, columns = _HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version not in _VERSIONS:
+            self.close()
+            raise ValueError(f"Not a snapshot file: {path}")
+
+        self._columns = {}
+        self._views = []
+        for n in range(columns):
+            name, kind, offset, length = _ENTRY.unpack_from(self._map, _HEADER.size + _ENTRY.size * n)
+            block = self._view[offset:offset + length]
+            if kind in (b"S", b"J", b"O"):
+                if _BIG_ENDIAN:
+                    column = array.array("I")
+                    column.frombytes(block.tobytes())
+                    column.byteswap()
+                    block.release()
+                    block = memoryview(column)
+                else:
+                    block = block.cast("I")
+            self._views.append(block)
+            self._columns[name.rstrip(b"\0").decode("ascii")] = (kind, block)
+        self._ids = _Ids(self._columns[_ID][1], self._width, self.count)
+        self._offsets = self._columns[_OFFSETS][1]
+        self._strings = self._columns[_STRINGS][1]
+        # string table index -> decoded string, for the repeated values
+        self._decoded = {}
+
+    def close(self):
+        """
+        Release the memory map
+        """
+        for view in getattr(self, "_views", []):
+            view.release()
+        self._views = []
+        if getattr(self, "_view", None) is not None:
+            self._view.release()
+            self._view = None
+        self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    #-------------------------------------------------------
+    # Access
+    #-------------------------------------------------------
+    def _string(self, index):
+        value = self._decoded.get(index)
+        if value is None:
+            value = self._decoded[index] = self._strings[self._offsets[index]:self._offsets[index + 1]].tobytes().decode("utf-8")
+        return value
+
+    def instanceId(self, n):
+        """
+        InstanceId of the n-th record
+        """
+        return self._ids[n].rstrip(b"\0").decode("ascii")
+
+    def value(self, n, name):
+        """
+        Field name of the n-th record, None when it was None
+        """
+        kind, column = self._columns[name]
+        index = column[n]
+        if index == _NULL:
+            return None
+        string = self._string(index)
+        # JSON is decoded on each call, the records don't share dicts
+        return json.loads(string) if kind == b"J" else string
+
+    def stateName(self, n):
+        """
+        State name of the n-th record
+        """
+        return self._string(self._columns[_STATE_NAME][1][n])
+
+    def record(self, n):
+        """
+        EC2Instance of the n-th record
+        """
+        fields = {name: self.value(n, name) for name in _STRING_FIELDS + _JSON_FIELDS if name != _STATE_NAME}
+        extra = fields.pop("Extra")
+        return EC2Instance(self.instanceId(n), Extra=extra, **fields)
+
+    def index(self, InstanceId):
+        """
+        Record number of InstanceId by binary search, None when missing
+        """
+        key = InstanceId.encode("ascii").ljust(self._width, b"\0")
+        n = bisect.bisect_left(self._ids, key)
+        if n < self.count and self._ids[n] == key:
+            return n
+        return None
+
+    def get(self, InstanceId, default=None):
+        """
+        EC2Instance of InstanceId, default when missing
+        """
+        n = self.index(InstanceId)
+        return default if n is None else self.record(n)
+
+    def __contains__(self, InstanceId):
+        return self.index(InstanceId) is not None
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        for n in range(self.count):
+            yield self.record(n)
+
+    def states(self):
+        """
+        {InstanceId: state name} of every record
+        """
+        return {self.instanceId(n): self.stateName(n) for n in range(self.count)}
+
+
+################################################################################
+# diff
+################################################################################
+def diff(old, new):
+    """
+    Differences between two snapshots by a merge of their sorted ids
+
+    Parameters
+    ------------------------------------
+    old : Snapshot
+        Older snapshot
+    new : Snapshot
+        Newer snapshot
+
+    Returns
+    ------------------------------------
+    result : dict
+        {
+            "Added": [InstanceId, ...],
+            "Removed": [InstanceId, ...],
+            "StateChanged": [(InstanceId, old state, new state), ...]
+        }
+    """
+
+    added = []
+    removed = []
+    changed = []
+    width = max(old._width, new._width)
+    oldIds = old._ids
+    newIds = new._ids
+    i = j = 0
+    while i < old.count and j < new.count:
+        a = oldIds[i].ljust(width, b"\0")
+        b = newIds[j].ljust(width, b"\0")
+        if a == b:
+            before = old.stateName(i)
+            after = new.stateName(j)
+            if before != after:
+                changed.append((new.instanceId(j), before, after))
+            i += 1
+            j += 1
+        elif a < b:
+            removed.append(old.instanceId(i))
+            i += 1
+        else:
+            added.append(new.instanceId(j))
+            j += 1
+    removed.extend(old.instanceId(n) for n in range(i, old.count))
+    added.extend(new.instanceId(n) for n in range(j, new.count))
+    return {"Added": added, "Removed": removed, "StateChanged": changed}
+
+
+################################################################################
+# SnapshotStore
+################################################################################
+class SnapshotStore:
+    """
+    Directory of snapshot files named by their creation time and a
+    sequence number within its millisecond
+
+    Parameters
+    ------------------------------------
+    Directory : str
+        Directory of the files, created when missing
+    Keep : int
+        Number of files kept by record, None keeps all
+    """
+
+    def __init__(self, Directory, Keep=None):
+        self.Directory = Directory
+        self.Keep = Keep
+        os.makedirs(Directory, exist_ok=True)
+
+    def paths(self):
+        """
+        Snapshot file paths, oldest first
+        """
+        names = sorted(name for name in os.listdir(self.Directory) if name.endswith(SUFFIX))
+        return [os.path.join(self.Directory, name) for name in names]
+
+    def latest(self):
+        """
+        Path of the newest snapshot, None when there is none
+        """
+        paths = self.paths()
+        return paths[-1] if paths else None
+
+    def open(self, path):
+        """
+        Open a snapshot of the store
+        """
+        return Snapshot(path)
+
+    def save(self, EC2InstanceList, Created=None):
+        """
+        Write a new snapshot, never replacing an existing one
+
+        Returns
+        ------------------------------------
+        path : str
+            File path
+        """
+        Created = Created or time.time()
+        stamp = time.strftime("%Y%m%dT%H%M%S", time.gmtime(Created))
+        base = os.path.join(self.Directory, f"snapshot-{stamp}-{int(Created * 1000) % 1000:03}")
+        tmp = f"{base}.{os.getpid()}.{threading.get_ident()}.new"
+        write(tmp, EC2InstanceList, Created)
+        try:
+            # link fails when the name is taken, by another process too,
+            # and the snapshot takes the next sequence number then
+            for seq in itertools.count():
+                path = f"{base}-{seq:03}{SUFFIX}"
+                try:
+                    os.link(tmp, path)
+                    return path
+                except FileExistsError:
+                    continue
+        finally:
+            os.remove(tmp)
+
+    def prune(self, Keep):
+        """
+        Remove the oldest snapshots, keeping Keep of them
+        """
+        paths = self.paths()
+        for path in paths[:max(0, len(paths) - Keep)]:
+            os.remove(path)
+
+    def record(self, EC2InstanceList):
+        """
+        Save a snapshot and diff it against the previous one
+
+        Parameters
+        ------------------------------------
+        EC2InstanceList : list
+            getEC2Instances result
+
+        Returns
+        ------------------------------------
+        status: int
+            Return code
+        diff : dict
+            See diff, None when there was no previous snapshot
+        """
+
+        logger.debug("start")
+        status = Status()
+        try:
+            previous = self.latest()
+            path = self.save(EC2InstanceList)
+            result = None
+            if previous is not None:
+                with Snapshot(previous) as old, Snapshot(path) as new:
+                    result = diff(old, new)
+                logger.info(
+                    f"Snapshot {os.path.basename(path)}: {len(result['Added'])} added, "
+                    f"{len(result['Removed'])} removed, {len(result['StateChanged'])} state changed"
+                )
+            if self.Keep:
+                self.prune(self.Keep)
+        except Exception as e:
+            logger.error(f"Exception: {e}\n{traceback.format_exc()}")
+            logger.debug("end")
+            return status.fail, None
+        logger.debug("end")
+        return status.success, result
+
+    def history(self, InstanceId):
+        """
+        State of an instance across the snapshots, for audits
+
+        Returns
+        ------------------------------------
+        history : list
+            [(created, state name or None when missing), ...], oldest first
+        """
+        result = []
+        for path in self.paths():
+            with Snapshot(path) as snapshot:
+                n = snapshot.index(InstanceId)
+                result.append((snapshot.created, None if n is None else snapshot.stateName(n)))
+        return result
@@ -0,0 +1,692 @@
+# -*- coding: utf-8 -*-
+################################################################################
+# EC2 state transition engine
+#-------------------------------------------------------------------------------
+# The Lambda handlers are thin entry points on top of run(event, Action).
+# A transition runs as a pipeline of four stages, one pass each:
+#   search : list the instances of Filters
+#   select : display them and pick the ones in the "Before" state
+#   act    : call the API of the action on the selected instances (BatchEC2)
+#   verify : wait only for the instances not yet in the "After" state (WaitEC2)
+# Instances already in the "After" state at search time are confirmed
+# without listing them again.
+#
+# With "incremental", search reads the instances from a shared InventorySync
+# kept current by EC2 state-change events instead of listing them each run.
+# The ones it has in the "After" state are checked by id before being
+# confirmed, since an event may not have arrived yet.
+# run() applies such events when the function is their EventBridge target.
+#
+# With "pipeline", search, select and act run as one stage (Pipeline) that
+# acts on each describe_instances page while the next one is fetched. The
+# minInstNum / maxInstNum guard then needs "precount", which lists every
+# page before acting.
+#
+# With "deadline", the run watches the time left of the invocation (the
+# Lambda context) and, when it runs short, returns a continuation that the
+# next invocation resumes from (see Deadline).
+#
+# With "wave", act starts or stops the instances in the order of their
+# StartOrder / DependsOn tags, at most "maxInFlight" at a time and "stagger"
+# seconds apart (see WaveEC2).
+#
+# boto3 is loaded on the first API call. Set AWS_CONTROL_PREWARM=1 on the
+# function to load it and the EC2 service model in the init phase instead
+# (see prewarm).
+################################################################################
+import os
+import time
+from logging import INFO
+
+from . import __VERSION__
+from . import Status
+from . import BatchEC2
+from . import ClientPool
+from . import Deadline
+from . import InventoryCache
+from . import InventorySync
+from . import Metrics
+from . import Pipeline
+from . import VerifyEC2
+from . import WaitEC2
+from . import WaveEC2
+from .log import logger, LazyRepr
+
+
+################################################################################
+# variables
+################################################################################
+NA = "NA"
+STOPPED = "stopped"
+RUNNING = "running"
+DEFAULT_LOGLEVEL = INFO
+LOGLEVELS = ["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"]
+INTERVAL = 120
+EC2PARAMS = ["VpcId", "SubnetId", "PrivateIpAddress", "State", "StateReason", "Tags"]
+PREWARM = "AWS_CONTROL_PREWARM"
+
+# Action : definition of the transition
+#   Api    : BatchEC2 action
+#   Params : additional parameters of the API
+#   Before : states the action is applied to
+#   After  : state expected after the action
+#   Verb   : (verb, present participle) used in messages
+TRANSITIONS = {
+    "start": {
+        "Api": "start",
+        "Params": {},
+        "Before": (STOPPED,),
+        "After": RUNNING,
+        "Verb": ("start", "starting")
+    },
+    "stop": {
+        "Api": "stop",
+        "Params": {},
+        "Before": (RUNNING,),
+        "After": STOPPED,
+        "Verb": ("stop", "stopping")
+    },
+    "hibernate": {
+        "Api": "stop",
+        "Params": {"Hibernate": True},
+        "Before": (RUNNING,),
+        "After": STOPPED,
+        "Verb": ("hibernate", "hibernating")
+    },
+    "reboot": {
+        "Api": "reboot",
+        "Params": {},
+        "Before": (RUNNING,),
+        "After": RUNNING,
+        "Verb": ("reboot", "rebooting")
+    },
+}
+
+
+################################################################################
+# prewarm
+################################################################################
+def prewarm():
+    """
+    Load boto3 and the EC2 service model when the environment variable
+    AWS_CONTROL_PREWARM is "1"
+    The handlers call it at import time, i.e. in the init phase of Lambda
+    """
+
+    if os.environ.get(PREWARM) != "1":
+        return
+    try:
+        ClientPool.prewarm("ec2")
+    except Exception as e:
+        # the first API call loads it anyway
+        logger.warning(f"Failed to prewarm: {e}")
+
+
+################################################################################
+# endLambda
+################################################################################
+def endLambda(stat, msg, continuation=None):
+    """
+    Lambda response
+    When Metrics is enabled, the body carries the timing summary as well
+    A continuation is returned next to the body (see Deadline)
+    """
+
+    if Metrics.isEnabled():
+        response = {"statusCode": stat, "body": {"msg": msg, "metrics": Metrics.report()}}
+    else:
+        response = {"statusCode": stat, "body": msg}
+    if continuation is not None:
+        response["continuation"] = continuation
+    return response
+
+
+################################################################################
+# parseEvent
+################################################################################
+def parseEvent(event):
+    """
+    Check the Lambda event
+
+    Parameters
+    ------------------------------------
+    event : dict
+        Lambda event
+        {
+            "loglevel": "INFO",
+            "Filters": [{"Name": "tag:Name", "Values": ["DC01", "DC02"]}],
+            "minInstNum": 1,
+            "maxInstNum": 2,
+            "interval": 120,
+            "metrics": False,
+            "incremental": False,
+            "pipeline": False,
+            "precount": False,
+            "deadline": False,
+            "reserve": 10,
+            "reinvoke": False,
+            "continuation": None,
+            "wave": False,
+            "maxInFlight": 50,
+            "stagger": 0
+        }
+        metrics enables Metrics for the run
+        incremental searches the InventorySync of Filters
+        pipeline acts while listing, precount keeps the instance number
+        guard in that mode
+        deadline checkpoints the run when less than reserve seconds are
+        left, continuation resumes from such a checkpoint and reinvoke
+        invokes the function again with it
+        wave acts in dependency order, maxInFlight instances at most and
+        stagger seconds between the API calls
+
+    Returns
+    ------------------------------------
+    status: int
+        Return code
+    params : dict
+        Filters, minInstNum, maxInstNum, interval, incremental, pipeline,
+        precount, deadline, reserve, reinvoke, continuation, wave,
+        maxInFlight and stagger,
+        or the error message as "msg" when status is fail
+    """
+
+    status = Status()
+
+    # Instrumentation
+    Metrics.enable(event.get("metrics") is True)
+    Metrics.reset()
+
+    # Loglevel
+    loglevel = event.get("loglevel", DEFAULT_LOGLEVEL)
+    if loglevel not in LOGLEVELS:
+        loglevel = DEFAULT_LOGLEVEL
+    logger.setLevel(loglevel)
+
+    # EC2 search filter
+    if "Filters" not in event:
+        return status.fail, {"msg": "Filters doesn't exist"}
+    Filters = event["Filters"]
+    if type(Filters) != list:
+        return status.fail, {"msg": f"Invalid Filters: {Filters}"}
+
+    # Minimum / Maximum expected EC2 instances and wait interval
+    params = {"Filters": Filters}
+    for key, default in [("minInstNum", 1), ("maxInstNum", 1), ("interval", INTERVAL), ("reserve", Deadline._RESERVE),
+                         ("maxInFlight", WaveEC2._MAX_IN_FLIGHT), ("stagger", 0)]:
+        value = event.get(key, default)
+        if type(value) != int:
+            return status.fail, {"msg": f"Invalid {key}: {value}"}
+        params[key] = value
+    if params["maxInFlight"] < 1:
+        return status.fail, {"msg": f"Invalid maxInFlight: {params['maxInFlight']}"}
+    if params["stagger"] < 0:
+        return status.fail, {"msg": f"Invalid stagger: {params['stagger']}"}
+    for key in ["incremental", "pipeline", "precount", "deadline", "reinvoke", "wave"]:
+        value = event.get(key, False)
+        if type(value) != bool:
+            return status.fail, {"msg": f"Invalid {key}: {value}"}
+        params[key] = value
+    if params["incremental"] and params["pipeline"]:
+        return status.fail, {"msg": "incremental and pipeline can't be used together"}
+
+    # Continuation of the previous invocation
+    continuation = event.get("continuation")
+    if continuation is not None and not Deadline.isContinuation(continuation):
+        return status.fail, {"msg": "Invalid continuation"}
+    params["continuation"] = continuation
+    params["deadline"] = params["deadline"] or continuation is not None
+    if params["deadline"] and (params["incremental"] or params["pipeline"]):
+        return status.fail, {"msg": "deadline can't be used with incremental or pipeline"}
+    if params["wave"] and (params["pipeline"] or params["deadline"]):
+        return status.fail, {"msg": "wave can't be used with pipeline or deadline"}
+
+    return status.success, params
+
+
+################################################################################
+# displayInstance
+################################################################################
+def displayInstance(i, ec2Info):
+    """
+    Log the information of an instance
+    """
+
+    logger.info(f"EC2 INSTANCE {i:003} ----------------------------------------")
+    # Name Tag Value
+    Name = ec2Info.name
+
+    logger.info(f"{Name = }")
+    for ec2Param in EC2PARAMS:
+        # Other attributes
+        logger.info(f"{ec2Param} = {ec2Info[ec2Param]}")
+
+
+################################################################################
+# Transition
+################################################################################
+class Transition:
+    """
+    One run of an action against the instances of Filters
+
+    Parameters
+    ------------------------------------
+    Action : str
+        Key of TRANSITIONS
+    Filters : list
+        EC2 searching filter
+    minInstNum : int
+        Minimum expected EC2 instances
+    maxInstNum : int
+        Maximum expected EC2 instances
+    interval : int
+        Seconds to wait for the instances to reach the "After" state,
+        the waves and the wait share it in wave mode
+    DryRun : boolean
+    incremental : boolean
+        Search the shared InventorySync of Filters instead of listing
+    pipeline : boolean
+        Act while listing (see Pipeline)
+    precount : boolean
+        Check the instance number before acting in pipeline mode
+    deadline : Deadline.Deadline
+        Time budget, the run is resumable (see Deadline) when given
+    continuation : dict
+        Checkpoint of the previous invocation to resume from
+    wave : boolean
+        Act in dependency order (see WaveEC2)
+    maxInFlight : int
+        Instances in transition at most in wave mode
+    stagger : int
+        Seconds between the API calls in wave mode
+    """
+
+    def __init__(self, Action, Filters, minInstNum=1, maxInstNum=1, interval=INTERVAL, DryRun=False,
+                 incremental=False, pipeline=False, precount=False, deadline=None, continuation=None,
+                 wave=False, maxInFlight=WaveEC2._MAX_IN_FLIGHT, stagger=0):
+        self.Action = Action
+        self.definition = TRANSITIONS[Action]
+        self.Filters = Filters
+        self.minInstNum = minInstNum
+        self.maxInstNum = maxInstNum
+        self.interval = interval
+        self.DryRun = DryRun
+        self.sync = InventorySync.getSync(Filters) if incremental else None
+        self.pipelined = pipeline
+        self.precount = precount
+        self.deadline = deadline
+        self.wave = wave
+        self.maxInFlight = maxInFlight
+        self.stagger = stagger
+        self.status = Status()
+
+        # results of the stages
+        self.ec2InstanceList = []
+        self.InstanceIds = []
+        self.confirmedIds = []
+        self.waitingIds = []
+        self.actResult = {}
+        self.convergence = {}
+        # monotonic time the waves and verify share the interval until, None
+        # when verify has the whole interval
+        self.waitUntil = None
+        # checkpoint to resume from, None when the run ended
+        self.continuation = continuation
+
+    #-------------------------------------------------------
+    # Stages
+    #-------------------------------------------------------
+    def search(self):
+        """
+        List the instances of Filters
+
+        Returns
+        ------------------------------------
+        status: int
+            Return code
+        msg : str
+            Message to end the run with, None to continue
+        """
+        logger.info("----------------------------------------")
+        logger.info("SEARCH EC2 INSTANCES")
+        logger.info("----------------------------------------")
+        if self.sync is not None:
+            ret, self.ec2InstanceList = self.sync.current()
+        else:
+            ret, self.ec2InstanceList = InventoryCache.getEC2Instances(self.Filters)
+        if ret != self.status.success:
+            return self.status.fail, "Failed to get EC2 instances"
+
+        if len(self.ec2InstanceList) == 0:
+            return self.status.success, "No instance found"
+        logger.debug("ec2InstanceList = %s", LazyRepr(self.ec2InstanceList))
+        logger.info(f"{len(self.ec2InstanceList)} instance(s) found")
+        return self.status.success, None
+
+    def select(self):
+        """
+        Display the instances and pick the ones in the "Before" state
+        """
+        Before = self.definition["Before"]
+        After = self.definition["After"]
+        for i, ec2Info in enumerate(self.ec2InstanceList, 1):
+            displayInstance(i, ec2Info)
+            stateName = ec2Info.stateName
+            if stateName in Before:
+                self.InstanceIds.append(ec2Info.InstanceId)
+            elif stateName == After:
+                self.confirmedIds.append(ec2Info.InstanceId)
+            else:
+                # in transition, e.g. pending or stopping
+                self.waitingIds.append(ec2Info.InstanceId)
+        if self.sync is not None and self.confirmedIds:
+            self.reconfirm()
+
+        instanceNum = len(self.ec2InstanceList)
+        logger.info(f"The expected instance number(s) is {self.minInstNum} <= instance(s) <= {self.maxInstNum}")
+        logger.debug("instanceNum(%s) < minInstNum(%s): %s", instanceNum, self.minInstNum, instanceNum < self.minInstNum)
+        logger.debug("instanceNum(%s) > maxInstNum(%s): %s", instanceNum, self.maxInstNum, instanceNum > self.maxInstNum)
+        if (instanceNum < self.minInstNum) or (instanceNum > self.maxInstNum):
+            return self.status.fail, "The number of instance(s) is out of range"
+
+        if len(self.InstanceIds) == 0 and len(self.waitingIds) == 0:
+            return self.status.success, f"All instances are in {After} state"
+        return self.status.success, None
+
+    def reconfirm(self):
+        """
+        Check by id the instances the InventorySync has in the "After" state,
+        as it lags behind the instances by the events not delivered yet
+        The ones not in it any more are selected or waited for instead
+        """
+        Before = self.definition["Before"]
+        After = self.definition["After"]
+        _, states = VerifyEC2.getInstanceStates(self.confirmedIds)
+        confirmedIds = []
+        for InstanceId in self.confirmedIds:
+            stateName = states.get(InstanceId)
+            if stateName == After:
+                confirmedIds.append(InstanceId)
+            elif stateName in Before:
+                self.InstanceIds.append(InstanceId)
+            else:
+                # in transition, or not returned by the failed check
+                self.waitingIds.append(InstanceId)
+            if stateName is not None and stateName != After and not self.DryRun:
+                self.sync.setState(InstanceId, stateName)
+        if len(confirmedIds) < len(self.confirmedIds):
+            logger.info(f"{len(self.confirmedIds) - len(confirmedIds)} instance(s) no longer {After}")
+        self.confirmedIds = confirmedIds
+
+    def act(self):
+        """
+        Call the API of the action on the selected instances
+        """
+        verb, _ = self.definition["Verb"]
+        logger.info("----------------------------------------")
+        logger.info(f"{verb.upper()} EC2 INSTANCES AND CHECK RESULT")
+        logger.info("----------------------------------------")
+        if len(self.InstanceIds) == 0:
+            return self.status.success, None
+        if self.wave:
+            return self.actInWaves()
+
+        ret, self.actResult = BatchEC2.run(
+            self.definition["Api"],
+            self.InstanceIds,
+            DryRun=self.DryRun,
+            **self.definition["Params"]
+        )
+        if ret == self.status.fail:
+            return self.status.fail, f"Failed to {verb} EC2 instances: {self.InstanceIds}"
+
+        for InstanceId, result in self.actResult.items():
+            if result["Status"] != self.status.success:
+                logger.error(f"Failed to {verb} {InstanceId}: {result['Error']}")
+        logger.info(f"{len(self.InstanceIds)} instance(s) requested to {verb}")
+        return self.status.success, None
+
+    def actInWaves(self):
+        """
+        act in the order of the StartOrder / DependsOn tags (WaveEC2)
+        The instances of Filters already in the "After" state count as done
+        """
+        verb, _ = self.definition["Verb"]
+        Api = self.definition["Api"]
+        if Api not in WaveEC2._DIRECTIONS:
+            return self.status.fail, f"wave can't be used to {verb}"
+        self.waitUntil = time.monotonic() + self.interval
+        ret, report = WaveEC2.run(
+            Api,
+            self.ec2InstanceList,
+            MaxInFlight=self.maxInFlight,
+            Stagger=self.stagger,
+            Timeout=self.interval,
+            DryRun=self.DryRun,
+            **self.definition["Params"]
+        )
+        if ret == self.status.fail and not report["InstanceIds"]:
+            return self.status.fail, report["Error"]
+        for InstanceId, error in report["Failed"].items():
+            logger.error(f"Failed to {verb} {InstanceId}: {error}")
+            self.actResult[InstanceId] = {"Status": self.status.fail, "PreviousState": NA, "CurrentState": NA, "Error": error}
+        if report["Skipped"]:
+            logger.error(f"Not {verb} since a dependency failed: {report['Skipped']}")
+        for InstanceId in report["Skipped"]:
+            self.actResult[InstanceId] = {"Status": self.status.fail, "PreviousState": NA, "CurrentState": NA, "Error": "Skipped"}
+        logger.info(f"{len(report['InstanceIds'])} instance(s) requested to {verb} in {len(report['Waves'])} wave(s)")
+        return self.status.success, None
+
+    def verify(self):
+        """
+        Wait for the instances that were not in the "After" state at search
+        time, querying them by id only
+        The ones the action failed on stay in the "Before" state, so they are
+        reported as failed without waiting for them
+        """
+        After = self.definition["After"]
+        failedIds = [
+            InstanceId for InstanceId in self.InstanceIds
+            if self.actResult.get(InstanceId, {}).get("Status", self.status.success) != self.status.success
+        ]
+        failed = set(failedIds)
+        targetIds = [InstanceId for InstanceId in self.InstanceIds if InstanceId not in failed] + self.waitingIds
+        # in wave mode, what the waves left of the interval
+        timeout = self.interval if self.waitUntil is None else max(0, self.waitUntil - time.monotonic())
+        logger.info(f"Wait up to {timeout:.0f} seconds for {len(targetIds)} instance(s) to be {After}")
+        ret, states = WaitEC2.waitForState(targetIds, After, Timeout=timeout)
+        if failedIds:
+            logger.error(f"Not waited for since the action failed: {failedIds}")
+            ret = self.status.fail
+        # the confirmed ones are reported in the "After" state of search time
+        for InstanceId in self.confirmedIds:
+            states[InstanceId] = After
+        self.convergence = VerifyEC2.convergence(targetIds + failedIds + self.confirmedIds, states, After)
+        if self.sync is not None and not self.DryRun:
+            for InstanceId, item in self.convergence.items():
+                if item["State"] != NA:
+                    self.sync.setState(InstanceId, item["State"])
+
+        for i, InstanceId in enumerate(targetIds, 1):
+            logger.info(f"EC2 INSTANCE {i:003} ----------------------------------------")
+            logger.info(f"{InstanceId = }")
+            logger.info(f"State = {self.convergence[InstanceId]['State']}")
+        return ret, None
+
+    def pipeline(self):
+        """
+        search, select and act overlapped page by page (Pipeline)
+        """
+        verb, _ = self.definition["Verb"]
+        After = self.definition["After"]
+        logger.info("----------------------------------------")
+        logger.info(f"SEARCH AND {verb.upper()} EC2 INSTANCES")
+        logger.info("----------------------------------------")
+        if not self.precount:
+            logger.info("The instance number is not checked without precount")
+        ret, report = Pipeline.run(
+            self.definition["Api"],
+            self.Filters,
+            self.definition["Before"],
+            After,
+            PreCount=(self.minInstNum, self.maxInstNum) if self.precount else None,
+            Display=displayInstance,
+            DryRun=self.DryRun,
+            **self.definition["Params"]
+        )
+        self.InstanceIds = report["InstanceIds"]
+        self.confirmedIds = report["ConfirmedIds"]
+        self.waitingIds = report["WaitingIds"]
+        self.actResult = report["Results"]
+        if ret == self.status.fail:
+            return self.status.fail, report["Error"]
+
+        for InstanceId, result in self.actResult.items():
+            if result["Status"] != self.status.success:
+                logger.error(f"Failed to {verb} {InstanceId}: {result['Error']}")
+        if report["Listed"] == 0:
+            return self.status.success, "No instance found"
+        if len(self.InstanceIds) == 0 and len(self.waitingIds) == 0:
+            return self.status.success, f"All instances are in {After} state"
+        return self.status.success, None
+
+    def resumable(self):
+        """
+        list -> act -> verify within the deadline, from the continuation
+        (Deadline.Runner)
+        """
+        runner = Deadline.Runner(
+            self.definition,
+            self.Filters,
+            self.minInstNum,
+            self.maxInstNum,
+            self.interval,
+            self.deadline,
+            self.continuation,
+            Display=displayInstance,
+            DryRun=self.DryRun
+        )
+        ret, msg, self.continuation = runner.run()
+        self.InstanceIds = runner.state["InstanceIds"]
+        self.actResult = runner.actResult
+        return ret, msg
+
+    #-------------------------------------------------------
+    # Pipeline
+    #-------------------------------------------------------
+    def run(self):
+        """
+        Run search -> select -> act -> verify
+        In pipeline mode, the first three are the pipeline stage
+        With a deadline, the resumable stage runs them instead
+
+        Returns
+        ------------------------------------
+        status: int
+            Return code
+        msg : str
+            Result message
+        """
+        _, participle = self.definition["Verb"]
+        if self.deadline is not None:
+            return self.resumable()
+        stages = (self.pipeline,) if self.pipelined else (self.search, self.select, self.act)
+        for stage in stages:
+            with Metrics.timer(stage.__name__):
+                ret, msg = stage()
+            if msg is not None:
+                return ret, msg
+
+        with Metrics.timer("verify"):
+            ret, _ = self.verify()
+        if ret == self.status.success:
+            return ret, f"Scceeded in {participle} EC2 instance: {self.InstanceIds}"
+        return ret, f"Failed to {self.definition['Verb'][0]} EC2 instances: {self.InstanceIds}"
+
+
+################################################################################
+# run
+################################################################################
+def run(event, Action, context=None):
+    """
+    Lambda entry point of an action
+
+    Parameters
+    ------------------------------------
+    event : dict
+        Lambda event (see parseEvent)
+    Action : str
+        Key of TRANSITIONS
+    context : object
+        Lambda context, or Deadline.FakeContext, for the deadline
+
+    Returns
+    ------------------------------------
+    response : dict
+        Lambda response
+    """
+
+    logger.debug("start")
+    logger.debug("__VERSION__ = %s", __VERSION__)
+    logger.info("----------------------------------------")
+    logger.info("- START")
+    logger.info("----------------------------------------")
+    status = Status()
+
+    #-------------------------------------------------------
+    # State-change Event
+    #-------------------------------------------------------
+    if InventorySync.isStateChange(event):
+        ret, msg = InventorySync.handleEvent(event)
+        logger.info(msg)
+        logger.debug("end")
+        return endLambda(200, msg)
+
+    #-------------------------------------------------------
+    # Check Arguments
+    #-------------------------------------------------------
+    ret, params = parseEvent(event)
+    if ret != status.success:
+        logger.error(params["msg"])
+        logger.debug("end")
+        return endLambda(200, params["msg"])
+
+    #-------------------------------------------------------
+    # Display Parameters
+    #-------------------------------------------------------
+    continuation = params.get("continuation")
+    for key, value in params.items():
+        if key != "continuation":
+            logger.info(f"{key} = {value}")
+    if continuation is not None:
+        logger.info(f"continuation = {continuation['Phase']} (invocation {continuation['Invocations'] + 1})")
+
+    #-------------------------------------------------------
+    # Run Pipeline
+    #-------------------------------------------------------
+    reserve = params.pop("reserve")
+    reinvoke = params.pop("reinvoke")
+    if params["deadline"]:
+        params["deadline"] = Deadline.Deadline(context, reserve)
+    else:
+        params["deadline"] = None
+    transition = Transition(Action, **params)
+    with Metrics.timer("total"):
+        ret, msg = transition.run()
+    if transition.continuation is not None:
+        logger.info(msg)
+        if reinvoke and context is not None:
+            if Deadline.reinvoke(event, transition.continuation, context) != status.success:
+                logger.error("Failed to invoke the function again, resume it with the continuation")
+        if Metrics.isEnabled():
+            Metrics.emitEMF({"Action": Action})
+        logger.debug("end")
+        return endLambda(202, msg, transition.continuation)
+    if ret == status.success:
+        logger.info(msg)
+    else:
+        logger.error(msg)
+    if Metrics.isEnabled():
+        Metrics.emitEMF({"Action": Action})
+    logger.debug("end")
+    return endLambda(200, msg)
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+import traceback
+
+from . import __VERSION__
+from . import Status
+from . import BatchEC2
+from . import ClientPool
+from .log import logger, LazyRepr
+
+
+################################################################################
+# variables
+################################################################################
+NA = "NA"
+# describe_instance_status accepts up to 100 instance ids per call
+_ID_CHUNK_SIZE = 100
+# Errors caused by some of the ids of the chunk, it is bisected to isolate them
+_BISECT_ERRORS = {"InvalidInstanceID.NotFound", "InvalidInstanceID.Malformed"}
+# State of an id describe_instance_status rejects by itself, i.e. no such instance
+NOT_FOUND = "not-found"
+
+
+################################################################################
+# getInstanceStates
+################################################################################
+def getInstanceStates(InstanceIds, Region=None, Profile=None):
+    """
+    Get the current state of the EC2 instances given
+    Only the instances given are queried, with describe_instance_status
+    and IncludeAllInstances so that stopped instances are returned too
+    A chunk rejected for some of its ids is bisected, so that the ids that
+    don't exist get NOT_FOUND and the others their state
+
+    Parameters
+    ------------------------------------
+    InstanceIds : list
+        EC2 Instance Ids
+    Region : str
+        AWS region name, None means the default region
+    Profile : str
+        Credentials profile name, None means the default credentials
+
+    Returns
+    ------------------------------------
+    status: int
+        fail when any of the calls failed for another reason than its ids
+    states : dict
+        State name per EC2 Instance Id, NOT_FOUND for the ids that don't
+        exist, the instances not returned are missing
+    """
+
+    logger.debug("start")
+    logger.debug("InstanceIds = %s", LazyRepr(InstanceIds))
+
+    status = Status()
+    ret = status.success
+    states = {}
+    try:
+        client = ClientPool.getClient("ec2", Region, Profile)
+    except Exception as e:
+        logger.error(f"Exception: {e}\n{traceback.format_exc()}")
+        logger.debug("end")
+        return status.fail, states
+
+    chunks = [InstanceIds[i:i + _ID_CHUNK_SIZE] for i in range(0, len(InstanceIds), _ID_CHUNK_SIZE)]
+    while chunks:
+        chunk = chunks.pop()
+        try:
+            response = client.describe_instance_status(
+                InstanceIds = chunk,
+                IncludeAllInstances = True
+            )
+        except Exception as e:
+            code = BatchEC2._errorCode(e)
+            # bisect so that one bad id doesn't hide the others
+            if code in _BISECT_ERRORS and len(chunk) > 1:
+                logger.debug("%s: bisect %s id(s)", code, len(chunk))
+                half = len(chunk) // 2
+                chunks += [chunk[:half], chunk[half:]]
+            elif code in _BISECT_ERRORS:
+                logger.warning(f"{code}: {chunk[0]}")
+                states[chunk[0]] = NOT_FOUND
+            else:
+                logger.warning(f"Exception: {e}\n{traceback.format_exc()}")
+                ret = status.fail
+            continue
+        for instanceStatus in response["InstanceStatuses"]:
+            states[instanceStatus["InstanceId"]] = instanceStatus["InstanceState"]["Name"]
+
+    logger.debug("end")
+    return ret, states
+
+
+################################################################################
+# convergence
+################################################################################
+def convergence(InstanceIds, states, TargetState):
+    """
+    Make the per-instance convergence map
+
+    Parameters
+    ------------------------------------
+    InstanceIds : list
+        EC2 Instance Ids
+    states : dict
+        State name per EC2 Instance Id
+    TargetState : str
+        Expected state
+
+    Returns
+    ------------------------------------
+    result : dict
+        {InstanceId: {"State": "running", "Converged": True}, ...}
+        State is "NA" when the instance was not returned
+    """
+
+    return {
+        InstanceId: {
+            "State": states.get(InstanceId, NA),
+            "Converged": states.get(InstanceId) == TargetState
+        }
+        for InstanceId in InstanceIds
+    }
+
+
+################################################################################
+# verify
+################################################################################
+def verify(InstanceIds, TargetState, Region=None, Profile=None):
+    """
+    Check whether the EC2 instances given are in the target state now
+
+    Parameters
+    ------------------------------------
+    InstanceIds : list
+        EC2 Instance Ids acted on
+    TargetState : str
+        Expected state such as "running" or "stopped"
+    Region : str
+        AWS region name, None means the default region
+    Profile : str
+        Credentials profile name, None means the default credentials
+
+    Returns
+    ------------------------------------
+    status: int
+        success when all instances converged, fail when not
+    result : dict
+        Convergence map (see convergence)
+    """
+
+    status = Status()
+    _, states = getInstanceStates(InstanceIds, Region, Profile)
+    result = convergence(InstanceIds, states, TargetState)
+    if all(item["Converged"] for item in result.values()):
+        return status.success, result
+    return status.fail, result
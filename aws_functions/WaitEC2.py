@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+import random
+import time
+
+from . import __VERSION__
+from . import Status
+from . import Metrics
+from . import VerifyEC2
+from .log import logger
+
+
+################################################################################
+# variables
+################################################################################
+_TIMEOUT = 120
+_DELAY = 2.0
+_MAX_DELAY = 15.0
+# States from which the target state can never be reached,
+# NOT_FOUND being the one of the ids that don't exist
+_UNREACHABLE = {"shutting-down", "terminated", VerifyEC2.NOT_FOUND}
+# Target state -> states moving away from it, e.g. stopping while waiting
+# for running, that only another action can bring back. The state the
+# action starts from isn't one: describe_instances may still return it
+# just after the call
+_DIVERGING = {
+    "running": {"stopping"},
+    "stopped": {"pending"},
+}
+
+
+################################################################################
+# isSettled
+################################################################################
+def isSettled(State, TargetState):
+    """
+    True when an instance in State needs no more polling for TargetState:
+    it is in it, or it can't reach it without another action
+    """
+
+    return State == TargetState or State in _UNREACHABLE or State in _DIVERGING.get(TargetState, ())
+
+
+################################################################################
+# waitForState
+################################################################################
+def waitForState(InstanceIds, TargetState, Timeout=_TIMEOUT, Delay=_DELAY,
+                 MaxDelay=_MAX_DELAY, Region=None, Profile=None):
+    """
+    Wait until the EC2 instances reach the target state
+    Only the instances that have not reached it yet are polled by id
+    (VerifyEC2.getInstanceStates), with exponential backoff and jitter,
+    and it returns as soon as all converge or can't converge (isSettled),
+    or when the states can't be got
+
+    Parameters
+    ------------------------------------
+    InstanceIds : list
+        EC2 Instance Ids
+    TargetState : str
+        Expected state such as "running" or "stopped"
+    Timeout : int
+        Overall deadline in seconds
+    Delay : float
+        First polling interval in seconds
+    MaxDelay : float
+        Upper limit of the polling interval in seconds
+    Region : str
+        AWS region name, None means the default region
+    Profile : str
+        Credentials profile name, None means the default credentials
+
+    Returns
+    ------------------------------------
+    status: int
+        success when all instances reached the target state, fail when not
+    states : dict
+        Last known state name per EC2 Instance Id
+    """
+
+    logger.debug("start")
+    logger.debug("__VERSION__ = %s", __VERSION__)
+    logger.debug("TargetState = %s, Timeout = %s, len(InstanceIds) = %s", TargetState, Timeout, len(InstanceIds))
+
+    #-------------------------------------------------------
+    # Variables
+    #-------------------------------------------------------
+    status = Status()
+    deadline = time.monotonic() + Timeout
+    states = {InstanceId: None for InstanceId in InstanceIds}
+    waiting = list(states)
+    attempt = 0
+
+    #-------------------------------------------------------
+    # Polling
+    #-------------------------------------------------------
+    while waiting:
+        Metrics.count("Polls")
+        ret, current = VerifyEC2.getInstanceStates(waiting, Region, Profile)
+        states.update(current)
+        if ret != status.success:
+            # not a bad id (NOT_FOUND), e.g. credentials or permissions
+            logger.error("Failed to get the states, stop waiting")
+            break
+        waiting = [InstanceId for InstanceId in waiting if not isSettled(states[InstanceId], TargetState)]
+        logger.debug("%s instance(s) not in %s state", len(waiting), TargetState)
+        if not waiting:
+            break
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            logger.warning(f"Timed out: {waiting}")
+            break
+        # jitter: sleep a random time between Delay / 2 and the current backoff
+        backoff = min(MaxDelay, Delay * (2 ** attempt))
+        with Metrics.timer("WaitSleep"):
+            time.sleep(min(remaining, random.uniform(Delay / 2, backoff)))
+        attempt += 1
+
+    #-------------------------------------------------------
+    # Return Value
+    #-------------------------------------------------------
+    logger.debug("end")
+    if all(state == TargetState for state in states.values()):
+        return status.success, states
+    return status.fail, states
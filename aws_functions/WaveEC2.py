@@ -0,0 +1,397 @@
+# -*- coding: utf-8 -*-
+################################################################################
+# Dependency-ordered start / stop in waves
+#-------------------------------------------------------------------------------
+# Starting every instance at once makes a boot storm against what they share,
+# e.g. the domain controllers DC01 / DC02, databases or license servers.
+# The order comes from two tags:
+#   StartOrder : integer, an instance starts after every instance of the
+#                next lower StartOrder is running
+#   DependsOn  : Name tags (or instance ids) of the instances it needs,
+#                separated by spaces or "+"
+# e.g. DC01 and DC02 with StartOrder=1, DB01 with StartOrder=2, and APP01
+# with DependsOn=DB01.
+#
+# An instance is started as soon as all of its dependencies are running, so
+# the total time is the one of the critical path rather than the sum of the
+# waits of every level. MaxInFlight caps the instances started and not yet
+# running, and Stagger spaces the start calls. Stop runs in reverse: an
+# instance stops after the ones depending on it are stopped.
+################################################################################
+import re
+import time
+import traceback
+
+from . import __VERSION__
+from . import Status
+from . import BatchEC2
+from . import Metrics
+from . import VerifyEC2
+from .log import logger
+
+
+################################################################################
+# variables
+################################################################################
+ORDER_TAG = "StartOrder"
+DEPENDS_TAG = "DependsOn"
+_MAX_IN_FLIGHT = 50
+_STAGGER = 0.0
+_BATCH_SIZE = BatchEC2._CHUNK_SIZE
+_DELAY = 2.0
+_TIMEOUT = 600
+_SEPARATOR = re.compile(r"[\s+]+")
+
+# Action : (state acted on, state in transition, state reached)
+_DIRECTIONS = {
+    "start": ("stopped", "pending", "running"),
+    "stop": ("running", "stopping", "stopped"),
+}
+
+
+################################################################################
+# Graph
+################################################################################
+def buildGraph(EC2InstanceList, OrderTag=ORDER_TAG, DependsTag=DEPENDS_TAG):
+    """
+    Dependencies of the instances for starting them
+
+    Parameters
+    ------------------------------------
+    EC2InstanceList : list
+        EC2Instance
+    OrderTag : str
+        Tag key of the start order
+    DependsTag : str
+        Tag key of the dependencies
+
+    Returns
+    ------------------------------------
+    dependencies : dict
+        {InstanceId: set of the InstanceIds it needs running first}
+        Dependencies that are not in EC2InstanceList are ignored
+    """
+
+    byName = {}
+    orders = {}
+    for instance in EC2InstanceList:
+        byName.setdefault(instance.name, []).append(instance.InstanceId)
+        order = instance.TagDict.get(OrderTag)
+        if order is None:
+            continue
+        try:
+            orders.setdefault(int(order), []).append(instance.InstanceId)
+        except ValueError:
+            logger.warning(f"Invalid {OrderTag} of {instance.InstanceId}: {order}")
+
+    dependencies = {instance.InstanceId: set() for instance in EC2InstanceList}
+
+    # StartOrder: the previous order is enough, the lower ones come with it
+    levels = sorted(orders)
+    for previous, current in zip(levels, levels[1:]):
+        for InstanceId in orders[current]:
+            dependencies[InstanceId].update(orders[previous])
+
+    # DependsOn
+    for instance in EC2InstanceList:
+        value = instance.TagDict.get(DependsTag)
+        if not value:
+            continue
+        for name in _SEPARATOR.split(value.strip()):
+            ids = byName.get(name) or ([name] if name in dependencies else [])
+            if not ids:
+                logger.warning(f"{instance.InstanceId} depends on {name}, which is not in the instances")
+            dependencies[instance.InstanceId].update(i for i in ids if i != instance.InstanceId)
+    return dependencies
+
+
+def reverseGraph(dependencies):
+    """
+    Dependencies for stopping: an instance waits for its dependents
+    """
+
+    reverse = {InstanceId: set() for InstanceId in dependencies}
+    for InstanceId, needs in dependencies.items():
+        for need in needs:
+            reverse[need].add(InstanceId)
+    return reverse
+
+
+def waves(dependencies):
+    """
+    Levels of the graph, each one only needs the ones before it
+
+    Returns
+    ------------------------------------
+    waves : list
+        [[InstanceIds of level 0], [level 1], ...]
+
+    Raises
+    ------------------------------------
+    ValueError
+        When the dependencies have a cycle
+    """
+
+    remaining = {InstanceId: set(needs) for InstanceId, needs in dependencies.items()}
+    result = []
+    while remaining:
+        level = sorted(i for i, needs in remaining.items() if not needs)
+        if not level:
+            raise ValueError(f"Dependency cycle among {sorted(remaining)}")
+        result.append(level)
+        for InstanceId in level:
+            del remaining[InstanceId]
+        for needs in remaining.values():
+            needs.difference_update(level)
+    return result
+
+
+################################################################################
+# run
+################################################################################
+def run(Action, EC2InstanceList, MaxInFlight=_MAX_IN_FLIGHT, Stagger=_STAGGER, BatchSize=_BATCH_SIZE,
+        Delay=_DELAY, Timeout=_TIMEOUT, OrderTag=ORDER_TAG, DependsTag=DEPENDS_TAG, DryRun=False,
+        Region=None, Profile=None, **kwargs):
+    """
+    Start or stop the instances in dependency order
+
+    Parameters
+    ------------------------------------
+    Action : str
+        "start" or "stop"
+    EC2InstanceList : list
+        EC2Instance, the ones already in the final state count as done
+    MaxInFlight : int
+        Instances acted on and not yet in the final state at most
+    Stagger : float
+        Seconds between two API calls
+    BatchSize : int
+        The number of EC2 instances per API call
+    Delay : float
+        Polling interval of the instances in flight
+    Timeout : int
+        Overall deadline in seconds
+    OrderTag : str
+        Tag key of the start order
+    DependsTag : str
+        Tag key of the dependencies
+    DryRun : boolean
+    Region : str
+        AWS region name, None means the default region
+    Profile : str
+        Credentials profile name, None means the default credentials
+    kwargs : dict
+        Additional parameters of the API, e.g. Hibernate
+
+    Returns
+    ------------------------------------
+    status: int
+        success when every instance reached the final state,
+        warning when some of them did, fail otherwise
+    report : dict
+        {
+            "Waves": [[InstanceIds], ...] levels of the graph,
+            "InstanceIds": [ids acted on, in order],
+            "States": {InstanceId: last known state},
+            "ReadySeconds": {InstanceId: seconds until it reached the final state},
+            "Failed": {InstanceId: error},
+            "Skipped": [ids not acted on since a dependency failed],
+            "Error": message when status is fail, else None
+        }
+    """
+
+    logger.debug("start")
+    logger.debug("__VERSION__ = %s", __VERSION__)
+    logger.debug("Action = %s, MaxInFlight = %s, Stagger = %s, len(EC2InstanceList) = %s", Action, MaxInFlight, Stagger, len(EC2InstanceList))
+
+    #-------------------------------------------------------
+    # Variables
+    #-------------------------------------------------------
+    status = Status()
+    before, transit, after = _DIRECTIONS[Action]
+    started = time.monotonic()
+    deadline = started + Timeout
+    report = {
+        "Waves": [],
+        "InstanceIds": [],
+        "States": {i.InstanceId: i.stateName for i in EC2InstanceList},
+        "ReadySeconds": {},
+        "Failed": {},
+        "Skipped": [],
+        "Error": None
+    }
+    if MaxInFlight < 1 or BatchSize < 1 or Stagger < 0:
+        report["Error"] = f"Invalid MaxInFlight / BatchSize / Stagger: {MaxInFlight} / {BatchSize} / {Stagger}"
+        logger.error(report["Error"])
+        logger.debug("end")
+        return status.fail, report
+
+    #-------------------------------------------------------
+    # Graph
+    #-------------------------------------------------------
+    dependencies = buildGraph(EC2InstanceList, OrderTag, DependsTag)
+    if Action == "stop":
+        dependencies = reverseGraph(dependencies)
+    try:
+        report["Waves"] = waves(dependencies)
+    except ValueError as e:
+        logger.error(f"{e}")
+        report["Error"] = str(e)
+        logger.debug("end")
+        return status.fail, report
+    for n, wave in enumerate(report["Waves"], 1):
+        logger.info(f"Wave {n}: {wave}")
+    dependents = reverseGraph(dependencies)
+
+    # InstanceId -> dependencies not yet in the final state
+    blocking = {i: set(needs) for i, needs in dependencies.items()}
+    done = set()
+    inFlight = set()
+    skipped = set()
+    ready = []
+
+    def release(InstanceId):
+        done.add(InstanceId)
+        report["ReadySeconds"][InstanceId] = round(time.monotonic() - started, 3)
+        for dependent in sorted(dependents[InstanceId]):
+            blocking[dependent].discard(InstanceId)
+            if not blocking[dependent]:
+                ready.append(dependent)
+
+    def fail(InstanceId, error):
+        report["Failed"][InstanceId] = error
+        # everything depending on it, directly or not, is skipped
+        stack = list(dependents[InstanceId])
+        while stack:
+            dependent = stack.pop()
+            if dependent in skipped or dependent in report["Failed"]:
+                continue
+            skipped.add(dependent)
+            stack += dependents[dependent]
+
+    def blocked(InstanceId):
+        return InstanceId in skipped or InstanceId in report["Failed"]
+
+    #-------------------------------------------------------
+    # Initial States
+    #-------------------------------------------------------
+    for wave in report["Waves"]:
+        for InstanceId in wave:
+            state = report["States"][InstanceId]
+            if state == transit:
+                inFlight.add(InstanceId)
+            elif state not in (before, after):
+                fail(InstanceId, f"{state} state")
+    for wave in report["Waves"]:
+        for InstanceId in wave:
+            if report["States"][InstanceId] == after and not blocked(InstanceId):
+                release(InstanceId)
+    ready[:] = [
+        i for wave in report["Waves"] for i in wave
+        if not blocking[i] and i not in done and i not in inFlight and not blocked(i)
+    ]
+
+    #-------------------------------------------------------
+    # Act on the ready ones, poll the ones in flight
+    #-------------------------------------------------------
+    lastCall = None
+    lastPoll = None
+    try:
+        while True:
+            now = time.monotonic()
+            ready[:] = [i for i in ready if not blocked(i) and i not in done and i not in inFlight]
+
+            # act on as many ready instances as MaxInFlight and Stagger allow
+            while ready and len(inFlight) < MaxInFlight and (lastCall is None or now - lastCall >= Stagger):
+                batch = ready[:min(BatchSize, MaxInFlight - len(inFlight))]
+                del ready[:len(batch)]
+                logger.info(f"{Action} {batch}")
+                _, results = BatchEC2.run(
+                    Action, batch, ChunkSize=len(batch), MaxWorkers=1,
+                    DryRun=DryRun, Region=Region, Profile=Profile, **kwargs
+                )
+                Metrics.count("Waves")
+                lastCall = now = time.monotonic()
+                report["InstanceIds"] += batch
+                for InstanceId in batch:
+                    result = results.get(InstanceId, {})
+                    if result.get("Status") != status.success:
+                        logger.error(f"Failed to {Action} {InstanceId}: {result.get('Error')}")
+                        fail(InstanceId, result.get("Error"))
+                    elif DryRun:
+                        release(InstanceId)
+                    else:
+                        inFlight.add(InstanceId)
+                if Stagger > 0:
+                    break
+
+            if not inFlight and not ready:
+                break
+            if now >= deadline:
+                report["Error"] = f"Timed out: {sorted(inFlight) + ready}"
+                logger.warning(report["Error"])
+                break
+
+            # poll the ones in flight every Delay
+            if inFlight and (lastPoll is None or now - lastPoll >= Delay):
+                Metrics.count("Polls")
+                _, states = VerifyEC2.getInstanceStates(sorted(inFlight), Region, Profile)
+                lastPoll = time.monotonic()
+                report["States"].update(states)
+                for InstanceId, state in states.items():
+                    if InstanceId not in inFlight:
+                        continue
+                    if state == after:
+                        inFlight.discard(InstanceId)
+                        release(InstanceId)
+                    elif state not in (transit, before):
+                        inFlight.discard(InstanceId)
+                        fail(InstanceId, f"{state} state")
+                continue
+
+            # sleep until the next poll or the next API call, whichever comes first
+            waits = []
+            if inFlight:
+                waits.append(lastPoll + Delay - now)
+            if ready and len(inFlight) < MaxInFlight and lastCall is not None:
+                waits.append(lastCall + Stagger - now)
+            with Metrics.timer("WaveSleep"):
+                time.sleep(max(0, min(waits + [deadline - now])))
+    except Exception as e:
+        logger.error(f"Exception: {e}\n{traceback.format_exc()}")
+        report["Error"] = str(e)
+
+    #-------------------------------------------------------
+    # Return Value
+    #-------------------------------------------------------
+    report["Skipped"] = sorted(skipped)
+    logger.info(f"{len(done)} instance(s) {after}, {len(report['Failed'])} failed, {len(skipped)} skipped")
+    logger.debug("end")
+    total = len(dependencies)
+    if len(done) == total:
+        return status.success, report
+    if report["Error"] is None:
+        report["Error"] = f"Failed to {Action} EC2 instances: {sorted(report['Failed'])}, skipped: {report['Skipped']}"
+    if len(done) == 0:
+        return status.fail, report
+    return status.warning, report
+
+
+################################################################################
+# start
+################################################################################
+def start(EC2InstanceList, **kwargs):
+    """
+    Start the instances in dependency order (see run)
+    """
+    return run("start", EC2InstanceList, **kwargs)
+
+
+################################################################################
+# stop
+################################################################################
+def stop(EC2InstanceList, **kwargs):
+    """
+    Stop the instances in reverse dependency order (see run)
+    """
+    return run("stop", EC2InstanceList, **kwargs)
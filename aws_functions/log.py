@@ -15,6 +15,8 @@ from logging import (
 # VARIABLES
 ################################################################################
 _LOGLEVEL_ = INFO
+# Upper limit of the characters LazyRepr produces
+_REPR_LIMIT_ = 4096
 
 
 ################################################################################
@@ -30,3 +32,118 @@ if len(logger.handlers) == 0:
     logger.addHandler(handler)
 
 
+################################################################################
+# Lazy Formatting
+#-------------------------------------------------------------------------------
+# logger formats "%s" arguments only when the record is emitted, so pass
+# values as arguments instead of building f-strings:
+#     logger.debug("response = %s", LazyRepr(response))
+#     logger.debug("count = %s", Lazy(len, instances))
+################################################################################
+class _Full(Exception):
+    pass
+
+
+def _cappedRepr(obj, limit):
+    """
+    repr() of dict/list/tuple nesting that stops working once limit is reached
+    """
+
+    parts = []
+    size = 0
+
+    def write(text):
+        nonlocal size
+        parts.append(text)
+        size += len(text)
+        if size > limit:
+            raise _Full
+
+    def walk(o):
+        if isinstance(o, dict):
+            write("{")
+            for i, (key, value) in enumerate(o.items()):
+                if i:
+                    write(", ")
+                walk(key)
+                write(": ")
+                walk(value)
+            write("}")
+        elif isinstance(o, (list, tuple)):
+            write("[" if isinstance(o, list) else "(")
+            for i, value in enumerate(o):
+                if i:
+                    write(", ")
+                walk(value)
+            if isinstance(o, tuple) and len(o) == 1:
+                write(",")
+            write("]" if isinstance(o, list) else ")")
+        elif isinstance(o, str) and len(o) > limit:
+            write(repr(o[:limit]))
+        else:
+            write(repr(o))
+
+    try:
+        walk(obj)
+    except _Full:
+        return "".join(parts)[:limit] + "...(truncated)"
+    return "".join(parts)
+
+
+class LazyRepr:
+    """
+    repr() of the object computed only when the log record is formatted
+    The result is capped to limit characters
+
+    Parameters
+    ------------------------------------
+    obj : object
+        Object to be logged
+    limit : int
+        Upper limit of the characters, None means no limit
+    """
+
+    __slots__ = ("obj", "limit")
+
+    def __init__(self, obj, limit=_REPR_LIMIT_):
+        self.obj = obj
+        self.limit = limit
+
+    def __str__(self):
+        if self.limit is None:
+            return repr(self.obj)
+        return _cappedRepr(self.obj, self.limit)
+
+    __repr__ = __str__
+
+
+class Lazy:
+    """
+    Function call evaluated only when the log record is formatted
+
+    Parameters
+    ------------------------------------
+    func : callable
+        Function to be called
+    args : tuple
+        Arguments of the function
+    """
+
+    __slots__ = ("func", "args")
+
+    def __init__(self, func, *args):
+        self.func = func
+        self.args = args
+
+    def __str__(self):
+        return str(self.func(*self.args))
+
+    __repr__ = __str__
+
+
+def isDebug():
+    """
+    Guard for debug-only work that is more than formatting a message
+    """
+
+    return logger.isEnabledFor(DEBUG)
@@ -0,0 +1,421 @@
+# -*- coding: utf-8 -*-
+################################################################################
+# Offline benchmarks of aws_functions
+#-------------------------------------------------------------------------------
+# Every scenario runs against the FakeEC2 stand-in (or a Stubber backed
+# botocore client), never against AWS:
+#   list     : ListEC2.getEC2Instances over the whole fleet
+#   extract  : ListEC2.extractEC2Info over pre-fetched pages
+#   stubber  : ListEC2.getEC2Instances through botocore with Stubber
+#   control  : BatchEC2.stop of the running and BatchEC2.start of the stopped
+#   handler  : Transition.run of the start action, as the Lambda handler does
+#   pipeline : the same with "pipeline", acting while listing
+#   deadline : the same with "deadline" and a 1 second FakeContext, resumed
+#              from the continuation until it ends
+#   schedule : Schedule.run over the Schedule tags of the fleet
+#   snapshot : Snapshot.SnapshotStore.record of the fleet twice, with a diff
+#   analytics: Analytics.Fleet of the fleet, its summary and tag compliance
+#
+# Each (scenario, size) runs in its own process so that the peak RSS belongs
+# to it. One JSON object per result is written, e.g.
+#     python benchmarks/BenchEC2.py --sizes 100 1000 10000 50000 --output bench_output.txt
+#     python benchmarks/BenchEC2.py --compare old.txt bench_output.txt
+#
+# Result fields:
+#   Seconds / MinSeconds : median / minimum wall time of the repeats
+#   ClientSeconds        : time spent inside the stand-in (median run)
+#   ApiCalls             : calls per API of one run
+#   PeakRSSKiB           : peak resident set size of the process
+#   SetupRSSKiB          : peak resident set size before the first run
+#   AllocatedPeakBytes   : tracemalloc peak of one run
+#   AllocatedBlocks      : memory blocks still allocated after one run
+################################################################################
+import argparse
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import FakeEC2
+from aws_functions import Analytics
+from aws_functions import BatchEC2
+from aws_functions import ClientPool
+from aws_functions import Deadline
+from aws_functions import InventoryCache
+from aws_functions import ListEC2
+from aws_functions import Schedule
+from aws_functions import Snapshot
+from aws_functions import Transition
+from aws_functions.log import logger
+
+
+################################################################################
+# variables
+################################################################################
+SIZES = [100, 1000, 10000, 50000]
+SCENARIOS = ["list", "extract", "stubber", "control", "handler", "pipeline", "deadline", "schedule", "snapshot", "analytics"]
+REPEAT = 3
+# matches every instance of the fleet
+FILTERS = [{"Name": "tag:env", "Values": ["prd", "stg", "dev"]}]
+PAGE_SIZE = 100
+
+
+################################################################################
+# Scenarios
+#-------------------------------------------------------------------------------
+# A scenario takes the fleet size and returns (prepare, run):
+#   prepare() : builds the state of one run outside of the measurement
+#   run(state) : the measured part, returns the stand-in or None
+################################################################################
+def _inject(fake):
+    ClientPool.clearClients()
+    ClientPool.setClient(fake, "ec2")
+    InventoryCache.configure()
+    return fake
+
+
+def scenarioList(Size):
+    reservations = FakeEC2.makeFleet(Size)
+
+    def prepare():
+        return _inject(FakeEC2.FakeEC2(reservations))
+
+    def run(fake):
+        ret, instances = ListEC2.getEC2Instances(FILTERS, MaxResults=PAGE_SIZE)
+        assert len(instances) == Size, (ret, len(instances))
+        return fake
+    return prepare, run
+
+
+def scenarioExtract(Size):
+    fake = FakeEC2.FakeEC2(FakeEC2.makeFleet(Size))
+    pages = []
+    NextToken = None
+    while True:
+        response = fake.describe_instances(Filters=FILTERS, MaxResults=PAGE_SIZE, NextToken=NextToken)
+        pages.append(response["Reservations"])
+        NextToken = response.get("NextToken")
+        if NextToken is None:
+            break
+
+    def prepare():
+        # the responses are consumed as getEC2InstancePage does
+        return [{"Reservations": list(page)} for page in pages]
+
+    def run(responses):
+        EC2InstanceList = []
+        for response in responses:
+            _, instances = ListEC2.extractEC2Info(response, Consume=True)
+            EC2InstanceList.extend(instances)
+        assert len(EC2InstanceList) == Size, len(EC2InstanceList)
+        return None
+    return prepare, run
+
+
+def scenarioStubber(Size):
+    reservations = FakeEC2.makeFleet(Size)
+
+    def prepare():
+        ClientPool.clearClients()
+        client, stubber = FakeEC2.makeStubber(reservations, FILTERS, PAGE_SIZE)
+        ClientPool.setClient(client, "ec2")
+        return client, stubber
+
+    def run(state):
+        client, stubber = state
+        ret, instances = ListEC2.getEC2Instances(FILTERS, MaxResults=PAGE_SIZE)
+        assert len(instances) == Size, (ret, len(instances))
+        stubber.assert_no_pending_responses()
+        return client.stand_in
+    return prepare, run
+
+
+def scenarioControl(Size):
+    def prepare():
+        return _inject(FakeEC2.FakeEC2(FakeEC2.makeFleet(Size), Transition=False))
+
+    def run(fake):
+        running = [i for i, instance in fake.instances.items() if instance["State"]["Name"] == "running"]
+        stopped = [i for i, instance in fake.instances.items() if instance["State"]["Name"] == "stopped"]
+        BatchEC2.stop(running)
+        BatchEC2.start(stopped)
+        return fake
+    return prepare, run
+
+
+def scenarioHandler(Size, **Options):
+    event = {
+        "loglevel": "WARNING",
+        "Filters": FILTERS,
+        "minInstNum": 0,
+        "maxInstNum": Size,
+        "interval": 60,
+        **Options
+    }
+
+    def prepare():
+        return _inject(FakeEC2.FakeEC2(FakeEC2.makeFleet(Size)))
+
+    def run(fake):
+        response = Transition.run(event, "start")
+        assert response["body"].startswith("Scceeded"), response["body"][:200]
+        return fake
+    return prepare, run
+
+
+def scenarioPipeline(Size):
+    return scenarioHandler(Size, pipeline=True)
+
+
+def scenarioDeadline(Size, TimeoutSeconds=1.0):
+    event = {
+        "loglevel": "WARNING",
+        "Filters": FILTERS,
+        "minInstNum": 0,
+        "maxInstNum": Size,
+        "interval": 60,
+        "deadline": True,
+        "reserve": 0,
+    }
+
+    def prepare():
+        return _inject(FakeEC2.FakeEC2(FakeEC2.makeFleet(Size)))
+
+    def run(fake):
+        response = Transition.run(event, "start", Deadline.FakeContext(TimeoutSeconds))
+        while "continuation" in response:
+            # through JSON, as the next invocation gets it
+            continuation = json.loads(json.dumps(response["continuation"]))
+            response = Transition.run(dict(event, continuation=continuation), "start", Deadline.FakeContext(TimeoutSeconds))
+        assert response["body"].startswith("Scceeded"), response["body"][:200]
+        return fake
+    return prepare, run
+
+
+def scenarioSchedule(Size):
+    # Monday 2025-01-06 03:00 UTC, 12:00 in Tokyo and 22:00 of Sunday in New York
+    Now = 1736132400
+
+    def prepare():
+        return _inject(FakeEC2.FakeEC2(FakeEC2.makeFleet(Size)))
+
+    def run(fake):
+        ret, result = Schedule.run(Now=Now)
+        assert ret == 0 and result["Plan"]["Schedules"] > 0, result["Plan"]
+        return fake
+    return prepare, run
+
+
+def scenarioSnapshot(Size):
+    fake = _inject(FakeEC2.FakeEC2(FakeEC2.makeFleet(Size), Transition=False))
+    _, before = ListEC2.getEC2Instances(FILTERS, MaxResults=PAGE_SIZE)
+    fake.stop_instances([i.InstanceId for i in before[:Size // 10]])
+    _, after = ListEC2.getEC2Instances(FILTERS, MaxResults=PAGE_SIZE)
+
+    def prepare():
+        directory = tempfile.mkdtemp(prefix="bench_snapshot_")
+        return Snapshot.SnapshotStore(directory)
+
+    def run(store):
+        store.save(before, Created=1.0)
+        ret, diff = store.record(after)
+        assert ret == 0 and diff is not None, diff
+        shutil.rmtree(store.Directory)
+        return None
+    return prepare, run
+
+
+def scenarioAnalytics(Size):
+    _inject(FakeEC2.FakeEC2(FakeEC2.makeFleet(Size)))
+    _, EC2InstanceList = ListEC2.getEC2Instances(FILTERS, MaxResults=PAGE_SIZE, Fields=Analytics.FIELDS)
+
+    def prepare():
+        return EC2InstanceList
+
+    def run(EC2InstanceList):
+        fleet = Analytics.Fleet(EC2InstanceList)
+        summary = fleet.summary()
+        fleet.countBy("State", "AvailabilityZone", "Platform")
+        fleet.tagCompliance(["env", "team", "Owner"], Allowed={"env": ["prd", "stg", "dev"]})
+        assert summary["Count"] == Size, summary["Count"]
+        return None
+    return prepare, run
+
+
+_SCENARIOS = {
+    "list": scenarioList,
+    "extract": scenarioExtract,
+    "stubber": scenarioStubber,
+    "control": scenarioControl,
+    "handler": scenarioHandler,
+    "pipeline": scenarioPipeline,
+    "deadline": scenarioDeadline,
+    "schedule": scenarioSchedule,
+    "snapshot": scenarioSnapshot,
+    "analytics": scenarioAnalytics,
+}
+
+
+################################################################################
+# measure
+################################################################################
+def _maxRSS():
+    # KiB on Linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss // 1024 if sys.platform == "darwin" else rss
+
+
+def measure(Scenario, Size, Repeat=REPEAT):
+    """
+    Run a scenario in this process
+
+    Parameters
+    ------------------------------------
+    Scenario : str
+        Key of _SCENARIOS
+    Size : int
+        Number of instances of the fleet
+    Repeat : int
+        Timed runs, plus one run under tracemalloc
+
+    Returns
+    ------------------------------------
+    result : dict
+        See the header of this file
+    """
+
+    logger.setLevel("WARNING")
+    prepare, run = _SCENARIOS[Scenario](Size)
+    setupRSS = _maxRSS()
+
+    runs = []
+    for _ in range(Repeat):
+        state = prepare()
+        start = time.perf_counter()
+        fake = run(state)
+        elapsed = time.perf_counter() - start
+        runs.append((elapsed, fake))
+    peakRSS = _maxRSS()
+    seconds = [elapsed for elapsed, _ in runs]
+    median = sorted(runs, key=lambda r: r[0])[len(runs) // 2][1]
+
+    # allocations, measured apart since tracemalloc slows everything down
+    state = prepare()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        run(state)
+        _, allocatedPeak = tracemalloc.get_traced_memory()
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    blocks = sum(stat.count_diff for stat in after.compare_to(before, "filename"))
+
+    return {
+        "Scenario": Scenario,
+        "Size": Size,
+        "Repeat": Repeat,
+        "Seconds": round(statistics.median(seconds), 6),
+        "MinSeconds": round(min(seconds), 6),
+        "ClientSeconds": round(median.seconds, 6) if median is not None and median.seconds is not None else None,
+        "ApiCalls": dict(median.calls) if median is not None else {},
+        "PeakRSSKiB": peakRSS,
+        "SetupRSSKiB": setupRSS,
+        "AllocatedPeakBytes": allocatedPeak,
+        "AllocatedBlocks": blocks,
+    }
+
+
+def _runChild(Scenario, Size, Repeat):
+    """
+    Run a scenario in a fresh interpreter
+    """
+
+    command = [
+        sys.executable, os.path.abspath(__file__),
+        "--child", Scenario, str(Size), "--repeat", str(Repeat)
+    ]
+    completed = subprocess.run(command, capture_output=True, text=True)
+    if completed.returncode != 0:
+        return {"Scenario": Scenario, "Size": Size, "Error": completed.stderr.strip().splitlines()[-1:]}
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+################################################################################
+# compare
+################################################################################
+def compare(Base, New):
+    """
+    Print the wall time ratio New / Base per (scenario, size)
+    """
+
+    def load(path):
+        with open(path) as f:
+            return {
+                (r["Scenario"], r["Size"]): r
+                for r in map(json.loads, f) if "Results" not in r and "Seconds" in r
+            }
+
+    base = load(Base)
+    new = load(New)
+    print(f"{'scenario':10} {'size':>7} {'base[s]':>10} {'new[s]':>10} {'ratio':>7} {'rss ratio':>9}")
+    for key in sorted(set(base) & set(new)):
+        b, n = base[key], new[key]
+        print(
+            f"{key[0]:10} {key[1]:>7} {b['Seconds']:>10.4f} {n['Seconds']:>10.4f} "
+            f"{n['Seconds'] / b['Seconds']:>7.2f} {n['PeakRSSKiB'] / b['PeakRSSKiB']:>9.2f}"
+        )
+
+
+################################################################################
+# main
+################################################################################
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmarks of aws_functions")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES)
+    parser.add_argument("--scenarios", nargs="+", choices=list(_SCENARIOS), default=SCENARIOS)
+    parser.add_argument("--repeat", type=int, default=REPEAT)
+    parser.add_argument("--output", help="file to write the JSON lines to, stdout by default")
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "NEW"), help="compare two outputs")
+    parser.add_argument("--child", nargs=2, metavar=("SCENARIO", "SIZE"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+    if args.child:
+        print(json.dumps(measure(args.child[0], int(args.child[1]), args.repeat)))
+        return
+
+    lines = [{
+        "Results": "aws_functions benchmarks",
+        "Timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "Python": platform.python_version(),
+        "Platform": platform.platform(),
+    }]
+    for Scenario in args.scenarios:
+        for Size in args.sizes:
+            result = _runChild(Scenario, Size, args.repeat)
+            print(f"{Scenario:10} {Size:>7} {result.get('Seconds', result.get('Error'))}", file=sys.stderr)
+            lines.append(result)
+
+    output = "\n".join(json.dumps(line) for line in lines) + "\n"
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        sys.stdout.write(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,429 @@
+# -*- coding: utf-8 -*-
+################################################################################
+# Local EC2 stand-in for the benchmarks
+#-------------------------------------------------------------------------------
+# makeFleet generates a synthetic fleet with the shape of describe_instances
+# (block devices, network interfaces, security groups, tags...), and FakeEC2
+# serves it like a boto3 EC2 client: paginated describe_instances with
+# Filters/InstanceIds, describe_instance_status and start/stop/reboot.
+# Inject it with ClientPool.setClient(FakeEC2(fleet)).
+#
+# makeStubber serves the same fleet through a real botocore client and
+# Stubber, so that botocore's parameter/response validation is included.
+################################################################################
+import copy
+import datetime
+import fnmatch
+import functools
+import random
+import threading
+import time
+
+
+################################################################################
+# variables
+################################################################################
+_REGION = "ap-northeast-1"
+_AZS = [f"{_REGION}{suffix}" for suffix in "acd"]
+_ENVS = ["prd", "stg", "dev"]
+_TEAMS = ["infra", "web", "data", "ml", "ops", "sec"]
+_PLATFORMS = ["Linux/UNIX", "Windows", "Red Hat Enterprise Linux"]
+_TYPES = ["t3.micro", "t3.large", "m6i.xlarge", "c6i.2xlarge", "r6i.4xlarge"]
+_SCHEDULES = [
+    "Mon-Fri 08:00-20:00 Asia/Tokyo",
+    "Mon-Sun 00:00-24:00 UTC",
+    "Mon-Fri 09:00-18:00 America/New_York",
+]
+_LAUNCH_TIME = datetime.datetime(2025, 1, 6, 0, 0, tzinfo=datetime.timezone.utc)
+
+
+################################################################################
+# makeFleet
+################################################################################
+def makeFleet(Size, Seed=0, StoppedRatio=0.5, PerReservation=2):
+    """
+    Generate describe_instances reservations of a synthetic fleet
+
+    Parameters
+    ------------------------------------
+    Size : int
+        The number of instances
+    Seed : int
+        Random seed, the same seed makes the same fleet
+    StoppedRatio : float
+        Ratio of stopped instances, the others are running
+    PerReservation : int
+        Instances per reservation
+
+    Returns
+    ------------------------------------
+    reservations : list
+        Reservations as describe_instances returns
+    """
+
+    rnd = random.Random(Seed)
+    vpcs = [f"vpc-{n:017x}" for n in range(1, 1 + max(1, Size // 5000))]
+    reservations = []
+    for start in range(0, Size, PerReservation):
+        instances = []
+        for n in range(start, min(Size, start + PerReservation)):
+            vpc = rnd.choice(vpcs)
+            az = rnd.choice(_AZS)
+            subnet = f"subnet-{(hash((vpc, az)) & 0xffffffff):08x}"
+            ip = f"10.{n // 65536 % 256}.{n // 256 % 256}.{n % 256}"
+            stopped = rnd.random() < StoppedRatio
+            state = {"Code": 80, "Name": "stopped"} if stopped else {"Code": 16, "Name": "running"}
+            env = rnd.choice(_ENVS)
+            team = rnd.choice(_TEAMS)
+            instance = {
+                "AmiLaunchIndex": 0,
+                "ImageId": f"ami-{rnd.getrandbits(68):017x}",
+                "InstanceId": f"i-{n:017x}",
+                "InstanceType": rnd.choice(_TYPES),
+                "KeyName": f"{team}-key",
+                "LaunchTime": _LAUNCH_TIME,
+                "Monitoring": {"State": "disabled"},
+                "Placement": {"AvailabilityZone": az, "GroupName": "", "Tenancy": "default"},
+                "PrivateDnsName": f"ip-{ip.replace('.', '-')}.{_REGION}.compute.internal",
+                "PrivateIpAddress": ip,
+                "ProductCodes": [],
+                "PublicDnsName": "",
+                "State": state,
+                "StateTransitionReason": "User initiated (2025-02-22 08:00:00 GMT)" if stopped else "",
+                "SubnetId": subnet,
+                "VpcId": vpc,
+                "Architecture": "x86_64",
+                "BlockDeviceMappings": [
+                    {
+                        "DeviceName": f"/dev/sd{letter}",
+                        "Ebs": {
+                            "AttachTime": _LAUNCH_TIME,
+                            "DeleteOnTermination": True,
+                            "Status": "attached",
+                            "VolumeId": f"vol-{rnd.getrandbits(68):017x}"
+                        }
+                    }
+                    for letter in "ab"
+                ],
+                "ClientToken": "",
+                "EbsOptimized": True,
+                "EnaSupport": True,
+                "Hypervisor": "xen",
+                "NetworkInterfaces": [{
+                    "Attachment": {
+                        "AttachTime": _LAUNCH_TIME,
+                        "AttachmentId": f"eni-attach-{rnd.getrandbits(68):017x}",
+                        "DeleteOnTermination": True,
+                        "DeviceIndex": 0,
+                        "Status": "attached"
+                    },
+                    "Description": "",
+                    "Groups": [{"GroupName": f"{team}-sg", "GroupId": f"sg-{hash(team) & 0xffffffff:08x}"}],
+                    "MacAddress": "0a:00:00:00:00:00",
+                    "NetworkInterfaceId": f"eni-{rnd.getrandbits(68):017x}",
+                    "OwnerId": "123456789012",
+                    "PrivateIpAddress": ip,
+                    "PrivateIpAddresses": [{"Primary": True, "PrivateIpAddress": ip}],
+                    "SourceDestCheck": True,
+                    "Status": "in-use",
+                    "SubnetId": subnet,
+                    "VpcId": vpc,
+                    "InterfaceType": "interface"
+                }],
+                "RootDeviceName": "/dev/sda",
+                "RootDeviceType": "ebs",
+                "SecurityGroups": [{"GroupName": f"{team}-sg", "GroupId": f"sg-{hash(team) & 0xffffffff:08x}"}],
+                "SourceDestCheck": True,
+                "Tags": [
+                    {"Key": "Name", "Value": f"{env}-{team}-{n:05d}"},
+                    {"Key": "env", "Value": env},
+                    {"Key": "team", "Value": team},
+                    {"Key": "Schedule", "Value": rnd.choice(_SCHEDULES)},
+                    {"Key": "CostCenter", "Value": f"cc-{rnd.randint(100, 999)}"},
+                ],
+                "VirtualizationType": "hvm",
+                "CpuOptions": {"CoreCount": 1, "ThreadsPerCore": 2},
+                "HibernationOptions": {"Configured": False},
+                "MetadataOptions": {"State": "applied", "HttpTokens": "required", "HttpEndpoint": "enabled"},
+                "PlatformDetails": rnd.choice(_PLATFORMS),
+                "UsageOperation": "RunInstances",
+                "MaintenanceOptions": {"AutoRecovery": "default"},
+            }
+            if stopped:
+                instance["StateReason"] = {
+                    "Code": "Client.UserInitiatedShutdown",
+                    "Message": "Client.UserInitiatedShutdown: User initiated shutdown"
+                }
+            instances.append(instance)
+        reservations.append({
+            "ReservationId": f"r-{start:017x}",
+            "OwnerId": "123456789012",
+            "Groups": [],
+            "Instances": instances
+        })
+    return reservations
+
+
+################################################################################
+# Filters
+################################################################################
+def _values(instance, Name):
+    """
+    Values of the instance for a describe_instances filter name
+    """
+
+    if Name.startswith("tag:"):
+        return [tag["Value"] for tag in instance.get("Tags", []) if tag["Key"] == Name[4:]]
+    if Name == "tag-key":
+        return [tag["Key"] for tag in instance.get("Tags", [])]
+    if Name == "instance-state-name":
+        return [instance["State"]["Name"]]
+    if Name == "instance-id":
+        return [instance["InstanceId"]]
+    if Name == "vpc-id":
+        return [instance.get("VpcId")]
+    if Name == "subnet-id":
+        return [instance.get("SubnetId")]
+    if Name == "availability-zone":
+        return [instance["Placement"]["AvailabilityZone"]]
+    if Name == "instance-type":
+        return [instance.get("InstanceType")]
+    raise ValueError(f"Filter not supported by FakeEC2: {Name}")
+
+
+def matches(instance, Filters):
+    """
+    True when the instance matches every filter (values may contain * and ?)
+    """
+
+    for f in Filters or []:
+        values = _values(instance, f["Name"])
+        if not any(fnmatch.fnmatchcase(str(value), pattern) for value in values for pattern in f["Values"]):
+            return False
+    return True
+
+
+################################################################################
+# FakeEC2
+################################################################################
+def _api(func):
+    """
+    Count the calls of an API and the time spent serving them, so that the
+    benchmarks can tell the cost of the stand-in from the cost of the caller
+    """
+
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            start = time.perf_counter()
+            self.calls[func.__name__] = self.calls.get(func.__name__, 0) + 1
+            try:
+                return func(self, *args, **kwargs)
+            finally:
+                self.seconds += time.perf_counter() - start
+    return wrapper
+
+
+class FakeEC2:
+    """
+    boto3 EC2 client stand-in serving a synthetic fleet
+
+    Parameters
+    ------------------------------------
+    reservations : list
+        makeFleet result, state changes are applied to it
+    Transition : boolean
+        start/stop leave the instances pending/stopping until the next
+        describe call, like the real API
+    """
+
+    def __init__(self, reservations, Transition=True):
+        self.reservations = reservations
+        self.Transition = Transition
+        self.instances = {
+            instance["InstanceId"]: instance
+            for reservation in reservations
+            for instance in reservation["Instances"]
+        }
+        self.calls = {}
+        self.seconds = 0.0
+        # BatchEC2 calls from several threads
+        self._lock = threading.Lock()
+        # InstanceId -> final state of pending/stopping instances
+        self._transitions = {}
+        # repr(Filters) -> matching reservations, for the following pages
+        self._selected = {}
+
+    def _settle(self):
+        if not self._transitions:
+            return
+        for InstanceId, state in self._transitions.items():
+            self.instances[InstanceId]["State"] = state
+        self._transitions.clear()
+        self._invalidate()
+
+    def _invalidate(self):
+        # the instances are shared, only the state filters select differently
+        for key in [key for key in self._selected if "instance-state-name" in key]:
+            del self._selected[key]
+
+    def _select(self, Filters):
+        key = repr(Filters)
+        if key not in self._selected:
+            reservations = [
+                dict(r, Instances=[i for i in r["Instances"] if matches(i, Filters)])
+                for r in self.reservations
+            ]
+            self._selected[key] = [r for r in reservations if r["Instances"]]
+        return self._selected[key]
+
+    #-------------------------------------------------------
+    # Describe
+    #-------------------------------------------------------
+    @_api
+    def describe_instances(self, Filters=None, InstanceIds=None, MaxResults=None, NextToken=None, DryRun=False):
+        self._settle()
+        if InstanceIds is not None:
+            wanted = set(InstanceIds)
+            selected = [r for r in self.reservations if any(i["InstanceId"] in wanted for i in r["Instances"])]
+            reservations = [
+                dict(r, Instances=[i for i in r["Instances"] if i["InstanceId"] in wanted and matches(i, Filters)])
+                for r in selected
+            ]
+            reservations = [r for r in reservations if r["Instances"]]
+        else:
+            reservations = self._select(Filters)
+
+        # pages hold up to MaxResults instances, whole reservations only
+        start = int(NextToken or 0)
+        page = []
+        count = 0
+        end = start
+        for reservation in reservations[start:]:
+            if MaxResults is not None and count and count + len(reservation["Instances"]) > MaxResults:
+                break
+            page.append(reservation)
+            count += len(reservation["Instances"])
+            end += 1
+        response = {"Reservations": page}
+        if end < len(reservations):
+            response["NextToken"] = str(end)
+        return response
+
+    @_api
+    def describe_instance_status(self, InstanceIds=None, IncludeAllInstances=False, Filters=None,
+                                 MaxResults=None, NextToken=None, DryRun=False):
+        self._settle()
+        ids = InstanceIds if InstanceIds is not None else list(self.instances)
+        unknown = [InstanceId for InstanceId in ids if InstanceId not in self.instances]
+        if unknown:
+            # the whole call fails, as the real API does
+            from botocore.exceptions import ClientError
+            raise ClientError(
+                {"Error": {"Code": "InvalidInstanceID.NotFound",
+                           "Message": f"The instance IDs '{', '.join(unknown)}' do not exist"}},
+                "DescribeInstanceStatus"
+            )
+        return {
+            "InstanceStatuses": [
+                {
+                    "InstanceId": InstanceId,
+                    "AvailabilityZone": self.instances[InstanceId]["Placement"]["AvailabilityZone"],
+                    "InstanceState": dict(self.instances[InstanceId]["State"])
+                }
+                for InstanceId in ids if InstanceId in self.instances
+            ]
+        }
+
+    #-------------------------------------------------------
+    # Control
+    #-------------------------------------------------------
+    def _control(self, key, InstanceIds, transit, final):
+        self._invalidate()
+        result = []
+        for InstanceId in InstanceIds:
+            instance = self.instances[InstanceId]
+            previous = dict(instance["State"])
+            if self.Transition:
+                instance["State"] = dict(transit)
+                self._transitions[InstanceId] = dict(final)
+            else:
+                instance["State"] = dict(final)
+            result.append({
+                "InstanceId": InstanceId,
+                "PreviousState": previous,
+                "CurrentState": dict(instance["State"])
+            })
+        return {key: result}
+
+    @_api
+    def start_instances(self, InstanceIds, DryRun=False, **kwargs):
+        return self._control(
+            "StartingInstances", InstanceIds,
+            {"Code": 0, "Name": "pending"}, {"Code": 16, "Name": "running"}
+        )
+
+    @_api
+    def stop_instances(self, InstanceIds, DryRun=False, **kwargs):
+        return self._control(
+            "StoppingInstances", InstanceIds,
+            {"Code": 64, "Name": "stopping"}, {"Code": 80, "Name": "stopped"}
+        )
+
+    @_api
+    def reboot_instances(self, InstanceIds, DryRun=False, **kwargs):
+        return {}
+
+
+################################################################################
+# makeStubber
+################################################################################
+def makeStubber(reservations, Filters, PageSize):
+    """
+    Real botocore EC2 client whose describe_instances pages are served by
+    Stubber, for one getEC2Instances(Filters, PageSize) run
+
+    Returns
+    ------------------------------------
+    client : botocore.client.BaseClient
+        EC2 client, already activated. client.stand_in.calls counts the
+        calls served (stand_in.seconds is None, botocore serves them)
+    stubber : botocore.stub.Stubber
+        Stubber of the client
+    """
+
+    import types
+    import boto3
+    from botocore.stub import Stubber
+
+    client = boto3.client(
+        "ec2",
+        region_name=_REGION,
+        aws_access_key_id="testing",
+        aws_secret_access_key="testing"
+    )
+    stubber = Stubber(client)
+    fake = FakeEC2(reservations)
+    NextToken = None
+    while True:
+        response = fake.describe_instances(Filters=Filters, MaxResults=PageSize, NextToken=NextToken)
+        expected = {"Filters": Filters, "MaxResults": PageSize}
+        if NextToken is not None:
+            expected["NextToken"] = NextToken
+        stubber.add_response("describe_instances", copy.deepcopy(response), expected)
+        NextToken = response.get("NextToken")
+        if NextToken is None:
+            break
+    stubber.activate()
+
+    client.stand_in = types.SimpleNamespace(calls={}, seconds=None)
+
+    methods = {action: method for method, action in client.meta.method_to_api_mapping.items()}
+
+    def beforeParameterBuild(event_name, **kwargs):
+        # before-call is answered by Stubber before reaching other handlers
+        method = methods[event_name.rsplit(".", 1)[-1]]
+        client.stand_in.calls[method] = client.stand_in.calls.get(method, 0) + 1
+
+    client.meta.events.register("before-parameter-build", beforeParameterBuild)
+    return client, stubber
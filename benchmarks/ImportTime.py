@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+################################################################################
+# Import time of the Lambda handlers
+#-------------------------------------------------------------------------------
+# Each target is imported in a fresh interpreter with "python -X importtime",
+# which is what a Lambda cold start pays before the first invocation:
+#     python benchmarks/ImportTime.py --output import_time.txt
+#     python benchmarks/ImportTime.py --compare old.txt import_time.txt
+#
+# Result fields:
+#   Microseconds      : median cumulative import time of the target
+#   WallSeconds       : median wall time of the whole interpreter
+#   Modules           : modules imported by the target
+#   Heavy             : heavy modules imported (boto3, botocore, ...)
+#   Top               : slowest modules by cumulative time
+################################################################################
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+
+################################################################################
+# variables
+################################################################################
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY = ("boto3", "botocore", "s3transfer", "urllib3", "aiobotocore")
+REPEAT = 5
+TOP = 10
+
+# name : (environment, code run in the interpreter)
+_LOAD_HANDLER = (
+    "import importlib.util as u; "
+    "s = u.spec_from_file_location('handler', {path!r}); "
+    "m = u.module_from_spec(s); s.loader.exec_module(m)"
+)
+TARGETS = {
+    "Lambda-StartEC2": ({}, _LOAD_HANDLER.format(path=os.path.join(ROOT, "Lambda-StartEC2.py"))),
+    "Lambda-StopEC2": ({}, _LOAD_HANDLER.format(path=os.path.join(ROOT, "Lambda-StopEC2.py"))),
+    "Lambda-StartEC2+prewarm": (
+        {"AWS_CONTROL_PREWARM": "1"},
+        _LOAD_HANDLER.format(path=os.path.join(ROOT, "Lambda-StartEC2.py"))
+    ),
+    "aws_functions": ({}, "import aws_functions.Transition"),
+    "boto3": ({}, "import boto3"),
+}
+
+
+################################################################################
+# measure
+################################################################################
+def parseImportTime(stderr):
+    """
+    Parse the "-X importtime" output
+
+    Returns
+    ------------------------------------
+    modules : list
+        [(name, self us, cumulative us), ...] in import order
+        name is indented by 2 spaces per nesting level
+    """
+
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        selfTime, cumulative, name = line[len("import time:"):].split("|")
+        modules.append((name.rstrip()[1:], int(selfTime), int(cumulative)))
+    return modules
+
+
+def measure(Name, Repeat=REPEAT):
+    """
+    Import a target in fresh interpreters
+
+    Parameters
+    ------------------------------------
+    Name : str
+        Key of TARGETS
+    Repeat : int
+        Interpreters started
+
+    Returns
+    ------------------------------------
+    result : dict
+        See the header of this file
+    """
+
+    environment, code = TARGETS[Name]
+    env = dict(os.environ, PYTHONPATH=ROOT, PYTHONDONTWRITEBYTECODE="1", **environment)
+
+    totals = []
+    walls = []
+    for _ in range(Repeat):
+        start = time.perf_counter()
+        completed = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", code],
+            capture_output=True, text=True, cwd=ROOT, env=env
+        )
+        walls.append(time.perf_counter() - start)
+        if completed.returncode != 0:
+            return {"Target": Name, "Error": completed.stderr.strip().splitlines()[-1:]}
+        modules = parseImportTime(completed.stderr)
+        # top-level imports only, the others are part of their cumulative time
+        totals.append(sum(cumulative for name, _, cumulative in modules if not name.startswith(" ")))
+
+    names = [name.strip() for name, _, _ in modules]
+    return {
+        "Target": Name,
+        "Repeat": Repeat,
+        "Microseconds": int(statistics.median(totals)),
+        "WallSeconds": round(statistics.median(walls), 6),
+        "Modules": len(names),
+        "Heavy": sorted({name for name in names if name.split(".")[0] in HEAVY and "." not in name}),
+        "Top": [
+            [name.strip(), cumulative]
+            for name, _, cumulative in sorted(modules, key=lambda m: -m[2])[:TOP]
+        ],
+    }
+
+
+################################################################################
+# compare
+################################################################################
+def compare(Base, New):
+    """
+    Print the import time ratio New / Base per target
+    """
+
+    def load(path):
+        with open(path) as f:
+            return {r["Target"]: r for r in map(json.loads, f) if "Microseconds" in r}
+
+    base = load(Base)
+    new = load(New)
+    print(f"{'target':26} {'base[ms]':>9} {'new[ms]':>9} {'ratio':>7}")
+    for name in sorted(set(base) & set(new)):
+        b, n = base[name]["Microseconds"], new[name]["Microseconds"]
+        print(f"{name:26} {b / 1000:>9.1f} {n / 1000:>9.1f} {n / b:>7.2f}")
+
+
+################################################################################
+# main
+################################################################################
+def main():
+    parser = argparse.ArgumentParser(description="Import time of the Lambda handlers")
+    parser.add_argument("--targets", nargs="+", choices=list(TARGETS), default=list(TARGETS))
+    parser.add_argument("--repeat", type=int, default=REPEAT)
+    parser.add_argument("--output", help="file to write the JSON lines to, stdout by default")
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "NEW"), help="compare two outputs")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    lines = [{
+        "Results": "aws_functions import time",
+        "Timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "Python": platform.python_version(),
+        "Platform": platform.platform(),
+    }]
+    for Name in args.targets:
+        result = measure(Name, args.repeat)
+        print(f"{Name:26} {result.get('Microseconds', result.get('Error'))}", file=sys.stderr)
+        lines.append(result)
+
+    output = "\n".join(json.dumps(line) for line in lines) + "\n"
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        sys.stdout.write(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+################################################################################
+# Analytics against plain Python counts over benchmarks/FakeEC2 fleets
+################################################################################
+import collections
+import math
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "benchmarks")]
+
+pytest.importorskip("numpy")
+
+import FakeEC2
+from aws_functions import Analytics
+from aws_functions.EC2Instance import EC2Instance
+
+
+NOW = 1740214800.0  # 2025-02-22 09:00:00 UTC, an hour after the fleet stopped
+
+
+def _instances():
+    instances = [instance for reservation in FakeEC2.makeFleet(500) for instance in reservation["Instances"]]
+    # some instances without the team tag
+    for instance in instances[::7]:
+        instance["Tags"] = [t for t in instance["Tags"] if t["Key"] != "team"]
+    return instances
+
+
+def _value(instance, name):
+    if name.startswith("tag:"):
+        return {t["Key"]: t["Value"] for t in instance["Tags"]}.get(name[4:])
+    return {
+        "State": instance["State"]["Name"],
+        "AvailabilityZone": instance["Placement"]["AvailabilityZone"],
+        "Platform": instance["PlatformDetails"],
+    }.get(name, instance.get(name))
+
+
+@pytest.fixture(scope="module")
+def instances():
+    return _instances()
+
+
+@pytest.fixture(scope="module")
+def fleet(instances):
+    return Analytics.Fleet([EC2Instance.fromInstance(i, Analytics.FIELDS) for i in instances], Now=NOW)
+
+
+@pytest.mark.parametrize("names", [
+    ("State",), ("AvailabilityZone",), ("InstanceType",), ("tag:team",),
+    ("State", "AvailabilityZone"), ("Platform", "tag:team", "tag:env"),
+])
+def test_count_by_matches_a_python_count(fleet, instances, names):
+    expected = collections.Counter(tuple(_value(i, name) for name in names) for i in instances)
+    if len(names) == 1:
+        expected = {key[0]: count for key, count in expected.items()}
+
+    assert fleet.countBy(*names) == dict(expected)
+
+
+def test_group_by_sums_values_skipping_nan(fleet, instances):
+    hours = fleet.stoppedHours()
+
+    groups = fleet.groupBy("AvailabilityZone", Values=hours)
+
+    expected = collections.Counter(
+        i["Placement"]["AvailabilityZone"] for i in instances if i["State"]["Name"] == "stopped"
+    )
+    assert groups.keys() == {(az,) for az in expected}
+    for (az,), total in groups.items():
+        assert math.isclose(total, expected[az] * 1.0)
+
+
+def test_filter_keeps_the_masked_instances(fleet, instances):
+    stopped = fleet.filter(fleet.isIn("State", "stopped") & fleet.hasTag("team"))
+
+    expected = [
+        i for i in instances
+        if i["State"]["Name"] == "stopped" and _value(i, "tag:team") is not None
+    ]
+    assert stopped.InstanceIds.tolist() == [i["InstanceId"] for i in expected]
+    assert stopped.countBy("tag:team") == dict(collections.Counter(_value(i, "tag:team") for i in expected))
+
+
+def test_tag_compliance(fleet, instances):
+    result = fleet.tagCompliance(["team", "env"], Allowed={"env": ["prd", "stg"]})
+
+    compliant = [i for i in instances if _value(i, "tag:team") is not None and _value(i, "tag:env") in ("prd", "stg")]
+    assert result["Compliant"] == len(compliant)
+    assert result["Missing"] == {"team": len(instances[::7]), "env": 0}
+    assert result["Invalid"] == {"env": sum(_value(i, "tag:env") == "dev" for i in instances)}
+    assert len(result["NonCompliantIds"]) == len(instances) - len(compliant)
+
+
+def test_empty_fleet():
+    fleet = Analytics.Fleet([], Now=NOW)
+
+    assert fleet.countBy("State") == {}
+    assert fleet.tagCompliance(["env"])["Rate"] == 1.0
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+################################################################################
+# AsyncEC2 over successive event loops against benchmarks/FakeEC2
+################################################################################
+import asyncio
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "benchmarks")]
+
+import FakeEC2
+from aws_functions import AsyncEC2, ClientPool, InventoryCache, ListEC2
+
+
+FILTERS = [{"Name": "tag:env", "Values": ["prd"]}]
+
+
+class AsyncFake:
+    """
+    Coroutine client over FakeEC2, bound to the event loop it was made in as
+    the connections of an aiobotocore client are
+    """
+
+    def __init__(self, fake, Loop=True):
+        self.fake = fake
+        # None for a client usable in any loop
+        self.loop = asyncio.get_running_loop() if Loop else None
+        self.closed = False
+
+    def __getattr__(self, name):
+        method = getattr(self.fake, name)
+
+        async def call(**kwargs):
+            assert not self.closed, "client closed"
+            assert self.loop in (None, asyncio.get_running_loop()), "client of another event loop"
+            await asyncio.sleep(0)
+            return method(**kwargs)
+        return call
+
+
+class Session:
+    """
+    aiobotocore session making AsyncFake clients
+    """
+
+    def __init__(self, fake):
+        self.fake = fake
+        self.created = []
+
+    def create_client(self, service, **kwargs):
+        session = self
+
+        class Context:
+            async def __aenter__(self):
+                # other coroutines asking for the client wait on the lock meanwhile
+                await asyncio.sleep(0.01)
+                self.client = AsyncFake(session.fake)
+                session.created.append(self.client)
+                return self.client
+
+            async def __aexit__(self, *exc):
+                self.client.closed = True
+                return False
+        return Context()
+
+    def set_config_variable(self, name, value):
+        pass
+
+
+@pytest.fixture
+def session(monkeypatch):
+    session = Session(FakeEC2.FakeEC2(FakeEC2.makeFleet(60)))
+    monkeypatch.setattr("aiobotocore.session.get_session", lambda: session)
+    yield session
+    AsyncEC2.clearClients()
+
+
+async def _list(Close):
+    try:
+        return await AsyncEC2.gather([AsyncEC2.getEC2Instances(FILTERS, MaxResults=5) for _ in range(4)])
+    finally:
+        if Close:
+            await AsyncEC2.closeClients()
+
+
+def _expected(fake):
+    ClientPool.clearClients()
+    ClientPool.setClient(fake, "ec2")
+    InventoryCache.configure()
+    try:
+        _, instances = ListEC2.getEC2Instances(FILTERS)
+    finally:
+        ClientPool.clearClients()
+    return sorted(i.InstanceId for i in instances)
+
+
+@pytest.mark.parametrize("Close", [True, False])
+def test_successive_event_loops_get_their_own_client(session, Close):
+    first = asyncio.run(_list(Close))
+    second = asyncio.run(_list(Close))
+
+    expected = _expected(session.fake)
+    for ret, instances in first + second:
+        assert ret == 0
+        assert sorted(i.InstanceId for i in instances) == expected
+    # one client per loop, shared by the coroutines of the loop
+    assert len(session.created) == 2
+    assert all(client.closed for client in session.created) == Close
+
+
+def test_injected_client_serves_every_loop(session):
+    client = AsyncFake(session.fake, Loop=None)
+    AsyncEC2.setClient(client)
+
+    first = asyncio.run(_list(True))
+    second = asyncio.run(_list(True))
+
+    assert all(ret == 0 for ret, _ in first + second)
+    assert session.created == []
+    assert not client.closed
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+################################################################################
+# BatchEC2 against benchmarks/FakeEC2
+################################################################################
+import os
+import sys
+
+import pytest
+from botocore.exceptions import ClientError
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "benchmarks")]
+
+import FakeEC2
+from aws_functions import BatchEC2, ClientPool
+
+
+class Rejecting(FakeEC2.FakeEC2):
+    """
+    FakeEC2 failing a whole call when it has an id of Bad, or with Code
+    """
+
+    Bad = set()
+    Code = None
+
+    def start_instances(self, InstanceIds, DryRun=False, **kwargs):
+        self.calls["start_instances"] = self.calls.get("start_instances", 0) + 1
+        if self.Code is not None:
+            raise ClientError({"Error": {"Code": self.Code, "Message": "x"}}, "StartInstances")
+        bad = self.Bad & set(InstanceIds)
+        if bad:
+            raise ClientError(
+                {"Error": {"Code": "InvalidInstanceID.NotFound", "Message": f"{sorted(bad)} do not exist"}},
+                "StartInstances"
+            )
+        return self._control(
+            "StartingInstances", InstanceIds,
+            {"Code": 0, "Name": "pending"}, {"Code": 16, "Name": "running"}
+        )
+
+
+@pytest.fixture
+def fake():
+    fake = Rejecting(FakeEC2.makeFleet(100))
+    ClientPool.clearClients()
+    ClientPool.setClient(fake, "ec2")
+    yield fake
+    Rejecting.Bad = set()
+    Rejecting.Code = None
+    ClientPool.clearClients()
+
+
+def test_bisect_isolates_bad_ids(fake):
+    ids = sorted(fake.instances)
+    Rejecting.Bad = {"i-0000000000bad001", "i-0000000000bad002"}
+
+    ret, results = BatchEC2.run("start", ids[:40] + sorted(Rejecting.Bad) + ids[40:], ChunkSize=50)
+
+    assert ret == 1
+    assert {i for i, r in results.items() if r["Status"] != 0} == Rejecting.Bad
+    assert all(results[i]["Status"] == 0 for i in ids)
+    assert all(i["State"]["Name"] in ("pending", "running") for i in fake.instances.values())
+
+
+def test_other_errors_fail_the_chunk_without_bisect(fake):
+    Rejecting.Code = "UnauthorizedOperation"
+
+    ret, results = BatchEC2.run("start", sorted(fake.instances), ChunkSize=50)
+
+    assert ret == 2
+    assert fake.calls["start_instances"] == 2
+    assert all(r["Status"] == 2 for r in results.values())
+
+
+@pytest.mark.parametrize("kwargs", [{"ChunkSize": 0}, {"ChunkSize": -1}, {"MaxWorkers": 0}])
+def test_invalid_sizes_fail(fake, kwargs):
+    ret, results = BatchEC2.run("start", sorted(fake.instances), **kwargs)
+
+    assert ret == 2
+    assert results == {}
+    assert "start_instances" not in fake.calls
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+################################################################################
+# Resumable runs of Deadline against benchmarks/FakeEC2
+################################################################################
+import json
+import os
+import sys
+import time
+
+import pytest
+from botocore.exceptions import ClientError
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "benchmarks")]
+
+import FakeEC2
+from aws_functions import ClientPool, Deadline, InventoryCache, Transition
+
+
+FILTERS = [{"Name": "tag:env", "Values": ["prd", "stg", "dev"]}]
+SIZE = 1000
+
+
+@pytest.fixture
+def fake():
+    fake = FakeEC2.FakeEC2(FakeEC2.makeFleet(SIZE))
+    ClientPool.clearClients()
+    ClientPool.setClient(fake, "ec2")
+    InventoryCache.configure()
+    yield fake
+    ClientPool.clearClients()
+
+
+def _event(**kwargs):
+    event = {
+        "loglevel": "WARNING",
+        "Filters": FILTERS,
+        "minInstNum": 0,
+        "maxInstNum": SIZE,
+        "deadline": True,
+        "reserve": 0,
+    }
+    event.update(kwargs)
+    return event
+
+
+def test_deadline_without_pressure_runs_in_one_invocation(fake):
+    response = Transition.run(_event(), "start", Deadline.FakeContext(60))
+
+    assert response["statusCode"] == 200
+    assert "continuation" not in response
+    assert all(i["State"]["Name"] == "running" for i in fake.instances.values())
+
+
+def test_run_resumes_over_continuations(fake):
+    event = _event()
+    phases = []
+    response = Transition.run(event, "start", Deadline.FakeContext(0.5))
+    for _ in range(100):
+        if "continuation" not in response:
+            break
+        # the continuation goes through the Lambda payload
+        continuation = json.loads(json.dumps(response["continuation"]))
+        phases.append(continuation["Phase"])
+        response = Transition.run(dict(event, continuation=continuation), "start", Deadline.FakeContext(0.5))
+
+    assert "continuation" not in response
+    assert response["statusCode"] == 200
+    assert len(phases) > 1
+    assert phases == sorted(phases, key=Deadline.PHASES.index)
+    assert all(i["State"]["Name"] == "running" for i in fake.instances.values())
+
+
+def test_invalid_continuation_is_rejected(fake):
+    response = Transition.run(_event(continuation={"Phase": "unknown"}), "start")
+
+    assert response["body"] == "Invalid continuation"
+    assert "continuation" not in response
+
+
+def test_deadline_measures_the_longest_operation():
+    deadline = Deadline.Deadline(Deadline.FakeContext(60), Reserve=0)
+    with deadline.measure("page"):
+        pass
+    first = deadline.estimates["page"]
+    with deadline.measure("page"):
+        time.sleep(0.01)
+
+    assert first < Deadline._ESTIMATES["page"]
+    assert deadline.estimates["page"] >= 0.01
+    assert deadline.allows("page")
+    assert not Deadline.Deadline(Deadline.FakeContext(0.5), Reserve=0).allows("act")
+
+
+def test_verify_measures_the_poll(fake):
+    deadline = Deadline.Deadline(Deadline.FakeContext(60), Reserve=0)
+    runner = Deadline.Runner(
+        Transition.TRANSITIONS["start"], FILTERS, 0, SIZE, interval=30, deadline=deadline
+    )
+
+    ret, _, continuation = runner.run()
+
+    assert ret == 0
+    assert continuation is None
+    assert 0 < deadline.estimates["poll"] < Deadline._ESTIMATES["poll"]
+
+
+def test_failed_act_is_not_waited_for(fake):
+    refused = next(InstanceId for InstanceId, i in fake.instances.items() if i["State"]["Name"] == "stopped")
+    fake.start_instances = _refusing(fake.start_instances, refused)
+
+    started = time.monotonic()
+    response = Transition.run(_event(interval=30, loglevel="CRITICAL"), "start", Deadline.FakeContext(60))
+
+    assert time.monotonic() - started < 10
+    assert response["body"].startswith("Failed")
+    assert "continuation" not in response
+    assert fake.instances[refused]["State"]["Name"] == "stopped"
+
+
+def _refusing(start_instances, refused):
+    def refusing(InstanceIds, DryRun=False, **kwargs):
+        if refused in InstanceIds:
+            raise ClientError({"Error": {"Code": "IncorrectInstanceState", "Message": "refused"}}, "StartInstances")
+        return start_instances(InstanceIds=InstanceIds, DryRun=DryRun, **kwargs)
+    return refusing
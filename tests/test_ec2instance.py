@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+################################################################################
+# EC2Instance records
+################################################################################
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "benchmarks")]
+
+import FakeEC2
+from aws_functions import ListEC2
+
+
+def _instances():
+    _, EC2InstanceList = ListEC2.extractEC2Info({"Reservations": FakeEC2.makeFleet(4)})
+    return EC2InstanceList
+
+
+def test_records_are_hashable():
+    first, second = _instances(), _instances()
+
+    assert len(set(first + second)) == 4
+    assert {i: i.InstanceId for i in first}[second[0]] == second[0].InstanceId
+
+
+def test_equal_records_compare_equal():
+    first, second = _instances(), _instances()
+
+    assert first == second
+    assert first[0] != first[1]
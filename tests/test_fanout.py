@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+################################################################################
+# FanOut scheduling
+################################################################################
+import os
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT]
+
+from aws_functions import FanOut
+
+
+def _role(account, name):
+    return f"arn:aws:iam::{account}:role/{name}"
+
+
+class Recorder:
+    """
+    func of FanOut.run recording the targets running per account
+    """
+
+    def __init__(self, Seconds=0.05):
+        self.Seconds = Seconds
+        self.running = {}
+        self.peak = {}
+        self.began = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, target):
+        account = target.RoleArn.split(":")[4]
+        with self._lock:
+            self.began[target] = time.monotonic()
+            self.running[account] = self.running.get(account, 0) + 1
+            self.peak[account] = max(self.peak.get(account, 0), self.running[account])
+        time.sleep(self.Seconds)
+        with self._lock:
+            self.running[account] -= 1
+        return 0, target.Region
+
+
+def test_account_limit_covers_every_role_of_the_account():
+    targets = [(_role("111111111111", f"r{n % 2}"), f"region-{n}") for n in range(8)]
+    recorder = Recorder()
+
+    ret, report = FanOut.run(targets, recorder, MaxWorkers=8, AccountLimit=2)
+
+    assert ret == 0
+    assert recorder.peak["111111111111"] == 2
+    assert [result["Result"] for result in report["Targets"]] == [region for _, region in targets]
+
+
+def test_busy_account_does_not_starve_the_others():
+    busy = [(_role("111111111111", f"r{n}"), f"region-{n}") for n in range(6)]
+    other = (_role("222222222222", "r"), "region-x")
+    recorder = Recorder(0.2)
+
+    started = time.monotonic()
+    ret, report = FanOut.run(busy + [other], recorder, MaxWorkers=2, AccountLimit=1)
+
+    assert ret == 0
+    assert recorder.peak["111111111111"] == 1
+    # it runs next to the first target of the busy account, not after all of them
+    assert recorder.began[FanOut.Target(*other)] - started < recorder.Seconds
+
+
+def test_invalid_limits_fail():
+    ret, report = FanOut.run([(_role("111111111111", "r"), None)], Recorder(0), AccountLimit=0)
+
+    assert ret == 2
+    assert report["Failed"] == 1
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+################################################################################
+# Inventory queries against the filters of benchmarks/FakeEC2
+################################################################################
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "benchmarks")]
+
+import FakeEC2
+from aws_functions import Inventory
+from aws_functions.EC2Instance import EC2Instance
+
+
+FLEET = FakeEC2.makeFleet(300)
+INSTANCES = [instance for reservation in FLEET for instance in reservation["Instances"]]
+IDS = sorted(i["InstanceId"] for i in INSTANCES)
+FILTERS = {
+    "none": [],
+    "env": [{"Name": "tag:env", "Values": ["prd", "stg"]}],
+    "tag-key": [{"Name": "tag-key", "Values": ["Schedule"]}],
+    "team-stopped": [{"Name": "tag:team", "Values": [FakeEC2._TEAMS[0]]}, {"Name": "instance-state-name", "Values": ["stopped"]}],
+    "az": [{"Name": "availability-zone", "Values": [FakeEC2._AZS[0], "nowhere"]}],
+    "vpc-subnet": [
+        {"Name": "vpc-id", "Values": [INSTANCES[0]["VpcId"]]},
+        {"Name": "subnet-id", "Values": [INSTANCES[0]["SubnetId"], INSTANCES[1]["SubnetId"]]}
+    ],
+    "ids": [{"Name": "instance-id", "Values": IDS[:5] + ["i-nothere"]}],
+    "wild-name": [{"Name": "tag:Name", "Values": ["*1?"]}],
+    "wild-env": [{"Name": "tag:env", "Values": ["p*"]}, {"Name": "instance-state-name", "Values": ["run*"]}],
+    "missing-tag": [{"Name": "tag:nothere", "Values": ["*"]}],
+}
+
+
+@pytest.fixture
+def inventory():
+    return Inventory.Inventory(EC2Instance.fromInstance(i) for i in INSTANCES)
+
+
+@pytest.mark.parametrize("name", sorted(FILTERS))
+def test_select_matches_describe_filters(inventory, name):
+    Filters = FILTERS[name]
+
+    selected = [i.InstanceId for i in inventory.select(Filters)]
+
+    assert selected == [i["InstanceId"] for i in INSTANCES if FakeEC2.matches(i, Filters)]
+
+
+def test_query_combines_conditions(inventory):
+    team = FakeEC2._TEAMS[0]
+    query = Inventory.Tag("team", team) & Inventory.State("stopped") & ~Inventory.AvailabilityZone(FakeEC2._AZS[0])
+    query |= Inventory.InstanceId(IDS[0])
+
+    found = {i.InstanceId for i in inventory.find(query)}
+
+    expected = {
+        i["InstanceId"] for i in INSTANCES
+        if FakeEC2.matches(i, FILTERS["team-stopped"]) and i["Placement"]["AvailabilityZone"] != FakeEC2._AZS[0]
+    }
+    assert found == expected | {IDS[0]}
+
+
+def test_update_moves_the_instance_between_index_values(inventory):
+    InstanceId = next(i["InstanceId"] for i in INSTANCES if i["State"]["Name"] == "stopped")
+
+    inventory.update(InstanceId, State={"Code": 16, "Name": "running"})
+
+    assert InstanceId in inventory.lookup(Inventory.STATE, "running")
+    assert InstanceId not in inventory.lookup(Inventory.STATE, "stopped")
+
+
+def test_unindexed_filter_is_rejected(inventory):
+    with pytest.raises(ValueError):
+        inventory.select([{"Name": "instance-type", "Values": ["t3.micro"]}])
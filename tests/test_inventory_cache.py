@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+################################################################################
+# InventoryCache against benchmarks/FakeEC2
+################################################################################
+import json
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "benchmarks")]
+
+import FakeEC2
+from aws_functions import ClientPool, InventoryCache
+
+
+FILTERS = [{"Name": "tag:env", "Values": ["dev"]}]
+
+
+@pytest.fixture
+def fake(tmp_path, monkeypatch):
+    fake = FakeEC2.FakeEC2(FakeEC2.makeFleet(20))
+    ClientPool.clearClients()
+    ClientPool.setClient(fake, "ec2")
+    monkeypatch.setattr(InventoryCache, "_DISK_DIR", str(tmp_path))
+    InventoryCache.configure(Disk=True)
+    yield fake
+    InventoryCache.configure()
+    ClientPool.clearClients()
+
+
+def _cacheFile(tmp_path):
+    names = [name for name in os.listdir(tmp_path) if name.endswith(".json")]
+    assert len(names) == 1
+    return tmp_path / names[0]
+
+
+@pytest.mark.parametrize("content", [
+    '{"key": "x", "expi',
+    '[1, 2, 3]',
+    '{"instances": []}',
+    None,
+])
+def test_broken_cache_file_is_a_miss(fake, tmp_path, content):
+    _, expected = InventoryCache.getEC2Instances(FILTERS)
+    path = _cacheFile(tmp_path)
+    if content is None:
+        # the right key with instances of the wrong shape
+        data = json.loads(path.read_text())
+        data["instances"] = [1, 2]
+        content = json.dumps(data)
+    path.write_text(content)
+    # a new module cache in the same container
+    InventoryCache.configure(Disk=True)
+    calls = fake.calls.get("describe_instances", 0)
+
+    ret, EC2InstanceList = InventoryCache.getEC2Instances(FILTERS)
+
+    assert ret == 0
+    assert [i.InstanceId for i in EC2InstanceList] == [i.InstanceId for i in expected]
+    assert fake.calls["describe_instances"] == calls + 1
+    # written again
+    assert json.loads(_cacheFile(tmp_path).read_text())["key"]
+
+
+def test_disk_hit(fake):
+    InventoryCache.getEC2Instances(FILTERS)
+    InventoryCache.configure(Disk=True)
+    calls = dict(fake.calls)
+
+    ret, EC2InstanceList = InventoryCache.getEC2Instances(FILTERS)
+
+    assert ret == 0
+    assert len(EC2InstanceList) > 0
+    assert fake.calls == calls
+
+
+def test_invalidate_drops_state_filtered_listings_only(fake):
+    InventoryCache.configure()
+    byState = [{"Name": "instance-state-name", "Values": ["stopped"]}]
+    # a tag value that merely contains the filter name
+    byTag = [{"Name": "tag:note", "Values": ["instance-state-name"]}]
+    InventoryCache.getEC2Instances(byState)
+    InventoryCache.getEC2Instances(byTag)
+    calls = fake.calls["describe_instances"]
+
+    InventoryCache.invalidate(["i-0000000000notlisted"])
+    InventoryCache.getEC2Instances(byTag)
+    assert fake.calls["describe_instances"] == calls
+    InventoryCache.getEC2Instances(byState)
+    assert fake.calls["describe_instances"] == calls + 1
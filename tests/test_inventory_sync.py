@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+################################################################################
+# InventorySync event application against benchmarks/FakeEC2
+################################################################################
+import os
+import sys
+import time
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "benchmarks")]
+
+import FakeEC2
+from aws_functions import ClientPool, InventoryCache, InventorySync, Transition
+
+
+FILTERS = [{"Name": "tag:env", "Values": ["dev"]}]
+STOPPED = [{"Name": "tag:env", "Values": ["dev"]}, {"Name": "instance-state-name", "Values": ["stopped"]}]
+
+
+def _env(instance):
+    return {t["Key"]: t["Value"] for t in instance["Tags"]}.get("env")
+
+
+@pytest.fixture
+def fake():
+    fake = FakeEC2.FakeEC2(FakeEC2.makeFleet(40, StoppedRatio=0.5))
+    ClientPool.clearClients()
+    ClientPool.setClient(fake, "ec2")
+    InventoryCache.configure()
+    InventorySync.clearSyncs()
+    yield fake
+    InventorySync.clearSyncs()
+    ClientPool.clearClients()
+
+
+def test_event_updates_state_without_listing(fake):
+    sync = InventorySync.getSync(FILTERS)
+    _, instances = sync.current()
+    calls = dict(fake.calls)
+    stopped = next(i.InstanceId for i in instances if i.stateName == "stopped")
+
+    assert sync.apply(InventorySync.makeEvent(stopped, "running"))
+    _, instances = sync.current()
+
+    assert {i.InstanceId: i.stateName for i in instances}[stopped] == "running"
+    assert fake.calls == calls
+
+
+def test_older_event_is_ignored(fake):
+    sync = InventorySync.getSync(FILTERS)
+    _, instances = sync.current()
+    InstanceId = instances[0].InstanceId
+    state = instances[0].stateName
+
+    assert not sync.apply(InventorySync.makeEvent(InstanceId, "terminated", Time=time.time() - 3600))
+    _, instances = sync.current()
+
+    assert {i.InstanceId: i.stateName for i in instances}[InstanceId] == state
+
+
+def test_state_filter_follows_events(fake):
+    sync = InventorySync.getSync(STOPPED)
+    _, instances = sync.current()
+    leaving = instances[0].InstanceId
+    # a running dev instance stops, it is not in the inventory yet
+    joining = next(
+        InstanceId for InstanceId, i in fake.instances.items()
+        if i["State"]["Name"] == "running" and _env(i) == "dev"
+    )
+    fake.instances[joining]["State"] = {"Code": 80, "Name": "stopped"}
+    fake.instances[leaving]["State"] = {"Code": 16, "Name": "running"}
+
+    sync.apply(InventorySync.makeEvent(leaving, "running"))
+    sync.apply(InventorySync.makeEvent(joining, "stopped"))
+    _, instances = sync.current()
+    InstanceIds = {i.InstanceId for i in instances}
+
+    assert leaving not in InstanceIds
+    assert joining in InstanceIds
+
+
+def test_instance_outside_filters_stays_out(fake):
+    sync = InventorySync.getSync(FILTERS)
+    sync.current()
+    other = next(InstanceId for InstanceId, i in fake.instances.items() if _env(i) != "dev")
+
+    ret, msg = InventorySync.handleEvent(InventorySync.makeEvent(other, "stopped"))
+    _, instances = sync.current()
+
+    assert ret == 0
+    assert other not in {i.InstanceId for i in instances}
+
+
+def test_not_a_state_change_event(fake):
+    ret, _ = InventorySync.handleEvent({"source": "aws.s3", "detail-type": "Object Created"})
+
+    assert ret == 2
+
+
+def test_incremental_run_checks_confirmed_instances(fake):
+    sync = InventorySync.getSync(FILTERS)
+    _, instances = sync.current()
+    running = next(i.InstanceId for i in instances if i.stateName == "running")
+    # it stopped but the event has not arrived yet
+    fake.instances[running]["State"] = {"Code": 80, "Name": "stopped"}
+
+    response = Transition.run(
+        {"Filters": FILTERS, "incremental": True, "minInstNum": 0, "maxInstNum": 40, "loglevel": "WARNING"},
+        "start"
+    )
+
+    assert response["statusCode"] == 200
+    assert running in response["body"]
+    assert fake.instances[running]["State"]["Name"] == "running"
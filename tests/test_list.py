@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+################################################################################
+# ListEC2 pagination against benchmarks/FakeEC2
+################################################################################
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "benchmarks")]
+
+import FakeEC2
+from aws_functions import ClientPool, InventoryCache, ListEC2
+
+
+FILTERS = [{"Name": "tag:env", "Values": ["prd", "stg"]}]
+
+
+@pytest.fixture
+def fake():
+    fake = FakeEC2.FakeEC2(FakeEC2.makeFleet(250))
+    ClientPool.clearClients()
+    ClientPool.setClient(fake, "ec2")
+    InventoryCache.configure()
+    yield fake
+    ClientPool.clearClients()
+
+
+def _matching(fake, Filters):
+    return sorted(
+        instance["InstanceId"]
+        for reservation in fake.reservations for instance in reservation["Instances"]
+        if FakeEC2.matches(instance, Filters)
+    )
+
+
+def test_pages_follow_next_token(fake):
+    pages = [page for _, page in ListEC2.iterEC2Instances(FILTERS, PageSize=10)]
+    InstanceIds = [i.InstanceId for page in pages for i in page]
+
+    assert len(pages) > 5
+    assert all(len(page) <= 10 for page in pages)
+    assert len(InstanceIds) == len(set(InstanceIds))
+    assert sorted(InstanceIds) == _matching(fake, FILTERS)
+    assert fake.calls["describe_instances"] == len(pages)
+
+
+def test_get_collects_every_page(fake):
+    ret, instances = ListEC2.getEC2Instances(FILTERS, MaxResults=7)
+
+    assert ret == 0
+    assert sorted(i.InstanceId for i in instances) == _matching(fake, FILTERS)
+
+
+def test_page_by_page(fake):
+    InstanceIds = []
+    NextToken = None
+    while True:
+        ret, page, NextToken = ListEC2.getEC2InstancePage(FILTERS, NextToken, PageSize=25)
+        assert ret == 0
+        InstanceIds += [i.InstanceId for i in page]
+        if NextToken is None:
+            break
+
+    assert sorted(InstanceIds) == _matching(fake, FILTERS)
+
+
+def test_failed_page_stops_the_iteration(fake):
+    pages = ListEC2.iterEC2Instances(FILTERS, PageSize=10)
+    next(pages)
+    fake.describe_instances = None
+
+    assert next(pages) == (2, None)
+    assert list(pages) == []
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+################################################################################
+# QueryPlanner against benchmarks/FakeEC2
+################################################################################
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "benchmarks")]
+
+import FakeEC2
+from aws_functions import ClientPool, InventoryCache, ListEC2, QueryPlanner
+
+
+@pytest.fixture
+def fake():
+    fake = FakeEC2.FakeEC2(FakeEC2.makeFleet(300))
+    ClientPool.clearClients()
+    ClientPool.setClient(fake, "ec2")
+    InventoryCache.configure()
+    yield fake
+    ClientPool.clearClients()
+
+
+def _sets(fake):
+    ids = sorted(fake.instances)
+    sets = {
+        "none": [],
+        "two-tag-keys": [{"Name": "tag-key", "Values": ["env"]}, {"Name": "tag-key", "Values": ["team"]}],
+        "tag-key-missing": [{"Name": "tag-key", "Values": ["env"]}, {"Name": "tag-key", "Values": ["nothere"]}],
+        "two-envs": [{"Name": "tag:env", "Values": ["prd", "stg"]}, {"Name": "tag:env", "Values": ["stg", "dev"]}],
+        "wild-name": [{"Name": "tag:Name", "Values": ["*1?"]}],
+        "wild-twice": [{"Name": "tag:Name", "Values": ["prd-*"]}, {"Name": "tag:Name", "Values": ["*-web-*"]}],
+        "wild-state": [{"Name": "instance-state-name", "Values": ["run*"]}, {"Name": "tag:env", "Values": ["dev"]}],
+        "empty": [{"Name": "tag:env", "Values": []}],
+        "ids": [{"Name": "instance-id", "Values": ids[:5] + ["i-nothere"]}],
+        "ids-twice": [{"Name": "instance-id", "Values": ids[:5]}, {"Name": "instance-id", "Values": ids[3:8]}],
+        "ids-running": [
+            {"Name": "instance-id", "Values": ids[10:30]},
+            {"Name": "instance-state-name", "Values": ["running"]}
+        ],
+        "type": [{"Name": "instance-type", "Values": ["t3.*"]}, {"Name": "tag:env", "Values": ["prd"]}],
+        "type-twice": [{"Name": "instance-type", "Values": ["t3.micro", "t3.large"]}, {"Name": "instance-type", "Values": ["t3.micro"]}],
+    }
+    for team in FakeEC2._TEAMS:
+        for env in FakeEC2._ENVS:
+            sets[f"{team}/{env}"] = [{"Name": "tag:team", "Values": [team]}, {"Name": "tag:env", "Values": [env]}]
+    return sets
+
+
+def test_run_returns_what_direct_calls_return(fake):
+    sets = _sets(fake)
+    # the set without filters would serve every other one
+    del sets["none"]
+
+    ret, result = QueryPlanner.run(sets)
+
+    assert ret == 0
+    assert result["Queries"] < len(sets)
+    for name, Filters in sets.items():
+        _, direct = ListEC2.getEC2Instances(Filters)
+        assert sorted(i.InstanceId for i in result["Results"][name]) == sorted(i.InstanceId for i in direct), name
+
+
+def test_each_set_alone_returns_what_a_direct_call_returns(fake):
+    # not served by a broader set, e.g. the one without filters
+    for name, Filters in _sets(fake).items():
+        _, result = QueryPlanner.run([Filters])
+        _, direct = ListEC2.getEC2Instances(Filters)
+        assert sorted(i.InstanceId for i in result["Results"][0]) == sorted(i.InstanceId for i in direct), name
+
+
+def test_plan_never_sends_empty_values(fake):
+    for Filters in _sets(fake).values():
+        for query in QueryPlanner.plan([Filters]):
+            assert all(f["Values"] for f in query["Filters"])
+
+
+def test_repeated_name_is_not_merged():
+    queries = QueryPlanner.plan([
+        [{"Name": "tag-key", "Values": ["env"]}, {"Name": "tag-key", "Values": ["team"]}],
+    ])
+
+    assert queries[0]["Filters"] == [
+        {"Name": "tag-key", "Values": ["env"]},
+        {"Name": "tag-key", "Values": ["team"]},
+    ]
+
+
+def test_sets_differing_in_one_name_share_a_query():
+    queries = QueryPlanner.plan([
+        [{"Name": "tag:team", "Values": ["a"]}, {"Name": "tag:env", "Values": ["prd"]}],
+        [{"Name": "tag:team", "Values": ["b"]}, {"Name": "tag:env", "Values": ["prd"]}],
+    ])
+
+    assert len(queries) == 1
+    assert {"Name": "tag:team", "Values": ["a", "b"]} in queries[0]["Filters"]
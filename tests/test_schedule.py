@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+################################################################################
+# Schedule compilation and evaluation
+################################################################################
+import datetime
+import os
+import sys
+import zoneinfo
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "benchmarks")]
+
+from aws_functions import Schedule
+from aws_functions.EC2Instance import EC2Instance
+
+
+# 2025-02-17 is a Monday
+MONDAY = datetime.date(2025, 2, 17)
+
+
+def _at(day, hour, minute=0, zone="UTC"):
+    """
+    Epoch seconds of day (0 is Monday) at hour:minute local time of zone
+    """
+    date = MONDAY + datetime.timedelta(days=day)
+    return datetime.datetime(date.year, date.month, date.day, hour, minute, tzinfo=zoneinfo.ZoneInfo(zone)).timestamp()
+
+
+@pytest.mark.parametrize("text, running, stopped", [
+    # weekdays, the end minute is out of the window
+    ("Mon-Fri 08:00-20:00", [(0, 8, 0), (2, 12, 0), (4, 19, 59)], [(0, 7, 59), (0, 20, 0), (5, 10, 0), (6, 10, 0)]),
+    # a range over the weekend
+    ("Fri-Mon 09:00-17:00", [(4, 9, 0), (5, 9, 0), (6, 16, 59), (0, 9, 0)], [(1, 9, 0), (3, 12, 0)]),
+    # "+" separated days and several windows
+    ("Mon+Wed 09:00-12:00 Sat 10:00-14:00", [(0, 9, 0), (2, 11, 59), (5, 13, 0)], [(1, 10, 0), (5, 9, 59), (6, 10, 0)]),
+    ("daily 00:00-24:00", [(0, 0, 0), (3, 12, 0), (6, 23, 59)], []),
+    # over midnight into the next day
+    ("Mon 22:00-06:00", [(0, 22, 0), (0, 23, 59), (1, 5, 59)], [(0, 21, 59), (1, 6, 0), (1, 22, 0)]),
+    # Sunday night runs into Monday morning
+    ("Sun 22:00-06:00", [(6, 23, 0), (0, 5, 0)], [(0, 6, 0), (6, 21, 0)]),
+])
+def test_compiled_windows(text, running, stopped):
+    schedule = Schedule.compileSchedule(text)
+
+    for day, hour, minute in running:
+        assert schedule.isRunning(_at(day, hour, minute)), (text, day, hour, minute)
+    for day, hour, minute in stopped:
+        assert not schedule.isRunning(_at(day, hour, minute)), (text, day, hour, minute)
+
+
+def test_windows_are_in_the_time_zone():
+    schedule = Schedule.compileSchedule("Mon-Fri 08:00-20:00 Asia/Tokyo")
+
+    # Monday 08:30 in Tokyo is Sunday 23:30 UTC
+    assert schedule.isRunning(_at(6, 23, 30))
+    assert schedule.isRunning(_at(0, 8, 30, "Asia/Tokyo"))
+    # Monday 12:00 UTC is 21:00 in Tokyo
+    assert not schedule.isRunning(_at(0, 12, 0))
+
+
+def test_windows_follow_daylight_saving_time():
+    schedule = Schedule.compileSchedule("Daily 08:00-09:00 Europe/Paris")
+
+    # UTC+1 in winter, UTC+2 in summer
+    assert schedule.isRunning(datetime.datetime(2025, 1, 15, 7, 30, tzinfo=datetime.timezone.utc).timestamp())
+    assert schedule.isRunning(datetime.datetime(2025, 7, 15, 6, 30, tzinfo=datetime.timezone.utc).timestamp())
+    assert not schedule.isRunning(datetime.datetime(2025, 7, 15, 7, 30, tzinfo=datetime.timezone.utc).timestamp())
+
+
+@pytest.mark.parametrize("text", [
+    "",
+    "Mon",
+    "Mon-Fri 08:00",
+    "Xyz 08:00-20:00",
+    "Mon-Xyz 08:00-20:00",
+    "Mon 25:00-26:00",
+    "Mon 08:60-09:00",
+    "Mon 08:00-08:00",
+    "Mon 8-20",
+    "Mon 08:00-20:00 Mars/Olympus",
+    "Mon-Fri 08:00-20:00 Asia/Tokyo extra",
+])
+def test_invalid_schedule_is_rejected(text):
+    with pytest.raises(ValueError):
+        Schedule.compileSchedule(text)
+
+
+def test_compiled_schedule_is_cached():
+    assert Schedule.compileSchedule("Mon-Fri 08:00-20:00 UTC") is Schedule.compileSchedule("Mon-Fri 08:00-20:00 UTC")
+
+
+def _instance(InstanceId, State, Text=None):
+    Tags = [{"Key": "Name", "Value": InstanceId}]
+    if Text is not None:
+        Tags.append({"Key": Schedule.TAG, "Value": Text})
+    return EC2Instance(InstanceId, State={"Code": 0, "Name": State}, Tags=Tags)
+
+
+def test_evaluate_plans_starts_and_stops():
+    instances = [
+        _instance("i-1", "stopped", "Mon-Fri 08:00-20:00"),
+        _instance("i-2", "running", "Mon-Fri 08:00-20:00"),
+        _instance("i-3", "running", "Sat 10:00-14:00"),
+        _instance("i-4", "stopped", "Sat 10:00-14:00"),
+        _instance("i-5", "running"),
+        _instance("i-6", "stopped", "Someday 10:00-14:00"),
+    ]
+
+    ret, plan = Schedule.evaluate(instances, Now=_at(0, 9, 0))
+
+    assert ret == 1
+    assert plan["Start"] == ["i-1"]
+    assert plan["Stop"] == ["i-3"]
+    assert plan["Schedules"] == 2
+    assert plan["Unscheduled"] == 1
+    assert plan["Invalid"] == {"Someday 10:00-14:00": ["i-6"]}
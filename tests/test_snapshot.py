@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+################################################################################
+# Snapshot write / read / diff of benchmarks/FakeEC2 fleets
+################################################################################
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "benchmarks")]
+
+import FakeEC2
+from aws_functions import Projection, Snapshot
+from aws_functions.EC2Instance import EC2Instance
+
+
+def _fleet(Size, **kwargs):
+    return [
+        EC2Instance.fromInstance(instance)
+        for reservation in FakeEC2.makeFleet(Size, **kwargs)
+        for instance in reservation["Instances"]
+    ]
+
+
+def test_read_returns_what_was_written(tmp_path):
+    instances = _fleet(50)
+    path = str(tmp_path / "fleet.ec2snap")
+
+    assert Snapshot.write(path, reversed(instances)) == 50
+    with Snapshot.Snapshot(path) as snapshot:
+        assert len(snapshot) == 50
+        assert [i.toDict() for i in snapshot] == [i.toDict() for i in instances]
+        assert snapshot.get(instances[7].InstanceId).toDict() == instances[7].toDict()
+        assert snapshot.get("i-nothere") is None
+        assert snapshot.states() == {i.InstanceId: i.stateName for i in instances}
+
+
+def test_missing_values_are_kept(tmp_path):
+    instances = [
+        EC2Instance("i-0000000000000000a"),
+        EC2Instance.fromDict({"InstanceId": "i-0000000000000000b", "KeyName": None, "Tags": None}),
+    ]
+    path = str(tmp_path / "missing.ec2snap")
+
+    Snapshot.write(path, instances)
+    with Snapshot.Snapshot(path) as snapshot:
+        first, second = list(snapshot)
+
+    assert first.KeyName == Projection.NA
+    assert first.stateName == Projection.NA
+    assert second.KeyName is None
+    assert second.Tags is None
+    assert second.toDict() == instances[1].toDict()
+
+
+def test_diff_reports_added_removed_and_state_changes(tmp_path):
+    old = _fleet(40, StoppedRatio=0.0)
+    new = [EC2Instance.fromDict(i.toDict()) for i in old[5:]] + _fleet(45, StoppedRatio=0.0)[40:]
+    new[0].State = {"Code": 80, "Name": "stopped"}
+    oldPath = str(tmp_path / "old.ec2snap")
+    newPath = str(tmp_path / "new.ec2snap")
+    Snapshot.write(oldPath, old)
+    Snapshot.write(newPath, new)
+
+    with Snapshot.Snapshot(oldPath) as a, Snapshot.Snapshot(newPath) as b:
+        result = Snapshot.diff(a, b)
+
+    assert result["Removed"] == [i.InstanceId for i in old[:5]]
+    assert result["Added"] == [i.InstanceId for i in new[35:]]
+    assert result["StateChanged"] == [(new[0].InstanceId, "running", "stopped")]
+
+
+def test_unchanged_missing_values_are_no_change(tmp_path):
+    instances = [EC2Instance.fromDict({"InstanceId": "i-0000000000000000a", "State": None, "KeyName": None})]
+    store = Snapshot.SnapshotStore(str(tmp_path))
+
+    store.record(instances)
+    ret, result = store.record(instances)
+
+    assert ret == 0
+    assert result == {"Added": [], "Removed": [], "StateChanged": []}
+    assert [state for _, state in store.history("i-0000000000000000a")] == [Projection.NA, Projection.NA]
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+################################################################################
+# Transition against benchmarks/FakeEC2
+################################################################################
+import os
+import sys
+import time
+
+import pytest
+from botocore.exceptions import ClientError
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "benchmarks")]
+
+import FakeEC2
+from aws_functions import ClientPool, InventoryCache, Transition
+
+
+FILTERS = [{"Name": "tag:env", "Values": ["prd", "stg", "dev"]}]
+
+
+class Refusing(FakeEC2.FakeEC2):
+    """
+    FakeEC2 refusing to start the instances of Refused
+    """
+
+    Refused = set()
+
+    def start_instances(self, InstanceIds, DryRun=False, **kwargs):
+        if self.Refused & set(InstanceIds):
+            raise ClientError(
+                {"Error": {"Code": "IncorrectInstanceState", "Message": "refused"}},
+                "StartInstances"
+            )
+        return super().start_instances(InstanceIds, DryRun=DryRun, **kwargs)
+
+
+@pytest.fixture
+def fake():
+    fake = Refusing(FakeEC2.makeFleet(40))
+    ClientPool.clearClients()
+    ClientPool.setClient(fake, "ec2")
+    InventoryCache.configure()
+    yield fake
+    Refusing.Refused = set()
+    ClientPool.clearClients()
+
+
+def test_start_runs_every_stopped_instance(fake):
+    response = Transition.run({"Filters": FILTERS, "minInstNum": 0, "maxInstNum": 40, "loglevel": "WARNING"}, "start")
+
+    assert response["body"].startswith("Scceeded")
+    assert all(i["State"]["Name"] == "running" for i in fake.instances.values())
+
+
+def test_failed_act_is_not_waited_for(fake):
+    refused = next(InstanceId for InstanceId, i in fake.instances.items() if i["State"]["Name"] == "stopped")
+    Refusing.Refused = {refused}
+
+    started = time.monotonic()
+    response = Transition.run(
+        {"Filters": FILTERS, "minInstNum": 0, "maxInstNum": 40, "interval": 30, "loglevel": "CRITICAL"},
+        "start"
+    )
+
+    assert time.monotonic() - started < 10
+    assert response["body"].startswith("Failed")
+    assert fake.instances[refused]["State"]["Name"] == "stopped"
+    others = [i for InstanceId, i in fake.instances.items() if InstanceId != refused]
+    assert all(i["State"]["Name"] == "running" for i in others)
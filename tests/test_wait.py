@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+################################################################################
+# VerifyEC2 / WaitEC2 against benchmarks/FakeEC2
+################################################################################
+import os
+import sys
+import time
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "benchmarks")]
+
+import FakeEC2
+from aws_functions import ClientPool, VerifyEC2, WaitEC2
+
+
+@pytest.fixture
+def fake():
+    fake = FakeEC2.FakeEC2(FakeEC2.makeFleet(250))
+    ClientPool.clearClients()
+    ClientPool.setClient(fake, "ec2")
+    yield fake
+    ClientPool.clearClients()
+
+
+def test_bad_id_does_not_hide_the_others(fake):
+    ids = sorted(fake.instances)
+    bad = "i-0000000000badbad"
+
+    ret, states = VerifyEC2.getInstanceStates(ids[:120] + [bad] + ids[120:])
+
+    assert ret == 0
+    assert states[bad] == VerifyEC2.NOT_FOUND
+    assert all(states[InstanceId] == fake.instances[InstanceId]["State"]["Name"] for InstanceId in ids)
+
+
+def test_missing_id_stops_the_wait(fake):
+    InstanceId = next(InstanceId for InstanceId, i in fake.instances.items() if i["State"]["Name"] == "running")
+
+    started = time.monotonic()
+    ret, states = WaitEC2.waitForState([InstanceId, "i-0000000000badbad"], "running", Timeout=30)
+
+    assert time.monotonic() - started < 5
+    assert ret == 2
+    assert states["i-0000000000badbad"] == VerifyEC2.NOT_FOUND
+
+
+def test_wait_returns_on_convergence(fake):
+    stopped = [InstanceId for InstanceId, i in fake.instances.items() if i["State"]["Name"] == "stopped"][:5]
+    fake.start_instances(InstanceIds=stopped)
+
+    ret, states = WaitEC2.waitForState(stopped, "running", Timeout=30, Delay=0.01)
+
+    assert ret == 0
+    assert set(states.values()) == {"running"}
+
+
+def test_failed_poll_stops_the_wait(fake, monkeypatch):
+    def denied(**kwargs):
+        raise RuntimeError("UnauthorizedOperation")
+    monkeypatch.setattr(fake, "describe_instance_status", denied)
+
+    started = time.monotonic()
+    ret, _ = WaitEC2.waitForState(sorted(fake.instances)[:3], "running", Timeout=30)
+
+    assert time.monotonic() - started < 5
+    assert ret == 2
+
+
+def test_only_the_pending_ids_are_polled(fake, monkeypatch):
+    running = [InstanceId for InstanceId, i in fake.instances.items() if i["State"]["Name"] == "running"][:3]
+    pending = running[0]
+    _setState(fake, pending, "pending")
+    polled = []
+    describe = fake.describe_instance_status
+
+    def recording(InstanceIds, **kwargs):
+        polled.append(sorted(InstanceIds))
+        if len(polled) == 3:
+            _setState(fake, pending, "running")
+        return describe(InstanceIds=InstanceIds, **kwargs)
+    monkeypatch.setattr(fake, "describe_instance_status", recording)
+
+    ret, states = WaitEC2.waitForState(running, "running", Timeout=30, Delay=0.01)
+
+    assert ret == 0
+    assert states == {InstanceId: "running" for InstanceId in running}
+    assert polled == [sorted(running), [pending], [pending]]
+
+
+@pytest.mark.parametrize("TargetState, diverging", [("running", "stopping"), ("stopped", "pending")])
+def test_diverging_state_stops_the_wait(fake, TargetState, diverging):
+    InstanceId = sorted(fake.instances)[0]
+    _setState(fake, InstanceId, diverging)
+
+    started = time.monotonic()
+    ret, states = WaitEC2.waitForState([InstanceId], TargetState, Timeout=30)
+
+    assert time.monotonic() - started < 5
+    assert ret == 2
+    assert states[InstanceId] == diverging
+
+
+def _setState(fake, InstanceId, Name):
+    fake.instances[InstanceId]["State"] = {"Code": 0, "Name": Name}
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+################################################################################
+# WaveEC2 against benchmarks/FakeEC2
+################################################################################
+import os
+import sys
+import time
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "benchmarks")]
+
+import FakeEC2
+from aws_functions import ClientPool, InventoryCache, ListEC2, Transition, WaveEC2
+
+
+FILTERS = [{"Name": "tag:env", "Values": ["prd"]}]
+# Name, additional tags
+FLEET = [
+    ("DC01", {"StartOrder": "1"}),
+    ("DC02", {"StartOrder": "1"}),
+    ("DB01", {"StartOrder": "2"}),
+    ("APP01", {"DependsOn": "DB01"}),
+    ("APP02", {"DependsOn": "DB01+DC01"}),
+    ("WEB01", {"DependsOn": "APP01 APP02"}),
+    ("LONE", {}),
+]
+
+
+def _setup(tags, StoppedRatio=1.0):
+    fleet = FakeEC2.makeFleet(len(tags), StoppedRatio=StoppedRatio)
+    for reservation in fleet:
+        for instance in reservation["Instances"]:
+            name, extra = tags[int(instance["InstanceId"][2:], 16)]
+            instance["Tags"] = [{"Key": "Name", "Value": name}, {"Key": "env", "Value": "prd"}]
+            instance["Tags"] += [{"Key": k, "Value": v} for k, v in extra.items()]
+    fake = FakeEC2.FakeEC2(fleet)
+    ClientPool.clearClients()
+    ClientPool.setClient(fake, "ec2")
+    InventoryCache.configure()
+    return fake
+
+
+@pytest.fixture(autouse=True)
+def clients():
+    yield
+    ClientPool.clearClients()
+
+
+def _instances():
+    _, instances = ListEC2.getEC2Instances(FILTERS)
+    return instances, {i.InstanceId: i.name for i in instances}
+
+
+def test_start_follows_start_order_and_depends_on():
+    _setup(FLEET)
+    instances, names = _instances()
+
+    ret, report = WaveEC2.start(instances, Delay=0.01)
+
+    assert ret == 0
+    assert [sorted(names[i] for i in wave) for wave in report["Waves"]] == [
+        ["DC01", "DC02", "LONE"], ["DB01"], ["APP01", "APP02"], ["WEB01"]
+    ]
+    order = [names[i] for i in report["InstanceIds"]]
+    for before, after in [("DC01", "DB01"), ("DC02", "DB01"), ("DB01", "APP01"), ("DB01", "APP02"),
+                          ("APP01", "WEB01"), ("APP02", "WEB01")]:
+        assert order.index(before) < order.index(after)
+    ready = {names[i]: seconds for i, seconds in report["ReadySeconds"].items()}
+    assert ready["DB01"] <= ready["APP01"] <= ready["WEB01"]
+
+
+def test_stop_runs_in_reverse():
+    _setup(FLEET, StoppedRatio=0.0)
+    instances, names = _instances()
+
+    ret, report = WaveEC2.stop(instances, Delay=0.01, MaxInFlight=2)
+
+    assert ret == 0
+    order = [names[i] for i in report["InstanceIds"]]
+    assert order.index("WEB01") < order.index("APP01") < order.index("DB01") < order.index("DC01")
+
+
+def test_failed_dependency_skips_its_dependents():
+    fake = _setup(FLEET)
+    instances, names = _instances()
+    db = next(i for i, name in names.items() if name == "DB01")
+    fake.instances[db]["State"] = {"Code": 48, "Name": "terminated"}
+    instances, _ = _instances()
+
+    ret, report = WaveEC2.start(instances, Delay=0.01)
+
+    assert ret == 1
+    assert list(report["Failed"]) == [db]
+    assert sorted(names[i] for i in report["Skipped"]) == ["APP01", "APP02", "WEB01"]
+
+
+def test_cycle_is_rejected():
+    fake = _setup([("A", {"DependsOn": "B"}), ("B", {"DependsOn": "A"})])
+    instances, _ = _instances()
+
+    ret, report = WaveEC2.start(instances)
+
+    assert ret == 2
+    assert "cycle" in report["Error"]
+    assert all(i["State"]["Name"] == "stopped" for i in fake.instances.values())
+
+
+@pytest.mark.parametrize("kwargs", [{"MaxInFlight": 0}, {"MaxInFlight": -1}, {"Stagger": -1}])
+def test_invalid_limits_fail_at_once(kwargs):
+    _setup(FLEET)
+    instances, _ = _instances()
+
+    started = time.monotonic()
+    ret, report = WaveEC2.start(instances, Timeout=30, **kwargs)
+
+    assert time.monotonic() - started < 1
+    assert ret == 2
+    assert report["InstanceIds"] == []
+
+
+@pytest.mark.parametrize("key, value", [("maxInFlight", 0), ("stagger", -1)])
+def test_event_with_invalid_limits_is_rejected(key, value):
+    _setup(FLEET)
+
+    response = Transition.run(
+        {"Filters": FILTERS, "minInstNum": 0, "maxInstNum": 10, "wave": True, key: value, "loglevel": "CRITICAL"},
+        "start"
+    )
+
+    assert response["body"] == f"Invalid {key}: {value}"
+
+
+def test_waves_and_verify_share_the_interval(monkeypatch):
+    _setup(FLEET)
+    waits = []
+    waitForState = Transition.WaitEC2.waitForState
+
+    def recording(InstanceIds, TargetState, Timeout, **kwargs):
+        waits.append(Timeout)
+        return waitForState(InstanceIds, TargetState, Timeout=Timeout, **kwargs)
+    monkeypatch.setattr(Transition.WaitEC2, "waitForState", recording)
+
+    transition = Transition.Transition("start", FILTERS, 0, 10, interval=30, wave=True)
+    ret, _ = transition.run()
+
+    assert ret == 0
+    assert len(waits) == 1
+    assert waits[0] < 30